@@ -0,0 +1,75 @@
+"""Latency of the NER prompt with similarity-based example selection, for a large example library.
+
+The booking examples are replicated with word variations to reach `--examples` examples.
+poetry run python -m benchmarks.bench_example_selection
+"""
+import argparse
+import random
+import time
+
+import yaml
+
+from lib.ner.entities.basic_entities import EntityExample
+from lib.ner.ner_prompt_template import NERPromptTemplate
+
+from .bench_session_creation import ENTITIES, EXAMPLES_PATH
+
+WORDS = "please thanks maybe actually so well um right okay great sure also".split()
+QUERIES = [
+    ("What is your phone number?", "it's 514 666 7777"),
+    ("When are you available?", "next tuesday afternoon works for me"),
+    ("Is everything correct?", "yes but my last name is Smith"),
+    ("What is your first name?", "I'm Jenny"),
+]
+
+
+def make_examples(count: int) -> list[EntityExample]:
+    raw_examples = yaml.safe_load(open(EXAMPLES_PATH))
+    examples = []
+    while len(examples) < count:
+        raw = random.choice(raw_examples)
+        text = " ".join([random.choice(WORDS), raw["text"], random.choice(WORDS)])
+        examples.append(EntityExample.parse_obj({**raw, "text": text}))
+    return examples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--examples", type=int, default=5000)
+    parser.add_argument("--max-examples", type=int, default=10)
+    parser.add_argument("--token-budget", type=int, default=600)
+    parser.add_argument("--calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    examples = make_examples(args.examples)
+    start = time.perf_counter()
+    template = NERPromptTemplate(
+        input_variables=["input", "history"],
+        entities=ENTITIES,
+        examples=examples,
+        max_examples=args.max_examples,
+        example_token_budget=args.token_budget,
+    )
+    print(f"built for {len(examples)} examples in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    queries = [f"{context}\n{text}" for context, text in QUERIES]
+    start = time.perf_counter()
+    for i in range(args.calls):
+        template.select_examples(queries[i % len(queries)])
+    selection = (time.perf_counter() - start) / args.calls
+    start = time.perf_counter()
+    for i in range(args.calls):
+        context, text = QUERIES[i % len(QUERIES)]
+        prompt = template.format(input=text, history=f"AI: {context}")
+    formatting = (time.perf_counter() - start) / args.calls
+    print(f"select_examples(): {selection * 1e6:.0f} µs")
+    print(f"format():          {formatting * 1e6:.0f} µs, prompt of {len(prompt)} characters")
+    all_examples = NERPromptTemplate(
+        input_variables=["input", "history"], entities=ENTITIES, examples=examples
+    ).format(input=text, history=f"AI: {context}")
+    print(f"prompt with all the examples: {len(all_examples)} characters")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Turns per second with and without `BatchingLLM` in front of a batch-capable NER model.
+
+The fake NER model takes `--request-overhead` seconds per call plus `--prompt-cost`
+seconds per prompt and serves one call at a time, like a self-hosted completion model
+running the prompts of a call as one batch.
+
+poetry run python -m benchmarks.bench_ner_batching --clients 32
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, List, Optional
+
+from langchain.schema import Generation, LLMResult
+
+from lib.ner.batching import BatchingLLM
+from lib.session import SessionManager
+
+from .bench_server import TURNS, FakeLLM, make_blueprint, quiet_loggers
+
+
+class FakeBatchLLM(FakeLLM):
+    """Serve one request at a time, like a model on a single GPU."""
+
+    request_overhead: float = 0.05
+    prompt_cost: float = 0.002
+    busy: Any = None
+
+    async def _agenerate(
+        self, prompts: List[str], stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> LLMResult:
+        self.busy = self.busy or asyncio.Lock()
+        async with self.busy:
+            await asyncio.sleep(self.request_overhead + self.prompt_cost * len(prompts))
+        return LLMResult(generations=[[Generation(text=self.answer(p))] for p in prompts])
+
+
+async def turns_per_second(sessions: SessionManager, clients: int, seconds: float) -> float:
+    async def client(client_id: int, deadline: float) -> int:
+        turns = conversation = 0
+        while time.perf_counter() < deadline:
+            session = sessions.get(f"{client_id}-{conversation}")
+            for turn in TURNS:
+                await session.acall(turn)
+                turns += 1
+            sessions.drop(session.session_id)
+            conversation += 1
+        return turns
+
+    start = time.perf_counter()
+    counts = await asyncio.gather(*[client(i, start + seconds) for i in range(clients)])
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--request-overhead", type=float, default=0.05)
+    parser.add_argument("--prompt-cost", type=float, default=0.002)
+    parser.add_argument("--max-wait", type=float, default=0.01)
+    args = parser.parse_args()
+    quiet_loggers()
+
+    for batched in (False, True):
+        llm = FakeBatchLLM(request_overhead=args.request_overhead, prompt_cost=args.prompt_cost)
+        if batched:
+            llm = BatchingLLM(llm=llm, max_wait=args.max_wait, max_batch_size=args.clients)
+        sessions = SessionManager(make_blueprint(ner_llm=llm), max_sessions=None)
+        rate = asyncio.run(turns_per_second(sessions, args.clients, args.seconds))
+        print(f"{'batched' if batched else 'direct':>8}: {rate:>8.0f} turns/s")
+    print(llm.stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""CPU time of `ProcessPromptTemplate.format()`, with and without compiled templates reused.
+
+poetry run python -m benchmarks.bench_process_prompt_format
+"""
+import argparse
+import logging
+import time
+from typing import Callable
+
+from lib import templates
+from lib.process.process_prompt_template import ProcessPromptTemplate
+
+from .bench_session_creation import BookingProcess
+
+KWARGS = {
+    "input": "I am available on Thursday",
+    "history": "User: Hi\nAI: Hello, when are you available?\nUser: I am available on Thursday",
+    "variables": {"availability": None, "first_name": "John", "errors": None},
+    "diff": [{"name": "first_name", "operation": "added", "value": "John"}],
+}
+
+
+def calls_per_second(call: Callable[[], object], seconds: float) -> float:
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        call()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    logging.getLogger("lib.process.process_prompt_template").setLevel(logging.INFO)
+    template = ProcessPromptTemplate(process=BookingProcess, validate_template=False)
+
+    def format_uncached():
+        # Every template is compiled again, as with `Template(source)` on each call
+        templates._compile.cache_clear()
+        template.format(**KWARGS)
+
+    before = calls_per_second(format_uncached, args.seconds)
+    after = calls_per_second(lambda: template.format(**KWARGS), args.seconds)
+    print(f"format() compiling templates: {before:>10.0f} calls/s ({1e6 / before:.1f} µs)")
+    print(f"format() cached templates:    {after:>10.0f} calls/s ({1e6 / after:.1f} µs)")
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
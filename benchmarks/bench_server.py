@@ -0,0 +1,162 @@
+"""Load test of `ChatServer` against fake LLMs: turns per second and latency percentiles.
+
+Clients run conversations concurrently by calling the ASGI application in process, so
+the numbers are those of the server on a single core without the network. Run with
+`--serve` to start it with uvicorn instead and load test it with an HTTP tool.
+
+poetry run python -m benchmarks.bench_server --clients 64 --llm-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Any, List, Optional
+
+from langchain.base_language import BaseLanguageModel
+from langchain.llms.base import LLM
+from pydantic import Field
+
+from lib.ner.entities.basic_entities import Entity, EntityExample, IntEntity
+from lib.process.blueprint import ProcessChainBlueprint
+from lib.process.schemas import Process
+from lib.server import ChatServer, serve
+
+TURNS = ["Hello", "I'm Nathan", "I'm 42", "Thanks"]
+
+ENTITIES = {
+    "I'm Nathan": [{"name": "first_name", "value": "Nathan"}],
+    "I'm 42": [{"name": "age", "value": "42"}],
+}
+
+
+class FakeLLM(LLM):
+    """Answer after `latency` seconds, with the entities of the user text for NER prompts."""
+
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def answer(self, prompt: str) -> str:
+        if prompt.rstrip().endswith("entities:"):
+            text = prompt.rstrip().splitlines()[-2].removeprefix("text: ")
+            return json.dumps(ENTITIES.get(text, []))
+        return "Sure, noted."
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        time.sleep(self.latency)
+        return self.answer(prompt)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        await asyncio.sleep(self.latency)
+        return self.answer(prompt)
+
+
+class FormProcess(Process):
+    first_name: Optional[str] = Field(
+        title="First name", description="First name", question="What is your first name?"
+    )
+    age: Optional[int] = Field(title="Age", description="Age", question="What is your age?")
+
+
+def make_blueprint(
+    llm_latency: float = 0.0, ner_llm: Optional[BaseLanguageModel] = None
+) -> ProcessChainBlueprint:
+    llm = FakeLLM(latency=llm_latency)
+    return ProcessChainBlueprint(
+        ner_llm=ner_llm or llm,
+        chat_llm=llm,
+        process=FormProcess,
+        entities={"first_name": Entity, "age": IntEntity},
+        entity_examples=[
+            EntityExample.parse_obj(
+                {"text": "I'm Bob", "entities": [{"name": "first_name", "value": "Bob"}]}
+            )
+        ],
+        verbose=False,
+    )
+
+
+def make_server(llm_latency: float, max_concurrency: int) -> ChatServer:
+    blueprint = make_blueprint(llm_latency)
+    return ChatServer(blueprint, max_concurrency=max_concurrency, max_sessions=None)
+
+
+async def request(app: ChatServer, method: str, path: str, body: Optional[dict] = None) -> int:
+    messages = [{"type": "http.request", "body": json.dumps(body).encode() if body else b""}]
+    status = 0
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app({"type": "http", "method": method, "path": path}, receive, send)
+    return status
+
+
+async def client(app: ChatServer, client_id: int, deadline: float, latencies: list[float]):
+    conversation = 0
+    while time.perf_counter() < deadline:
+        session_id = f"{client_id}-{conversation}"
+        await request(app, "POST", "/sessions", {"session_id": session_id})
+        for turn in TURNS:
+            start = time.perf_counter()
+            status = await request(
+                app, "POST", f"/sessions/{session_id}/turns", {"input": turn}
+            )
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+        await request(app, "DELETE", f"/sessions/{session_id}")
+        conversation += 1
+
+
+def percentile(values: list[float], p: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * p))]
+
+
+async def load_test(app: ChatServer, clients: int, seconds: float) -> None:
+    latencies: list[float] = []
+    deadline = time.perf_counter() + seconds
+    start, cpu_start = time.perf_counter(), time.process_time()
+    await asyncio.gather(*[client(app, i, deadline, latencies) for i in range(clients)])
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    print(f"turns:          {len(latencies):>10}")
+    print(f"turns/s:        {len(latencies) / elapsed:>10.0f}")
+    print(f"turns/cpu-s:    {len(latencies) / cpu:>10.0f}")
+    print(f"p50 latency:    {percentile(latencies, 0.5) * 1000:>10.1f} ms")
+    print(f"p99 latency:    {percentile(latencies, 0.99) * 1000:>10.1f} ms")
+
+
+def quiet_loggers() -> None:
+    # Each turn logs its variables at the DEBUG level
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("lib."):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per LLM call")
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument("--serve", action="store_true", help="serve with uvicorn instead")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    quiet_loggers()
+    app = make_server(args.llm_latency, args.max_concurrency)
+    if args.serve:
+        serve(app, port=args.port)
+    else:
+        asyncio.run(load_test(app, args.clients, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Sessions created per second, building a `ProcessChain` per session vs. from a blueprint.
+
+poetry run python -m benchmarks.bench_session_creation
+"""
+import argparse
+import os
+import time
+from typing import Callable, Optional
+
+import yaml
+from langchain.llms.fake import FakeListLLM
+from pydantic import Field
+
+from lib.conversation_memory import ConversationMemory
+from lib.ner.entities.basic_entities import BooleanEntity, Entity, EntityExample
+from lib.ner.entities.datetime_entity import DateTimeEntity
+from lib.process.blueprint import ProcessChainBlueprint
+from lib.process.process_chain import ProcessChain
+from lib.process.schemas import Process
+
+EXAMPLES_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "examples",
+    "appointment_booking",
+    "booking_bot_entity_examples.yaml",
+)
+
+ENTITIES = {
+    "availability": DateTimeEntity,
+    "first_name": Entity,
+    "last_name": Entity,
+    "phone_number": Entity,
+    "confirmation": BooleanEntity,
+}
+
+
+class BookingProcess(Process):
+    availability: Optional[dict | str] = Field(
+        title="Availability", description="Availability", question="When are you available?"
+    )
+    first_name: Optional[str] = Field(
+        title="First name", description="First name", question="What is your first name?"
+    )
+    last_name: Optional[str] = Field(
+        title="Last name", description="Last name", question="What is your last name?"
+    )
+    phone_number: Optional[str] = Field(
+        title="Phone number", description="Phone number", question="What is your phone number?"
+    )
+    confirmation: Optional[bool] = Field(
+        title="Confirmation", description="Confirmation", question="Is everything correct?"
+    )
+
+
+def sessions_per_second(create: Callable[[], ProcessChain], seconds: float) -> float:
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        create()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    raw_examples = yaml.safe_load(open(EXAMPLES_PATH))
+    llm = FakeListLLM(responses=["[]"])
+    config = dict(
+        ner_llm=llm,
+        chat_llm=llm,
+        process=BookingProcess,
+        entities=ENTITIES,
+        verbose=False,
+    )
+
+    def build_chain() -> ProcessChain:
+        return ProcessChain(
+            **config,
+            entity_examples=[EntityExample.parse_obj(e) for e in raw_examples],
+            memory=ConversationMemory(),
+        )
+
+    blueprint = ProcessChainBlueprint(**config, entity_examples=raw_examples)
+
+    before = sessions_per_second(build_chain, args.seconds)
+    after = sessions_per_second(blueprint.new_session, args.seconds)
+    print(f"ProcessChain(...) per session:  {before:>10.0f} sessions/s ({1e6 / before:.1f} µs)")
+    print(f"blueprint.new_session():        {after:>10.0f} sessions/s ({1e6 / after:.1f} µs)")
+    print(f"speedup: {after / before:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Slot matching over 100k slots, linear scan vs. `SlotIndex`.
+
+poetry run python -m benchmarks.bench_slot_index
+"""
+import argparse
+import datetime
+import random
+import time
+from typing import Callable
+
+from lib.availability.slot_index import Slot, SlotIndex
+
+START = datetime.datetime(2023, 7, 3)
+
+
+def make_slots(count: int, resources: int) -> list[Slot]:
+    # 15 minutes slots over the opening hours, spread across the resources
+    slots = []
+    i = 0
+    while len(slots) < count:
+        day, quarter = divmod(i, 40)
+        start = START + datetime.timedelta(days=day, hours=9, minutes=15 * quarter)
+        slots.extend(Slot(start, f"resource-{r}") for r in range(resources))
+        i += 1
+    return slots[:count]
+
+
+def make_queries(slots: list[Slot], count: int) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    last = max(s.start for s in slots)
+    queries = []
+    for _ in range(count):
+        start = START + (last - START) * random.random()
+        queries.append((start, start + datetime.timedelta(hours=random.choice([1, 24]))))
+    return queries
+
+
+def per_second(run: Callable[[], object], calls: int) -> float:
+    start = time.perf_counter()
+    run()
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slots", type=int, default=100_000)
+    parser.add_argument("--resources", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+    slots = make_slots(args.slots, args.resources)
+    queries = make_queries(slots, args.queries)
+
+    start = time.perf_counter()
+    index = SlotIndex(slots)
+    print(f"index build: {(time.perf_counter() - start) * 1000:.0f} ms for {len(index)} slots")
+
+    def scan():
+        for start, end in queries:
+            [s for s in slots if start <= s.start < end]
+
+    def query():
+        for start, end in queries:
+            index.between(start, end)
+
+    def nearest():
+        for start, _ in queries:
+            index.nearest(start, 3)
+
+    def book():
+        for slot in random.sample(slots, args.queries):
+            index.remove(slot)
+            index.add(slot)
+
+    linear = per_second(scan, len(queries))
+    indexed = per_second(query, len(queries))
+    print(f"range query, linear scan: {linear:>10.0f} queries/s")
+    print(f"range query, SlotIndex:   {indexed:>10.0f} queries/s ({indexed / linear:.0f}x)")
+    print(f"nearest 3 slots:          {per_second(nearest, len(queries)):>10.0f} queries/s")
+    print(f"remove + add:             {per_second(book, args.queries):>10.0f} bookings/s")
+
+
+if __name__ == "__main__":
+    main()
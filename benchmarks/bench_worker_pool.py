@@ -0,0 +1,65 @@
+"""Turns per second of a `WorkerPool` against a fake LLM, from 1 worker to one per core.
+
+poetry run python -m benchmarks.bench_worker_pool --max-workers 4
+"""
+import argparse
+import asyncio
+import functools
+import os
+import time
+
+from lib.workers import WorkerPool
+
+from .bench_server import TURNS, make_blueprint, quiet_loggers
+
+
+def quiet_blueprint(llm_latency: float):
+    quiet_loggers()
+    return make_blueprint(llm_latency)
+
+
+async def client(pool: WorkerPool, client_id: int, deadline: float) -> int:
+    turns = 0
+    conversation = 0
+    while time.perf_counter() < deadline:
+        session_id = f"{client_id}-{conversation}"
+        for turn in TURNS:
+            await pool.arun(session_id, turn)
+            turns += 1
+        pool.drop(session_id)
+        conversation += 1
+    return turns
+
+
+async def turns_per_second(pool: WorkerPool, clients: int, seconds: float) -> float:
+    # Warm up the workers, which import the libraries on start
+    await asyncio.gather(*[pool.arun(f"warmup-{i}", "Hello") for i in range(len(pool) * 4)])
+    start = time.perf_counter()
+    counts = await asyncio.gather(
+        *[client(pool, i, start + seconds) for i in range(clients)]
+    )
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--clients", type=int, default=128)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per LLM call")
+    args = parser.parse_args()
+
+    quiet_loggers()
+    factory = functools.partial(quiet_blueprint, args.llm_latency)
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        with WorkerPool(factory, workers=workers, max_sessions=None) as pool:
+            rate = asyncio.run(turns_per_second(pool, args.clients, args.seconds))
+        baseline = baseline or rate
+        print(f"{workers:>3} workers: {rate:>8.0f} turns/s ({rate / baseline:.1f}x)")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
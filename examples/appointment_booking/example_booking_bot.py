@@ -7,13 +7,19 @@ import yaml
 from langchain.chat_models import ChatOpenAI
 from pydantic import Field, ValidationError, root_validator, validator
 
+from lib.availability.providers import (
+    AvailabilityProvider,
+    CachedAvailabilityProvider,
+    InMemoryAvailabilityProvider,
+)
 from lib.bot import gradio_bot
 from lib.conversation_memory import ConversationMemory
 from lib.logger_config import setup_logger
 from lib.ner.entities.basic_entities import BooleanEntity, Entity, EntityExample
 from lib.ner.entities.datetime_entity import DateTimeEntity
+from lib.ner.extractors import PhoneNumberExtractor
 from lib.process.process_chain import ProcessChain
-from lib.process.schemas import Process
+from lib.process.schemas import Process, derived
 
 logger = setup_logger(__name__)
 # Some calendar availability the bot can use
@@ -45,6 +51,10 @@ class AppointmentBookingProcess(Process):
         now + datetime.timedelta(days=9, hours=19),
         now + datetime.timedelta(days=10, hours=2),
     ]
+    # Use a `SQLiteAvailabilityProvider` to share the calendar between workers
+    salon_calendar: ClassVar[AvailabilityProvider] = CachedAvailabilityProvider(
+        InMemoryAvailabilityProvider(salon_available_slots)
+    )
 
     # The process description will be injected in the prompt template.
     process_description = f"""
@@ -98,23 +108,34 @@ To all other questions reply you don't know.
         description="We need a confirmation to make sure we have the right information before we book.",
     )
 
-    matching_slots_in_human_friendly_format: Optional[str] = Field(
-        title="Matching slots in human frendly format",
+    # Salon slots matching the User availability, formatted only when a question or an
+    # error message refers to `matching_slots_in_human_friendly_format`.
+    matching_slots: Optional[list[str]] = Field(
+        title="Matching slots ISO datetimes",
     )
 
     errors_count: Optional[int] = 0
 
+    # Only validate again what the User changed during the turn
+    incremental_validation = True
+    dependencies = {"validate": ["availability", "phone_number"]}
+
     @classmethod
     def get_matching_slots(cls, availability: dict):
         start = datetime.datetime.fromisoformat(availability["start"])
         end = datetime.datetime.fromisoformat(availability["end"])
-        available_slots = []
-
-        for slot in cls.salon_available_slots:
-            if start <= slot < end:
-                available_slots.append(slot)
-
-        return available_slots
+        return [slot.start for slot in cls.salon_calendar.between(start, end)]
+
+    @derived
+    def matching_slots_in_human_friendly_format(cls, variables) -> str:
+        slots = [
+            datetime.datetime.fromisoformat(slot)
+            for slot in variables.get("matching_slots") or []
+        ]
+        # Without matching slots, let's offer some of the salon's availability
+        return cls.slots_in_human_friendly_format(
+            slots or random.sample(cls.salon_available_slots, 3)
+        )
 
     @classmethod
     def slots_in_human_friendly_format(cls, slots: list[datetime.datetime]):
@@ -139,13 +160,6 @@ To all other questions reply you don't know.
     @root_validator(pre=True)
     def validate(cls, values: dict):
         values["errors"] = {}
-        # Let's define a default value in case no availability is provided yet or
-        # there is no matching slot between the Nathan's availability and the salon's availability
-        values[
-            "matching_slots_in_human_friendly_format"
-        ] = cls.slots_in_human_friendly_format(
-            random.sample(cls.salon_available_slots, 3)
-        )
         if values.get("availability") is not None:
             # The grain of a datetime can be just one minute. We want to make sure we have at least 15 minutes
             if values["availability"]["grain"]  < 15 * 60:
@@ -158,12 +172,12 @@ To all other questions reply you don't know.
 
             if len(matching_slots) == 0:
                 logger.debug("No matching slot found")
-                del values["availability"]
-                values[
-                    "matching_slots_in_human_friendly_format"
-                ] = cls.slots_in_human_friendly_format(
-                    random.sample(cls.salon_available_slots, 3)
+                # Suggest the slots the closest to the User availability
+                nearest_slots = cls.salon_calendar.nearest(
+                    datetime.datetime.fromisoformat(values["availability"]["start"])
                 )
+                del values["availability"]
+                values["matching_slots"] = [slot.start.isoformat() for slot in nearest_slots]
                 values["errors"][
                     "availability"
                 ] = "No, unfortunately. but we can offer {{matching_slots_in_human_friendly_format}}"
@@ -172,9 +186,7 @@ To all other questions reply you don't know.
                 logger.debug(f"Found a slot at {matching_slots[0]}")
                 if values["availability"]["grain"] > 60 * 60:
                     del values["availability"]
-                    values[
-                        "matching_slots_in_human_friendly_format"
-                    ] = cls.slots_in_human_friendly_format([matching_slots[0]])
+                    values["matching_slots"] = [matching_slots[0].isoformat()]
                     values["errors"][
                         "availability"
                     ] = "We can propose you a slot on {{matching_slots_in_human_friendly_format}}. Would that work?"
@@ -193,15 +205,11 @@ To all other questions reply you don't know.
                     values["appointment_time"] = matching_slots[0].strftime(
                         "%A, %d %B %Y, %H:%M"
                     )
-                    values[
-                        "matching_slots_in_human_friendly_format"
-                    ] = cls.slots_in_human_friendly_format([matching_slots[0]])
+                    values["matching_slots"] = [matching_slots[0].isoformat()]
             elif len(matching_slots) > 1:
                 logger.debug(f"Found several slots: {matching_slots}")
                 del values["availability"]
-                values[
-                    "matching_slots_in_human_friendly_format"
-                ] = cls.slots_in_human_friendly_format(matching_slots)
+                values["matching_slots"] = [slot.isoformat() for slot in matching_slots]
                 values["errors"][
                     "availability"
                 ] = "We have several slot available: {{matching_slots_in_human_friendly_format}}. Would that work?"
@@ -237,7 +245,7 @@ To all other questions reply you don't know.
 
 
 ner_llm = ChatOpenAI(temperature=0, client=None, max_tokens=200, model="gpt-3.5-turbo")
-chat_llm = ChatOpenAI(temperature=0, client=None, max_tokens=200, model="gpt-3.5-turbo")
+chat_llm = ChatOpenAI(temperature=0, client=None, max_tokens=200, model="gpt-3.5-turbo", streaming=True)
 
 from langchain.llms import Cohere
 
@@ -256,6 +264,10 @@ process_chain = ProcessChain(
         "phone_number": Entity,
         "confirmation": BooleanEntity,
     },  # type: ignore
+    # Resolve phone numbers already in the expected format without calling the NER LLM
+    entity_extractors={"phone_number": PhoneNumberExtractor()},
+    # Show the proposed slots to the NER, so that "the last one" resolves to one of them
+    ner_offered_options=["matching_slots"],
     additional_ner_instructions="""
 - "confirmation" entity: should only be `true` if the gives an explicity confirmation that all the collected information is correct
 and not if the user just says "yes" or confirms but asks follow-up questions.
@@ -169,7 +169,7 @@ If the salon asks anything else about Nathan, say it's not relevant.
 
 
 ner_llm = ChatOpenAI(temperature=0, client=None, max_tokens=100, model="gpt-3.5-turbo")
-chat_llm = ChatOpenAI(temperature=0, client=None, max_tokens=100, model="gpt-4")
+chat_llm = ChatOpenAI(temperature=0, client=None, max_tokens=100, model="gpt-4", streaming=True)
 
 process_chain = ProcessChain(
     memory=ConversationMemory(),
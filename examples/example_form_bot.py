@@ -106,7 +106,7 @@ Your goal is to collect the required information from the User to open a bank ac
 
 
 openai_entity_extractor_llm = ChatOpenAI(temperature=0, client=None, max_tokens=256)
-openai_chat_llm = ChatOpenAI(temperature=0, client=None, max_tokens=256)
+openai_chat_llm = ChatOpenAI(temperature=0, client=None, max_tokens=256, streaming=True)
 
 form_chain = ProcessChain(
     ner_llm=openai_entity_extractor_llm,
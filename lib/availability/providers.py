@@ -0,0 +1,238 @@
+import datetime
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Iterable, Optional
+
+from ..cache import LRUCache
+from .slot_index import Slot, SlotIndex
+
+
+class AvailabilityProvider(ABC):
+    """Calendar of available slots shared by the sessions of booking processes."""
+
+    @abstractmethod
+    def between(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        resource: Optional[str] = None,
+    ) -> list[Slot]:
+        """Return the slots starting in [start, end), in chronological order."""
+
+    @abstractmethod
+    def nearest(
+        self,
+        moment: datetime.datetime,
+        count: int = 3,
+        resource: Optional[str] = None,
+    ) -> list[Slot]:
+        """Return the `count` slots starting the closest to `moment`, in chronological order."""
+
+    @abstractmethod
+    def add(self, slot: datetime.datetime | Slot) -> None:
+        """Make a slot available."""
+
+    @abstractmethod
+    def book(self, slot: datetime.datetime | Slot) -> None:
+        """Remove a slot from the availability, raise a `KeyError` if it is not available."""
+
+    @abstractmethod
+    def version(self) -> int:
+        """Return a number changing whenever the slots are written."""
+
+
+class InMemoryAvailabilityProvider(AvailabilityProvider):
+    """Availability held by the current process, e.g. for tests and demos."""
+
+    def __init__(self, slots: Iterable[datetime.datetime | Slot] = ()):
+        self.index = SlotIndex(slots)
+        self._version = 0
+
+    def between(self, start, end, resource=None):
+        return self.index.between(start, end, resource)
+
+    def nearest(self, moment, count=3, resource=None):
+        return self.index.nearest(moment, count, resource)
+
+    def add(self, slot):
+        self.index.add(slot)
+        self._version += 1
+
+    def book(self, slot):
+        self.index.remove(slot)
+        self._version += 1
+
+    def version(self):
+        return self._version
+
+
+class SQLiteAvailabilityProvider(AvailabilityProvider):
+    """Availability stored in a local SQLite database, shared by the workers of the host."""
+
+    def __init__(self, path: str, slots: Iterable[datetime.datetime | Slot] = ()):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS slots "
+            "(start TEXT NOT NULL, resource TEXT NOT NULL, PRIMARY KEY (start, resource))"
+        )
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO slots (start, resource) VALUES (?, ?)",
+            [self._row(slot) for slot in slots],
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _row(slot: datetime.datetime | Slot) -> tuple[str, str]:
+        slot = SlotIndex._slot(slot)
+        # Fixed width timestamps sort chronologically as text
+        return slot.start.isoformat(timespec="microseconds"), slot.resource
+
+    @staticmethod
+    def _slot(row: tuple[str, str]) -> Slot:
+        return Slot(datetime.datetime.fromisoformat(row[0]), row[1])
+
+    @staticmethod
+    def _timestamp(moment: datetime.datetime) -> str:
+        return moment.isoformat(timespec="microseconds")
+
+    def _select(self, where: str, params: tuple, resource: Optional[str]) -> list[Slot]:
+        if resource is not None:
+            where += " AND resource = ?"
+            params += (resource,)
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT start, resource FROM slots WHERE {where}", params
+            ).fetchall()
+        return [self._slot(row) for row in rows]
+
+    def between(self, start, end, resource=None):
+        return sorted(
+            self._select(
+                "start >= ? AND start < ?",
+                (self._timestamp(start), self._timestamp(end)),
+                resource,
+            )
+        )
+
+    def nearest(self, moment, count=3, resource=None):
+        timestamp = self._timestamp(moment)
+        resource_filter = " AND resource = ?" if resource is not None else ""
+        params = (timestamp,) + ((resource,) if resource is not None else ())
+        with self._lock:
+            before = self._connection.execute(
+                f"SELECT start, resource FROM slots WHERE start < ?{resource_filter} "
+                "ORDER BY start DESC, resource DESC LIMIT ?",
+                params + (count,),
+            ).fetchall()
+            after = self._connection.execute(
+                f"SELECT start, resource FROM slots WHERE start >= ?{resource_filter} "
+                "ORDER BY start, resource LIMIT ?",
+                params + (count,),
+            ).fetchall()
+        closest = heapq.merge(
+            ((moment - s.start, s) for s in map(self._slot, before)),
+            ((s.start - moment, s) for s in map(self._slot, after)),
+        )
+        return sorted(s for _, s in itertools.islice(closest, count))
+
+    def add(self, slot):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO slots (start, resource) VALUES (?, ?)",
+                self._row(slot),
+            )
+            self._connection.commit()
+            self._writes += 1
+
+    def book(self, slot):
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM slots WHERE start = ? AND resource = ?", self._row(slot)
+            )
+            self._connection.commit()
+            self._writes += 1
+        if cursor.rowcount == 0:
+            raise KeyError(slot)
+
+    def version(self):
+        with self._lock:
+            # `data_version` only changes with the commits of other connections
+            data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+        return hash((data_version, self._writes))
+
+
+class CachedAvailabilityProvider(AvailabilityProvider):
+    """Serve range queries from the slots of whole days, cached until the next write.
+
+    Sessions looking at the same day share one lookup in `provider`, including the
+    lookups running concurrently. Writes made through any provider sharing the same
+    storage invalidate the cache, see `AvailabilityProvider.version`.
+    """
+
+    def __init__(self, provider: AvailabilityProvider, max_days: int = 366):
+        self.provider = provider
+        self.days = LRUCache(max_days)
+        self._pending: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def day(self, day: datetime.date) -> list[Slot]:
+        """Return all the slots of `day`."""
+        key = (day, self.provider.version())
+        slots = self.days.get(key)
+        if slots is not None:
+            return slots
+        with self._lock:
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            start = datetime.datetime.combine(day, datetime.time())
+            slots = self.provider.between(start, start + datetime.timedelta(days=1))
+            self.days.set(key, slots)
+            future.set_result(slots)
+            return slots
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    def between(self, start, end, resource=None):
+        slots = []
+        day = start.date()
+        while datetime.datetime.combine(day, datetime.time()) < end:
+            slots.extend(
+                s
+                for s in self.day(day)
+                if start <= s.start < end and resource in (None, s.resource)
+            )
+            day += datetime.timedelta(days=1)
+        return slots
+
+    def nearest(self, moment, count=3, resource=None):
+        return self.provider.nearest(moment, count, resource)
+
+    def add(self, slot):
+        self.provider.add(slot)
+        self.days.clear()
+
+    def book(self, slot):
+        self.provider.book(slot)
+        self.days.clear()
+
+    def version(self):
+        return self.provider.version()
@@ -0,0 +1,103 @@
+import bisect
+import datetime
+import heapq
+import itertools
+import threading
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+
+class Slot(NamedTuple):
+    start: datetime.datetime
+    # Calendar the slot belongs to, e.g. a hairdresser or a room
+    resource: str = ""
+
+
+class SlotIndex:
+    """Thread safe index of available slots, sorted by start time.
+
+    Range queries and nearest slot suggestions are binary searches, so they stay fast
+    with calendars of tens of thousands of slots. Slots are removed as they get booked.
+    """
+
+    def __init__(self, slots: Iterable[datetime.datetime | Slot] = ()):
+        self._slots: list[Slot] = sorted({self._slot(s) for s in slots})
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _slot(slot: datetime.datetime | Slot) -> Slot:
+        return slot if isinstance(slot, Slot) else Slot(slot)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __iter__(self) -> Iterator[Slot]:
+        return iter(list(self._slots))
+
+    def __contains__(self, slot: datetime.datetime | Slot) -> bool:
+        slot = self._slot(slot)
+        with self._lock:
+            i = bisect.bisect_left(self._slots, slot)
+            return i < len(self._slots) and self._slots[i] == slot
+
+    def add(self, slot: datetime.datetime | Slot) -> None:
+        slot = self._slot(slot)
+        with self._lock:
+            i = bisect.bisect_left(self._slots, slot)
+            if i == len(self._slots) or self._slots[i] != slot:
+                self._slots.insert(i, slot)
+
+    def remove(self, slot: datetime.datetime | Slot) -> None:
+        """Remove a booked slot, raise a `KeyError` if it is not available."""
+        slot = self._slot(slot)
+        with self._lock:
+            i = bisect.bisect_left(self._slots, slot)
+            if i == len(self._slots) or self._slots[i] != slot:
+                raise KeyError(slot)
+            del self._slots[i]
+
+    def between(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        resource: Optional[str] = None,
+    ) -> list[Slot]:
+        """Return the slots starting in [start, end), in chronological order."""
+        with self._lock:
+            # `(start,)` sorts before any slot starting at `start`
+            i = bisect.bisect_left(self._slots, (start,))
+            j = bisect.bisect_left(self._slots, (end,), lo=i)
+            slots = self._slots[i:j]
+        if resource is not None:
+            slots = [s for s in slots if s.resource == resource]
+        return slots
+
+    def nearest(
+        self,
+        moment: datetime.datetime,
+        count: int = 3,
+        resource: Optional[str] = None,
+    ) -> list[Slot]:
+        """Return the `count` slots starting the closest to `moment`, in chronological order.
+
+        Used to suggest alternatives when no slot matches the availability of the User.
+        """
+        with self._lock:
+            i = bisect.bisect_left(self._slots, (moment,))
+            before = (
+                s
+                for s in map(self._slots.__getitem__, range(i - 1, -1, -1))
+                if resource in (None, s.resource)
+            )
+            after = (
+                s
+                for s in map(self._slots.__getitem__, range(i, len(self._slots)))
+                if resource in (None, s.resource)
+            )
+            # Both sides are ordered by distance to `moment`
+            closest = heapq.merge(
+                ((moment - s.start, s) for s in before),
+                ((s.start - moment, s) for s in after),
+            )
+            slots = [s for _, s in itertools.islice(closest, count)]
+        return sorted(slots)
+
@@ -1,25 +1,39 @@
 import json
+from typing import Optional
+from uuid import uuid4
+
 from langchain.chains.base import Chain
 from rich.console import Console
 from rich.prompt import Prompt
 
 from lib.conversation_memory import ConversationMemory
 
+from .process.blueprint import ProcessChainBlueprint
 from .process.process_chain import ProcessChain
+from .session import SessionManager
+from .streaming import StreamingTurn
+
+
+def print_streaming_response(console: Console, chain: Chain, user_input: str) -> dict:
+    """Print the response tokens as they arrive and return the chain output."""
+    turn = StreamingTurn(chain, user_input)
+    for token in turn:
+        console.print(token, end="", markup=False, highlight=False)
+    console.print()
+    return turn.inference
 
 
 def console_bot(chain: ProcessChain, initial_input: str = ""):
     console = Console()
     console.clear()
-    console.print(chain(initial_input)["response"])
+    print_streaming_response(console, chain, initial_input)
     while True:
         user_input = Prompt.ask("User")
         if user_input.lower() == "exit":
             console.print("[bold]Goodbye![/bold]")
             break
         else:
-            inference = chain(user_input)
-            console.print(inference["response"])
+            inference = print_streaming_response(console, chain, user_input)
             if inference["result"] is not None:
                 console.print("[bold]Done![/bold]")
                 console.print(inference["result"])
@@ -73,10 +87,22 @@ class RichCallbackHandler(BaseCallbackHandler):
         self.console.print(text)
 
 
-def gradio_bot(chain: Chain, initial_input: str = "", title: str = "CustomerServiceGPT"):
+def gradio_bot(
+    chain: ProcessChain | ProcessChainBlueprint,
+    initial_input: str = "",
+    title: str = "CustomerServiceGPT",
+    concurrency_count: int = 16,
+    max_sessions: Optional[int] = 1000,
+):
+    """Gradio demo with one conversation per visitor.
 
-    
+    Each browser tab gets its own session, created from `chain` by a `SessionManager`
+    holding up to `max_sessions` of them; the conversation of an evicted session starts
+    over. Turns run through the Gradio queue, at most `concurrency_count` at once.
+    """
     import gradio as gr
+
+    sessions = SessionManager(chain, max_sessions=max_sessions)
     css = """
 #chatbot .user {
     text-align: right
@@ -88,10 +114,9 @@ def gradio_bot(chain: Chain, initial_input: str = "", title: str = "CustomerServ
         # {title}
         """
         )
-        initial_history = [[None, chain(initial_input)["response"]]] if initial_input else []
-        chatbot = gr.Chatbot(
-            value=initial_history, elem_id="chatbot"
-        ).style(height=500)
+        # Id of the visitor session, gradio keeps one value per browser tab
+        session_id = gr.State(None)
+        chatbot = gr.Chatbot(value=[], elem_id="chatbot").style(height=500)
         with gr.Row():
             with gr.Column(scale=8):
                 msg = gr.Textbox(
@@ -101,25 +126,40 @@ def gradio_bot(chain: Chain, initial_input: str = "", title: str = "CustomerServ
             with gr.Column(scale=1):
                 clear = gr.Button("Reset conversation")
 
-        def respond(message, chat_history):
-            inference = chain(message)
-            response = inference["response"]
+        def start(current_session_id):
+            new_session_id = current_session_id or str(uuid4())
+            session = sessions.get(new_session_id)
+            history = [[None, session(initial_input)["response"]]] if initial_input else []
+            return new_session_id, history
+
+        def respond(message, chat_history, current_session_id):
+            if current_session_id is None:
+                current_session_id, chat_history = start(None)
+            # Tokens are rendered as they arrive, which requires the gradio queue
+            chat_history.append([message, ""])
+            turn = StreamingTurn(sessions.get(current_session_id), message)
+            for token in turn:
+                chat_history[-1][1] += token
+                yield "", chat_history, current_session_id
+            inference = turn.inference
             if inference["result"] is not None:
-                response +=  f"""
+                chat_history[-1][1] +=  f"""
 
 ```json
 {json.dumps(inference["result"], indent=2)}
 ```
 """
-            chat_history.append((message, response))
-            return "", chat_history
+                yield "", chat_history, current_session_id
 
-        msg.submit(respond, [msg, chatbot], [msg, chatbot]) # type: ignore
+        demo.load(start, [session_id], [session_id, chatbot])
+        msg.submit(respond, [msg, chatbot, session_id], [msg, chatbot, session_id]) # type: ignore
 
-        def reset():
-            chain.reset()
-            return [[None, chain(initial_input)["response"]]]
+        def reset(current_session_id):
+            if current_session_id is not None:
+                sessions.drop(current_session_id)
+            return start(None)
 
-        clear.click(reset, None, chatbot, queue=False)
+        clear.click(reset, [session_id], [session_id, chatbot])
 
+    demo.queue(concurrency_count=concurrency_count)
     return demo
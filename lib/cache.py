@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from langchain import LLMChain
+from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
+
+
+def llm_params(llm: Optional[BaseLanguageModel]) -> dict[str, Any]:
+    """Return the type and parameters of `llm`, which determine its responses."""
+    try:
+        params = dict(llm._identifying_params)  # type: ignore
+    except AttributeError:
+        params = {}
+    return {"llm_type": type(llm).__name__, **params}
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return f"CacheStats(hits={self.hits}, misses={self.misses}, hit_ratio={self.hit_ratio:.2f})"
+
+
+class LRUCache:
+    """Thread safe in-memory cache evicting the least recently used entries."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Any, Any] = OrderedDict()
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            if key not in self.entries:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: Any) -> None:
+        with self._lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+
+
+class SQLiteCache:
+    """Local on-disk cache of strings evicting the least recently used entries.
+
+    The database is in WAL mode so that the processes of the host can read it while one
+    writes. The access time of an entry is only updated by a hit when it is older than
+    `touch_interval` seconds, so that most hits do not write.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        touch_interval: float = 60.0,
+        busy_timeout: float = 5.0,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # `timeout` is the time to wait for the lock of another process
+        self._connection = sqlite3.connect(
+            path, timeout=busy_timeout, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+        )
+        self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, accessed_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            value, accessed_at = row
+            now = time.time()
+            if now - accessed_at > self.touch_interval:
+                self._connection.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self._connection.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, accessed_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            self._connection.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+            self._connection.commit()
+
+
+class ResponseCache:
+    """Content-addressed cache of LLM responses.
+
+    Entries are keyed by a hash of the prompt and the LLM parameters. They are looked up
+    in an in-memory LRU tier, then in an optional SQLite tier shared by the processes
+    of the host, which promotes hits to memory.
+    Only use it with deterministic LLMs, i.e. with a temperature of 0.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        path: Optional[str] = None,
+        max_disk_entries: int = 100_000,
+    ):
+        self.memory = LRUCache(max_entries)
+        self.disk = SQLiteCache(path, max_disk_entries) if path else None
+        self.stats = CacheStats()
+
+    @staticmethod
+    def make_key(
+        prompt: str, llm: BaseLanguageModel, stop: Optional[List[str]] = None
+    ) -> str:
+        params = {**llm_params(llm), "stop": stop}
+        content = json.dumps(params, sort_keys=True, default=str) + "\n" + prompt
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+class CachedLLMChain(LLMChain):
+    """`LLMChain` answering from `cache` when the same prompt was already completed."""
+
+    cache: ResponseCache
+
+    def _cached_outputs(self, key: str) -> Optional[Dict[str, Any]]:
+        text = self.cache.get(key)
+        if text is None:
+            return None
+        return {self.output_key: self.output_parser.parse(text)}
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        prompts, stop = self.prep_prompts([inputs], run_manager=run_manager)
+        key = self.cache.make_key(prompts[0].to_string(), self.llm, stop)
+        outputs = self._cached_outputs(key)
+        if outputs is not None:
+            return outputs
+        response = self.llm.generate_prompt(
+            prompts,
+            stop,
+            callbacks=run_manager.get_child() if run_manager else None,
+            **self.llm_kwargs,
+        )
+        self.cache.set(key, response.generations[0][0].text)
+        return self.create_outputs(response)[0]
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        prompts, stop = await self.aprep_prompts([inputs], run_manager=run_manager)
+        key = self.cache.make_key(prompts[0].to_string(), self.llm, stop)
+        outputs = self._cached_outputs(key)
+        if outputs is not None:
+            return outputs
+        response = await self.llm.agenerate_prompt(
+            prompts,
+            stop,
+            callbacks=run_manager.get_child() if run_manager else None,
+            **self.llm_kwargs,
+        )
+        self.cache.set(key, response.generations[0][0].text)
+        return self.create_outputs(response)[0]
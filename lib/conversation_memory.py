@@ -1,4 +1,5 @@
 from typing import Any, Dict, List
+from pydantic import Field
 from langchain.schema import BaseMemory
 from langchain.schema import HumanMessage, AIMessage
 from langchain.memory.buffer_window import ConversationBufferWindowMemory
@@ -6,7 +7,7 @@ from langchain.memory.buffer_window import ConversationBufferWindowMemory
 
 class KeyValueStoreMemory(BaseMemory):
     memory_key: str = "variables"
-    memories: dict[str, Any] = dict()
+    memories: dict[str, Any] = Field(default_factory=dict)
 
     def get(self, key: str) -> Any:
         return self.memories.get(key)
@@ -37,14 +38,13 @@ import traceback
 class ConversationHistoryMemory(ConversationBufferWindowMemory):
     human_prefix: str = "User"
     memory_key: str = "history"
-    history: list[HumanMessage | AIMessage] = []
 
     @property
     def memory_variables(self) -> List[str]:
         return [self.memory_key]
 
     def clear(self) -> None:
-        return self.history.clear()
+        return self.chat_memory.clear()
     
     def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
         """Save context from this conversation to buffer."""
@@ -57,8 +57,8 @@ class ConversationHistoryMemory(ConversationBufferWindowMemory):
 
 
 class ConversationMemory(BaseMemory):
-    kv_store: KeyValueStoreMemory = KeyValueStoreMemory()
-    history: ConversationHistoryMemory = ConversationHistoryMemory()
+    kv_store: KeyValueStoreMemory = Field(default_factory=KeyValueStoreMemory)
+    history: ConversationHistoryMemory = Field(default_factory=ConversationHistoryMemory)
 
     @property
     def memory_variables(self) -> List[str]:
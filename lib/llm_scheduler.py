@@ -0,0 +1,446 @@
+"""Coordinate the LLM calls of all sessions within the rate limits of the provider.
+
+Every LLM of a `ProcessChain` (`ner_llm`, `chat_llm` and the LLMs of entities) is
+wrapped in a `ScheduledLLM` sharing one `LLMScheduler`, which admits the calls in
+priority order while the requests and tokens per minute budgets allow it:
+
+```python
+scheduler = LLMScheduler(requests_per_minute=3500, tokens_per_minute=90_000)
+chat_llm = ScheduledLLM(llm=ChatOpenAI(max_retries=0), scheduler=scheduler)
+evaluation_llm = ScheduledLLM(
+    llm=ChatOpenAI(max_retries=0), scheduler=scheduler, priority=Priority.BACKGROUND
+)
+```
+
+Rate limit errors make the scheduler pause all calls before the failed call is retried,
+so the client retries of the wrapped LLMs are best disabled.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+import weakref
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Sequence, TypeVar
+
+from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.manager import Callbacks
+from langchain.schema import BaseMessage, LLMResult, PromptValue
+
+from .logger_config import setup_logger
+from .ner.example_index import estimate_tokens
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Calls of a lower priority class only run when no call of a higher one is waiting."""
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class TokenBucket:
+    """`capacity` units refilled continuously over `period` seconds.
+
+    A request larger than the capacity is admitted when the bucket is full and leaves it
+    in debt, so it is delayed rather than blocked forever.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken, 0 if it can be now."""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+    def give(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, seconds: float) -> None:
+        """Empty the bucket so that it only starts refilling in `seconds`."""
+        self.level = min(self.level, -seconds * self.rate)
+
+
+class SchedulerMetrics:
+    def __init__(self):
+        self.queue_depth = {priority: 0 for priority in Priority}
+        self.max_queue_depth = 0
+        self.running = 0
+        self.granted = 0
+        # Calls that had to wait for the rate limits or for a free slot
+        self.delayed = 0
+        self.rate_limit_errors = 0
+        self.total_wait = 0.0
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.granted if self.granted else 0.0
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "queue_depth": {priority.name.lower(): n for priority, n in self.queue_depth.items()},
+            "max_queue_depth": self.max_queue_depth,
+            "running": self.running,
+            "granted": self.granted,
+            "delayed": self.delayed,
+            "rate_limit_errors": self.rate_limit_errors,
+            "average_wait": self.average_wait,
+        }
+
+    def __repr__(self) -> str:
+        return f"SchedulerMetrics({self.snapshot()})"
+
+
+class OpenAIConnectionPool:
+    """Keep-alive HTTP connections shared by the OpenAI clients of all sessions.
+
+    Without it the `openai` library keeps a connection pool per thread for sync calls
+    and opens a new connection for every async call.
+    """
+
+    def __init__(self, max_connections: int = 100):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.max_connections = max_connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # By event loop, released with the loop
+        self._aiosessions: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, Any
+        ] = weakref.WeakKeyDictionary()
+
+    def install(self) -> None:
+        """Use the pool for the sync calls of the `openai` library."""
+        import openai
+
+        openai.requestssession = self.session
+
+    def aiosession(self) -> Any:
+        """Return the aiohttp session of the running event loop."""
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._aiosessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            session = aiohttp.ClientSession(connector=connector)
+            self._aiosessions[loop] = session
+        return session
+
+    @contextlib.contextmanager
+    def bind(self) -> Iterator[None]:
+        """Use the pool for the async calls of the `openai` library in this context."""
+        import openai
+
+        token = openai.aiosession.set(self.aiosession())
+        try:
+            yield
+        finally:
+            openai.aiosession.reset(token)
+
+    async def aclose(self) -> None:
+        session = self._aiosessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+class LLMScheduler:
+    """Admit LLM calls by priority within requests and tokens per minute budgets.
+
+    Calls are granted in priority order, then in order of arrival, once the budgets and
+    `max_concurrency` allow it. The tokens of a call are reserved from an estimate when
+    it is granted and corrected with the actual usage when it is released. Calls reach
+    the provider a little after they are granted, so only `headroom` of the limits is
+    used. `period` is the window of the limits in seconds, shortened in tests.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        headroom: float = 0.9,
+        period: float = 60.0,
+        connection_pool: Optional[OpenAIConnectionPool] = None,
+    ):
+        self.request_bucket = (
+            TokenBucket(requests_per_minute * headroom, period) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute * headroom, period) if tokens_per_minute else None
+        )
+        self.max_concurrency = max_concurrency
+        self.connection_pool = connection_pool
+        self.metrics = SchedulerMetrics()
+        # (priority, arrival, tokens, enqueued at, future)
+        self._waiters: list[tuple[int, int, int, float, concurrent.futures.Future]] = []
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._timer_deadline = 0.0
+        # Set by `backoff`, no call is granted before
+        self._paused_until = 0.0
+
+    def submit(
+        self, tokens: int, priority: Priority = Priority.INTERACTIVE
+    ) -> concurrent.futures.Future:
+        """Queue a call of `tokens` tokens, the returned future is done once it is granted."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            heapq.heappush(
+                self._waiters,
+                (priority, next(self._arrivals), tokens, time.monotonic(), future),
+            )
+            self.metrics.queue_depth[Priority(priority)] += 1
+            self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, len(self._waiters))
+        self._dispatch()
+        return future
+
+    def acquire(self, tokens: int, priority: Priority = Priority.INTERACTIVE) -> None:
+        self.submit(tokens, priority).result()
+
+    async def aacquire(self, tokens: int, priority: Priority = Priority.INTERACTIVE) -> None:
+        future = self.submit(tokens, priority)
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Granted meanwhile
+            if not future.cancel():
+                self.release(tokens)
+            raise
+
+    def release(self, reserved_tokens: int, used_tokens: Optional[int] = None) -> None:
+        """Free the slot of a granted call, `used_tokens` corrects its reservation."""
+        with self._lock:
+            self.metrics.running -= 1
+            if self.token_bucket is not None and used_tokens is not None:
+                if used_tokens < reserved_tokens:
+                    self.token_bucket.give(reserved_tokens - used_tokens)
+                else:
+                    self.token_bucket.take(used_tokens - reserved_tokens)
+        self._dispatch()
+
+    def backoff(self, seconds: float) -> None:
+        """Hold all calls for `seconds`, after the provider rejected one for its rate limits."""
+        with self._lock:
+            self.metrics.rate_limit_errors += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            # The budgets also restart empty, so that the held calls do not burst
+            for bucket in (self.request_bucket, self.token_bucket):
+                if bucket is not None:
+                    bucket.drain(seconds)
+        logger.warning(f"Rate limited by the provider, holding LLM calls for {seconds:.1f}s")
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.wait_time(1, now))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.wait_time(tokens, now))
+        return wait
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            while self._waiters:
+                priority, _, tokens, enqueued_at, future = self._waiters[0]
+                if future.cancelled():
+                    heapq.heappop(self._waiters)
+                    self.metrics.queue_depth[Priority(priority)] -= 1
+                    continue
+                if (
+                    self.max_concurrency is not None
+                    and self.metrics.running >= self.max_concurrency
+                ):
+                    return
+                now = time.monotonic()
+                wait = self._wait_time(tokens, now)
+                if wait > 0:
+                    self._schedule(wait)
+                    return
+                heapq.heappop(self._waiters)
+                self.metrics.queue_depth[Priority(priority)] -= 1
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if self.request_bucket is not None:
+                    self.request_bucket.take(1)
+                if self.token_bucket is not None:
+                    self.token_bucket.take(tokens)
+                self.metrics.running += 1
+                self.metrics.granted += 1
+                waited = now - enqueued_at
+                self.metrics.total_wait += waited
+                if waited > 0.001:
+                    self.metrics.delayed += 1
+                future.set_result(None)
+
+    def _schedule(self, wait: float) -> None:
+        deadline = time.monotonic() + wait
+        if self._timer is not None:
+            if self._timer_deadline <= deadline:
+                return
+            self._timer.cancel()
+        self._timer = threading.Timer(wait, self._on_timer)
+        self._timer.daemon = True
+        self._timer_deadline = deadline
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        self._dispatch()
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return type(error).__name__ == "RateLimitError" or getattr(error, "http_status", None) == 429
+
+
+def retry_after(error: Exception, attempt: int) -> float:
+    """Seconds to wait before retrying, from the Retry-After header if the provider sent one."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return min(2.0**attempt, 60.0)
+
+
+def used_tokens(result: LLMResult) -> Optional[int]:
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    return usage.get("total_tokens")
+
+
+class ScheduledLLM(BaseLanguageModel):
+    """Run the calls of `llm` through `scheduler`, retrying the rate limited ones."""
+
+    llm: BaseLanguageModel
+    scheduler: LLMScheduler
+    priority: Priority = Priority.INTERACTIVE
+    # Expected completion tokens when the LLM does not set `max_tokens`
+    completion_tokens: int = 256
+    max_retries: int = 3
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return getattr(self.llm, "_identifying_params", {})
+
+    def estimate_tokens(self, text: str) -> int:
+        completion = getattr(self.llm, "max_tokens", None) or self.completion_tokens
+        return estimate_tokens(text) + completion
+
+    def _run(self, tokens: int, call: Callable[[], T]) -> T:
+        for attempt in range(self.max_retries + 1):
+            self.scheduler.acquire(tokens, self.priority)
+            used = None
+            try:
+                result = call()
+                if isinstance(result, LLMResult):
+                    used = used_tokens(result)
+                return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self.scheduler.backoff(retry_after(e, attempt))
+            finally:
+                self.scheduler.release(tokens, used)
+        raise AssertionError("unreachable")
+
+    async def _arun(self, tokens: int, call: Callable[[], Awaitable[T]]) -> T:
+        pool = self.scheduler.connection_pool
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.aacquire(tokens, self.priority)
+            used = None
+            try:
+                with pool.bind() if pool is not None else contextlib.nullcontext():
+                    result = await call()
+                if isinstance(result, LLMResult):
+                    used = used_tokens(result)
+                return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self.scheduler.backoff(retry_after(e, attempt))
+            finally:
+                self.scheduler.release(tokens, used)
+        raise AssertionError("unreachable")
+
+    def _prompts_tokens(self, prompts: List[PromptValue]) -> int:
+        return sum(self.estimate_tokens(prompt.to_string()) for prompt in prompts)
+
+    @staticmethod
+    def _messages_text(messages: List[BaseMessage]) -> str:
+        return "\n".join(message.content for message in messages)
+
+    def generate_prompt(
+        self,
+        prompts: List[PromptValue],
+        stop: Optional[List[str]] = None,
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        return self._run(
+            self._prompts_tokens(prompts),
+            lambda: self.llm.generate_prompt(prompts, stop, callbacks=callbacks, **kwargs),
+        )
+
+    async def agenerate_prompt(
+        self,
+        prompts: List[PromptValue],
+        stop: Optional[List[str]] = None,
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        return await self._arun(
+            self._prompts_tokens(prompts),
+            lambda: self.llm.agenerate_prompt(prompts, stop, callbacks=callbacks, **kwargs),
+        )
+
+    def predict(self, text: str, *, stop: Optional[Sequence[str]] = None, **kwargs: Any) -> str:
+        return self._run(
+            self.estimate_tokens(text), lambda: self.llm.predict(text, stop=stop, **kwargs)
+        )
+
+    def predict_messages(
+        self, messages: List[BaseMessage], *, stop: Optional[Sequence[str]] = None, **kwargs: Any
+    ) -> BaseMessage:
+        return self._run(
+            self.estimate_tokens(self._messages_text(messages)),
+            lambda: self.llm.predict_messages(messages, stop=stop, **kwargs),
+        )
+
+    async def apredict(
+        self, text: str, *, stop: Optional[Sequence[str]] = None, **kwargs: Any
+    ) -> str:
+        return await self._arun(
+            self.estimate_tokens(text), lambda: self.llm.apredict(text, stop=stop, **kwargs)
+        )
+
+    async def apredict_messages(
+        self, messages: List[BaseMessage], *, stop: Optional[Sequence[str]] = None, **kwargs: Any
+    ) -> BaseMessage:
+        return await self._arun(
+            self.estimate_tokens(self._messages_text(messages)),
+            lambda: self.llm.apredict_messages(messages, stop=stop, **kwargs),
+        )
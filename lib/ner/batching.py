@@ -0,0 +1,264 @@
+"""Batch the NER calls of concurrent sessions into one LLM call.
+
+The NER chain of a blueprint is shared by its sessions, so wrapping its LLM in a
+`BatchingLLM` collects the prompts of the turns arriving within `max_wait` seconds and
+sends them in a single `generate` call:
+
+```python
+blueprint = ProcessChainBlueprint(ner_llm=BatchingLLM(llm=OpenAI(...)), ...)
+```
+
+Completion models like `OpenAI` send the prompts of a `generate` call in one request and
+local models like `HuggingFacePipeline` run them as one batch, which is where batching
+pays off. Chat models like `ChatOpenAI` send one request per prompt, one after the other
+in the sync path, so their calls are passed through without batching.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, List, Optional
+
+from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.manager import AsyncCallbackManager, CallbackManager, Callbacks
+from langchain.chat_models.base import BaseChatModel
+from langchain.load.dump import dumpd
+from langchain.schema import BaseMessage, LLMResult, PromptValue
+from pydantic import Field, PrivateAttr
+
+from ..logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.prompts = 0
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.prompts / self.batches if self.batches else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"BatchStats(batches={self.batches}, prompts={self.prompts}, "
+            f"average_batch_size={self.average_batch_size:.1f})"
+        )
+
+
+def is_prompt_error(error: Exception) -> bool:
+    """Whether the provider rejected a request for its content, e.g. a too long prompt."""
+    return type(error).__name__ in {"InvalidRequestError", "BadRequestError"} or getattr(
+        error, "http_status", None
+    ) in {400, 413}
+
+
+def share_llm_output(
+    llm_output: Optional[dict[str, Any]], size: int, total: int
+) -> Optional[dict[str, Any]]:
+    """Return `llm_output` with the token usage of a batch prorated to `size` of `total`."""
+    if not llm_output:
+        return llm_output
+    usage = llm_output.get("token_usage")
+    if not usage or not total:
+        return dict(llm_output)
+    return {
+        **llm_output,
+        "token_usage": {
+            name: round(count * size / total) if isinstance(count, (int, float)) else count
+            for name, count in usage.items()
+        },
+    }
+
+
+class _Batch:
+    """Prompts waiting to be sent together, with the future of their generations."""
+
+    def __init__(self, full: threading.Event | asyncio.Event):
+        self.prompts: list[PromptValue] = []
+        self.full = full
+        self.result: concurrent.futures.Future = concurrent.futures.Future()
+        self.task: Optional[asyncio.Future] = None
+
+    def add(self, prompts: List[PromptValue]) -> int:
+        start = len(self.prompts)
+        self.prompts.extend(prompts)
+        return start
+
+
+class BatchingLLM(BaseLanguageModel):
+    """Send the concurrent calls of `llm` as `generate` calls of `max_batch_size` prompts at most.
+
+    The first call of a batch waits `max_wait` seconds, or until the batch is full, then
+    runs the batch; the other calls wait for their generations. Only calls with the same
+    stop words and arguments are batched together. When a batch is rejected for its
+    content, each call runs its own prompts again, so that an invalid prompt only fails its
+    own call; other errors fail all the calls. Each call gets its share of the token usage
+    of the batch, prorated to the length of its prompts. The callbacks of each call get the
+    run of its own prompts, those of `llm` the run of the whole batch. Calls of chat models
+    are not batched.
+    """
+
+    llm: BaseLanguageModel
+    max_wait: float = 0.01
+    max_batch_size: int = 16
+    stats: BatchStats = Field(default_factory=BatchStats)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _batches: dict[Any, _Batch] = PrivateAttr(default_factory=dict)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return getattr(self.llm, "_identifying_params", {})
+
+    @staticmethod
+    def _key(stop: Optional[List[str]], kwargs: dict[str, Any], loop: Any = None) -> Any:
+        return tuple(stop or ()), repr(sorted(kwargs.items())), loop
+
+    def _join(self, key: Any, prompts: List[PromptValue], full: Any) -> tuple[_Batch, int, bool]:
+        """Add `prompts` to the open batch of `key`, return it with their offset and
+        whether this call leads the batch."""
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = _Batch(full)
+            start = batch.add(prompts)
+            if len(batch.prompts) >= self.max_batch_size:
+                del self._batches[key]
+                batch.full.set()
+            return batch, start, leader
+
+    def _close(self, key: Any, batch: _Batch) -> None:
+        with self._lock:
+            if self._batches.get(key) is batch:
+                del self._batches[key]
+            self.stats.batches += 1
+            self.stats.prompts += len(batch.prompts)
+        logger.debug(f"Sending a batch of {len(batch.prompts)} prompts")
+
+    @staticmethod
+    def _result(batch: _Batch, start: int, prompts: List[PromptValue]) -> LLMResult:
+        """Return the generations of `prompts` with their share of the token usage."""
+        result = batch.result.result()
+        return LLMResult(
+            generations=result.generations[start : start + len(prompts)],
+            llm_output=share_llm_output(
+                result.llm_output,
+                sum(len(p.to_string()) for p in prompts),
+                sum(len(p.to_string()) for p in batch.prompts),
+            ),
+        )
+
+    @staticmethod
+    def _should_run_alone(error: Exception, batch: _Batch, prompts: List[PromptValue]) -> bool:
+        """Whether to run `prompts` again without the rest of the failed `batch`.
+
+        Only for the errors a single prompt can cause. Others, like timeouts or rate limits,
+        fail all the calls of the batch rather than turning into one request per call.
+        """
+        return len(batch.prompts) > len(prompts) and is_prompt_error(error)
+
+    def generate_prompt(
+        self,
+        prompts: List[PromptValue],
+        stop: Optional[List[str]] = None,
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        if isinstance(self.llm, BaseChatModel):
+            return self.llm.generate_prompt(prompts, stop, callbacks=callbacks, **kwargs)
+        run_managers = CallbackManager.configure(callbacks).on_llm_start(
+            dumpd(self.llm), [prompt.to_string() for prompt in prompts]
+        )
+        key = self._key(stop, kwargs)
+        batch, start, leader = self._join(key, prompts, threading.Event())
+        if leader:
+            batch.full.wait(self.max_wait)
+            self._close(key, batch)
+            try:
+                batch.result.set_result(self.llm.generate_prompt(batch.prompts, stop, **kwargs))
+            except Exception as e:
+                batch.result.set_exception(e)
+        try:
+            try:
+                result = self._result(batch, start, prompts)
+            except Exception as e:
+                if not self._should_run_alone(e, batch, prompts):
+                    raise
+                result = self.llm.generate_prompt(prompts, stop, **kwargs)
+        except Exception as e:
+            for run_manager in run_managers:
+                run_manager.on_llm_error(e)
+            raise
+        for run_manager, generation in zip(run_managers, result.generations):
+            run_manager.on_llm_end(LLMResult(generations=[generation]))
+        return result
+
+    async def agenerate_prompt(
+        self,
+        prompts: List[PromptValue],
+        stop: Optional[List[str]] = None,
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        if isinstance(self.llm, BaseChatModel):
+            return await self.llm.agenerate_prompt(prompts, stop, callbacks=callbacks, **kwargs)
+        run_managers = await AsyncCallbackManager.configure(callbacks).on_llm_start(
+            dumpd(self.llm), [prompt.to_string() for prompt in prompts]
+        )
+        # Batches do not span event loops
+        key = self._key(stop, kwargs, asyncio.get_running_loop())
+        batch, start, leader = self._join(key, prompts, asyncio.Event())
+        if leader:
+            # In its own task, so that cancelling the leading call does not stall the others
+            batch.task = asyncio.ensure_future(self._arun_batch(key, batch, stop, kwargs))
+        try:
+            try:
+                await asyncio.wrap_future(batch.result)
+                result = self._result(batch, start, prompts)
+            except Exception as e:
+                if not self._should_run_alone(e, batch, prompts):
+                    raise
+                result = await self.llm.agenerate_prompt(prompts, stop, **kwargs)
+        except Exception as e:
+            for run_manager in run_managers:
+                await run_manager.on_llm_error(e)
+            raise
+        for run_manager, generation in zip(run_managers, result.generations):
+            await run_manager.on_llm_end(LLMResult(generations=[generation]))
+        return result
+
+    async def _arun_batch(
+        self, key: Any, batch: _Batch, stop: Optional[List[str]], kwargs: dict[str, Any]
+    ) -> None:
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        self._close(key, batch)
+        try:
+            result = await self.llm.agenerate_prompt(batch.prompts, stop, **kwargs)
+            batch.result.set_result(result)
+        except Exception as e:
+            batch.result.set_exception(e)
+
+    def predict(self, text: str, *, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        return self.llm.predict(text, stop=stop, **kwargs)
+
+    def predict_messages(
+        self, messages: List[BaseMessage], *, stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> BaseMessage:
+        return self.llm.predict_messages(messages, stop=stop, **kwargs)
+
+    async def apredict(
+        self, text: str, *, stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> str:
+        return await self.llm.apredict(text, stop=stop, **kwargs)
+
+    async def apredict_messages(
+        self, messages: List[BaseMessage], *, stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> BaseMessage:
+        return await self.llm.apredict_messages(messages, stop=stop, **kwargs)
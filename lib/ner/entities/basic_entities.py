@@ -1,4 +1,4 @@
-from typing import Any, Optional, Type
+from typing import Any, ClassVar, Optional, Type
 from langchain import PromptTemplate
 from pydantic import BaseModel, Field, validator
 from langchain.base_language import BaseLanguageModel
@@ -11,6 +11,17 @@ class Entity(BaseModel):
     llm: Optional[BaseLanguageModel] = Field(exclude=True, default=None)
     value: Any
     prompt: Optional[PromptTemplate] = Field(exclude=True, default=None)
+    # Whether parsing the value calls the LLM, so that it can be done concurrently
+    requires_llm: ClassVar[bool] = False
+
+    @classmethod
+    async def aparse_obj(cls, obj: dict[str, Any]) -> "Entity":
+        """Async counterpart of `parse_obj` for entities that call an LLM to parse their value."""
+        return cls.parse_obj(obj)
+
+    def get_value(self) -> Any:
+        """Return the value with nested models converted to dicts, as processes expect."""
+        return self.value.dict() if isinstance(self.value, BaseModel) else self.value
 
 class BooleanEntity(Entity):
     value: bool
@@ -18,12 +29,14 @@ class BooleanEntity(Entity):
 class StringEntity(Entity):
     value: str
     
+EMAIL_PATTERN = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
+
+
 class EmailEntity(Entity):
     @validator("value")
     def validate_email(cls, v):
         print("email val")
-        pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-        match = re.search(pattern, v)
+        match = re.search(EMAIL_PATTERN, v)
         if not match:
             return None
         return v
@@ -1,5 +1,8 @@
 import datetime
 import json
+import re
+import threading
+from typing import Any, ClassVar
 from langchain import PromptTemplate
 from pydantic import BaseModel, root_validator, validator
 
@@ -9,16 +12,46 @@ from langchain.base_language import BaseLanguageModel
 from langchain import LLMChain
 from jinja2 import Template
 
+from ...cache import CacheStats, LRUCache, llm_params
+from . import datetime_rules
 from .basic_entities import Entity
 
 
+QUERY_PLACEHOLDER = "__QUERY__"
+NOW_PLACEHOLDER = "__NOW__"
+TIME_RELATIVE_EXAMPLES_PLACEHOLDER = "__TIME_RELATIVE_EXAMPLES__"
+
+EXAMPLES_TEMPLATE = Template(
+    """{% for e in examples %}
+Natural language date:
+{{e.text}}
+result:
+{{ escape_json(e.result) }}
+{% endfor %}"""
+)
+
+PROMPT_TEMPLATE = Template(
+    """
+At this very moment, date time is {{now}}.
+For a given date expressed in natural language, output date time information in ISO format as shown in the examples:
+
+EXAMPLES:{{time_relative_examples}}{{examples}}
+END OF EXAMPLES
+
+Natural language date:
+{{query}}
+ISO:
+"""
+)
+
+
 class DateTime(BaseModel):
     start: str
     end: str
     grain: int
 
     @root_validator
-    def validate(cls, values):
+    def validate_range(cls, values):
         try:
             start = datetime.datetime.fromisoformat(values["start"])
             end = datetime.datetime.fromisoformat(values["end"])
@@ -29,200 +62,216 @@ class DateTime(BaseModel):
             raise ValueError("Could not parse date time")
 
 
-class DateTimeEntity(Entity):
-    name: str = "datetime"
-    value: str
+class DateTimeResolutionCache:
+    """Memoize the resolution of natural language dates for the current day.
 
-    @validator("value")
-    def validate_date(cls, v, values):
-        chain = LLMChain(
-            llm=values["llm"], prompt=DateTimeEntity.get_prompt(), verbose=True
-        )
-        result = chain.run({"query": v})
-        value: str | None = None
-        try:
-            return DateTime.parse_obj(json.loads(result))
-        except ValueError as e:
-            value = None
-            pass
-        return value
+    Entries are keyed by the normalized expression, the anchor date, the local time
+    zone and the parameters of the LLM, and are all dropped when the date changes.
+    Expressions relative to the current time, like "in a couple of hours", are anchored
+    on the minute instead.
+    """
 
-    @staticmethod
-    def get_prompt() -> PromptTemplate:
-        import datetime
-
-        current_time = datetime.datetime.now()
-
-        # In a couple of hours
-        in_couple_of_hours = current_time + datetime.timedelta(hours=2)
-
-        # Tomorrow
-        tomorrow = (current_time + datetime.timedelta(days=1)).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
+    TIME_RELATIVE_PATTERN = re.compile(
+        r"\b(hours?|minutes?|mins?|now|later|soon|in a (?:bit|while|moment))\b"
+    )
 
-        # Thursday 2pm
-        today = current_time.date()
-        thursday = today + datetime.timedelta((3 - today.weekday()) % 7)
-        thursday_2pm = datetime.datetime.combine(thursday, datetime.time(14, 0))
+    def __init__(self, max_entries: int = 1024):
+        self.entries = LRUCache(max_entries)
+        self.day: datetime.date | None = None
+        self._lock = threading.Lock()
 
-        # Next Tuesday 4pm
-        next_tuesday = today + datetime.timedelta((7 - today.weekday() + 1) % 7)
-        next_tuesday_4pm = datetime.datetime.combine(next_tuesday, datetime.time(16, 0))
+    @property
+    def stats(self) -> CacheStats:
+        return self.entries.stats
 
-        # Next week
-        next_week = (current_time + datetime.timedelta(weeks=1)).replace(
-            hour=0, minute=0, second=0, microsecond=0
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split()).strip(" .!?")
+
+    def key(
+        self,
+        text: str,
+        now: datetime.datetime | None = None,
+        llm: BaseLanguageModel | None = None,
+    ) -> tuple:
+        now = now or datetime.datetime.now()
+        with self._lock:
+            if self.day != now.date():
+                self.entries.clear()
+                self.day = now.date()
+        normalized = self.normalize(text)
+        anchor = (
+            now.replace(second=0, microsecond=0)
+            if self.TIME_RELATIVE_PATTERN.search(normalized)
+            else now.date()
         )
-        next_week = next_week - datetime.timedelta(days=next_week.weekday())
-
-        # Next month
-        next_month = (
-            current_time.replace(day=1) + datetime.timedelta(days=32)
-        ).replace(day=1)
-        next_month = next_month.replace(hour=0, minute=0, second=0, microsecond=0)
-        examples = []
-
-        # In a couple of hours
-        start_in_couple_of_hours = in_couple_of_hours.isoformat()
-        end_in_couple_of_hours = (
-            in_couple_of_hours + datetime.timedelta(hours=1, seconds=-1)
-        ).isoformat()
-        examples.append(
-            {
-                "text": "In a couple of hours",
-                "result": {
-                    "start": start_in_couple_of_hours,
-                    "end": end_in_couple_of_hours,
-                    "grain": 3600,
-                },
-            }
+        return (
+            normalized,
+            anchor.isoformat(),
+            now.astimezone().tzname(),
+            json.dumps(llm_params(llm), sort_keys=True, default=str),
         )
 
-        # Tomorrow
-        start_tomorrow = tomorrow.isoformat()
-        end_tomorrow = (tomorrow + datetime.timedelta(days=1, seconds=-1)).isoformat()
-        examples.append(
-            {
-                "text": "Tomorrow",
-                "result": {
-                    "start": start_tomorrow,
-                    "end": end_tomorrow,
-                    "grain": 24 * 3600,
-                },
-            }
-        )
-
-        # Thursday 2pm
-        start_thursday_2pm = thursday_2pm.isoformat()
-        end_thursday_2pm = (
-            thursday_2pm + datetime.timedelta(hours=1, seconds=-1)
-        ).isoformat()
-        examples.append(
-            {
-                "text": "Thursday 2pm",
-                "result": {
-                    "start": start_thursday_2pm,
-                    "end": end_thursday_2pm,
-                    "grain": 3600,
-                },
-            }
-        )
+    def get(self, key: tuple) -> DateTime | None:
+        return self.entries.get(key)
 
-        # Next Tuesday 4pm
-        start_next_tuesday_4pm = next_tuesday_4pm.isoformat()
-        end_next_tuesday_4pm = (
-            next_tuesday_4pm + datetime.timedelta(hours=1, seconds=-1)
-        ).isoformat()
-        examples.append(
-            {
-                "text": "Next Tuesday 4pm",
-                "result": {
-                    "start": start_next_tuesday_4pm,
-                    "end": end_next_tuesday_4pm,
-                    "grain": 3600,
-                },
-            }
-        )
+    def set(self, key: tuple, value: DateTime | None) -> None:
+        # Failed resolutions are not memoized, they might succeed on the next call
+        if value is not None:
+            self.entries.set(key, value)
 
-        # Next week
-        start_next_week = next_week.isoformat()
-        end_next_week = (next_week + datetime.timedelta(days=7, seconds=-1)).isoformat()
-        examples.append(
-            {
-                "text": "Next week",
-                "result": {
-                    "start": start_next_week,
-                    "end": end_next_week,
-                    "grain": 604800,
-                },
-            }
-        )
-        # Next month
-        start_next_month = next_month.isoformat()
-        one_month_duration = (
-            next_month.replace(day=1) + datetime.timedelta(days=32)
-        ).replace(day=1) - next_month
-        end_next_month = (next_month + one_month_duration).isoformat()
-        examples.append(
-            {
-                "text": "Next month",
-                "result": {
-                    "start": start_next_month,
-                    "end": end_next_month,
-                    "grain": one_month_duration.total_seconds(),
-                },
-            }
-        )
 
-        def escape_json(obj: dict) -> str:
-            return json.dumps(obj)
+class DateTimeEntity(Entity):
+    name: str = "datetime"
+    value: str | DateTime
+    requires_llm: ClassVar[bool] = True
+    # Only the dates the rules cannot resolve are looked up, so
+    # `resolution_cache.stats.hit_ratio` is the share of those resolved without the LLM
+    resolution_cache: ClassVar[DateTimeResolutionCache] = DateTimeResolutionCache()
+    # Resolve the common relative dates with `datetime_rules` and only call the LLM
+    # for the expressions the rules cannot parse
+    use_rules: ClassVar[bool] = True
+    PROMPT_EXAMPLES: ClassVar[list[str]] = [
+        "In a couple of hours",
+        "Tomorrow",
+        "Thursday 2pm",
+        "Next Tuesday 4pm",
+        "Next week",
+        "Next month",
+    ]
+    # Print the prompts of the date resolution chains
+    verbose: ClassVar[bool] = True
+    # Chains by LLM id, bounded so that the LLMs of past sessions are released
+    _chains: ClassVar[LRUCache] = LRUCache(max_entries=64)
+    _chains_lock: ClassVar[threading.Lock] = threading.Lock()
 
-        now = datetime.datetime.now()
-        jinja_template = Template(
-            """
-At this very moment, date time is {{now}}.
-For a given date expressed in natural language, output date time information in ISO format as shown in the examples:
+    @validator("value")
+    def validate_date(cls, v, values):
+        if isinstance(v, DateTime):
+            return v
+        return cls.resolve(v, values.get("llm"))
+
+    @classmethod
+    async def aparse_obj(cls, obj: dict[str, Any]) -> "DateTimeEntity":
+        if isinstance(obj.get("value"), str):
+            obj = {**obj, "value": await cls.aresolve(obj["value"], obj.get("llm"))}
+        return cls.parse_obj(obj)
+
+    @classmethod
+    def resolve_with_rules(cls, text: str) -> DateTime | None:
+        if not cls.use_rules:
+            return None
+        result = datetime_rules.parse_datetime(text)
+        return DateTime.parse_obj(result) if result is not None else None
+
+    @classmethod
+    def resolve(cls, text: str, llm: BaseLanguageModel) -> DateTime | None:
+        value = cls.resolve_with_rules(text)
+        if value is not None:
+            return value
+        key = cls.resolution_cache.key(text, llm=llm)
+        value = cls.resolution_cache.get(key)
+        if value is None:
+            value = cls.parse_result(cls.get_chain(llm).run(cls.prompt_inputs(text)))
+            cls.resolution_cache.set(key, value)
+        return value
 
-EXAMPLES:
-{% for e in examples %}
-Natural language date:
-{{e.text}}
-result:
-{{ escape_json(e.result) }}
-{% endfor %}
-END OF EXAMPLES
+    @classmethod
+    async def aresolve(cls, text: str, llm: BaseLanguageModel) -> DateTime | None:
+        value = cls.resolve_with_rules(text)
+        if value is not None:
+            return value
+        key = cls.resolution_cache.key(text, llm=llm)
+        value = cls.resolution_cache.get(key)
+        if value is None:
+            value = cls.parse_result(await cls.get_chain(llm).arun(cls.prompt_inputs(text)))
+            cls.resolution_cache.set(key, value)
+        return value
 
-Natural language date:{% raw %}
-{{query}}{% endraw %}
-ISO:
-"""
-        )
+    @staticmethod
+    def parse_result(result: str) -> DateTime | None:
         try:
-            template: str = jinja_template.render(
-                {
-                    "examples": examples,
-                    "now": now.strftime(
-                        "%A, %B %d, %Y",
-                    ),
-                    "escape_json": escape_json,
-                }
-            )
-            try:
-                return PromptTemplate(
-                    input_variables=[
-                        "query",
-                    ],
-                    template_format="jinja2",
-                    template=template,
+            return DateTime.parse_obj(json.loads(result))
+        except ValueError as e:
+            return None
+
+    @classmethod
+    def get_chain(cls, llm: BaseLanguageModel) -> LLMChain:
+        """Return the chain resolving dates with `llm`, built once per day and LLM instance.
+
+        Run it with `prompt_inputs`, which adds the current time and the examples
+        relative to it.
+        """
+        today = datetime.date.today()
+        with cls._chains_lock:
+            cached = cls._chains.get(id(llm))
+            # The llm is kept with its chain to check that its id was not reused
+            if cached is None or cached[0] != today or cached[1] is not llm:
+                cached = (
+                    today,
+                    llm,
+                    LLMChain(llm=llm, prompt=cls.get_prompt(), verbose=cls.verbose),
                 )
-            except Exception as e:
-                print(e)
-                raise e
+                cls._chains.set(id(llm), cached)
+            return cached[2]
+
+    @staticmethod
+    def is_time_relative(text: str) -> bool:
+        normalized = DateTimeResolutionCache.normalize(text)
+        return DateTimeResolutionCache.TIME_RELATIVE_PATTERN.search(normalized) is not None
+
+    @staticmethod
+    def render_examples(texts: list[str], now: datetime.datetime) -> str:
+        # The examples are resolved by the same rules as the fast path
+        examples = [
+            {"text": text, "result": datetime_rules.parse_datetime(text, now)} for text in texts
+        ]
+        return EXAMPLES_TEMPLATE.render(examples=examples, escape_json=json.dumps)
+
+    @classmethod
+    def prompt_inputs(cls, text: str, now: datetime.datetime | None = None) -> dict[str, str]:
+        """Return the inputs of the chain of `get_chain` to resolve `text` at `now`."""
+        current_time = now or datetime.datetime.now()
+        return {
+            "query": text,
+            "now": current_time.strftime("%A, %B %d, %Y %H:%M"),
+            "time_relative_examples": cls.render_examples(
+                [e for e in cls.PROMPT_EXAMPLES if cls.is_time_relative(e)], current_time
+            ),
+        }
 
-        except Exception as e:
-            print(e)
-            raise e
+    @staticmethod
+    def get_prompt(now: datetime.datetime | None = None) -> PromptTemplate:
+        """Return the prompt with the examples relative to the date of `now` rendered.
+
+        The examples relative to the current time, like "In a couple of hours", and the
+        current time itself are inputs of the prompt, see `prompt_inputs`.
+        """
+        current_time = now or datetime.datetime.now()
+        template = PROMPT_TEMPLATE.render(
+            now=NOW_PLACEHOLDER,
+            time_relative_examples=TIME_RELATIVE_EXAMPLES_PLACEHOLDER,
+            examples=DateTimeEntity.render_examples(
+                [
+                    e
+                    for e in DateTimeEntity.PROMPT_EXAMPLES
+                    if not DateTimeEntity.is_time_relative(e)
+                ],
+                current_time,
+            ),
+            query=QUERY_PLACEHOLDER,
+        )
+        # Rendered once, so the prompt is formatted with a plain string substitution
+        template = (
+            template.replace("{", "{{")
+            .replace("}", "}}")
+            .replace(QUERY_PLACEHOLDER, "{query}")
+            .replace(NOW_PLACEHOLDER, "{now}")
+            .replace(TIME_RELATIVE_EXAMPLES_PLACEHOLDER, "{time_relative_examples}")
+        )
+        return PromptTemplate(
+            input_variables=["query", "now", "time_relative_examples"], template=template
+        )
 
 
 def main():
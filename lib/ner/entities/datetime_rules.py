@@ -0,0 +1,138 @@
+"""Deterministic parsing of the common relative dates, before falling back to the LLM.
+
+Handles the expressions used as examples in the `DateTimeEntity` prompt:
+"in a couple of hours", "in 3 hours", "today", "tomorrow", "Thursday", "next Tuesday",
+any of those days followed by a time ("Thursday 2pm", "tomorrow at 14:30"),
+"next week" and "next month". Results have the `DateTime` structure.
+"""
+import datetime
+import re
+from typing import Optional
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+WEEKDAYS = {
+    "monday": 0,
+    "mon": 0,
+    "tuesday": 1,
+    "tue": 1,
+    "tues": 1,
+    "wednesday": 2,
+    "wed": 2,
+    "thursday": 3,
+    "thu": 3,
+    "thurs": 3,
+    "friday": 4,
+    "fri": 4,
+    "saturday": 5,
+    "sat": 5,
+    "sunday": 6,
+    "sun": 6,
+}
+
+NUMBERS = {"one": 1, "an": 1, "a": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6}
+
+IN_HOURS_PATTERN = re.compile(
+    r"in (?:(?P<couple>a couple of)|(?P<few>a few)|(?P<count>\d+|one|an|a|two|three|four|five|six)) hours?"
+)
+DAY_PATTERN = re.compile(
+    r"(?:on )?(?:(?P<today>today)|(?P<tomorrow>tomorrow)|(?:(?P<next>next|this) )?(?P<weekday>"
+    + "|".join(sorted(WEEKDAYS, key=len, reverse=True))
+    + r"))(?: (?:at )?(?P<time>.+))?"
+)
+TIME_PATTERN = re.compile(
+    r"(?P<hour>\d{1,2})(?:[:h](?P<minute>\d{2}))? ?(?P<meridiem>am|pm|a\.m\.|p\.m\.)?"
+)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().replace(",", " ").split()).strip(" .!?")
+
+
+def timespan(start: datetime.datetime, duration: int) -> dict:
+    """Return the `DateTime` structure of `duration` seconds starting at `start`."""
+    end = start + datetime.timedelta(seconds=duration - 1)
+    return {"start": start.isoformat(), "end": end.isoformat(), "grain": duration}
+
+
+def parse_time(text: str) -> Optional[datetime.time]:
+    match = TIME_PATTERN.fullmatch(text)
+    if match is None:
+        return None
+    hour = int(match["hour"])
+    minute = int(match["minute"] or 0)
+    meridiem = (match["meridiem"] or "").replace(".", "")
+    # A bare "4" is ambiguous, an hour needs either minutes or am/pm
+    if not meridiem and match["minute"] is None:
+        return None
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == "pm" else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return datetime.time(hour, minute)
+
+
+def parse_in_hours(text: str, now: datetime.datetime) -> Optional[dict]:
+    match = IN_HOURS_PATTERN.fullmatch(text)
+    if match is None:
+        return None
+    if match["couple"]:
+        hours = 2
+    elif match["few"]:
+        hours = 3
+    else:
+        hours = NUMBERS.get(match["count"]) or int(match["count"])
+    return timespan(now.replace(microsecond=0) + datetime.timedelta(hours=hours), HOUR)
+
+
+def parse_day(text: str, now: datetime.datetime) -> Optional[dict]:
+    match = DAY_PATTERN.fullmatch(text)
+    if match is None:
+        return None
+    today = now.date()
+    if match["today"]:
+        day = today
+    elif match["tomorrow"]:
+        day = today + datetime.timedelta(days=1)
+    else:
+        days_ahead = (WEEKDAYS[match["weekday"]] - today.weekday()) % 7
+        # "next Tuesday" is never today
+        if match["next"] == "next" and days_ahead == 0:
+            days_ahead = 7
+        day = today + datetime.timedelta(days=days_ahead)
+    if match["time"] is None:
+        return timespan(datetime.datetime.combine(day, datetime.time()), DAY)
+    time = parse_time(match["time"])
+    if time is None:
+        return None
+    return timespan(datetime.datetime.combine(day, time), HOUR)
+
+
+def parse_next_period(text: str, now: datetime.datetime) -> Optional[dict]:
+    today = now.date()
+    if text == "next week":
+        monday = today + datetime.timedelta(days=7 - today.weekday())
+        return timespan(datetime.datetime.combine(monday, datetime.time()), WEEK)
+    if text == "next month":
+        start = (today.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+        return timespan(
+            datetime.datetime.combine(start, datetime.time()),
+            int((end - start).total_seconds()),
+        )
+    return None
+
+
+def parse_datetime(text: str, now: Optional[datetime.datetime] = None) -> Optional[dict]:
+    """Return the timespan of `text` relative to `now`, or None if it is not supported."""
+    now = now or datetime.datetime.now()
+    text = normalize(text)
+    for parse in (parse_in_hours, parse_next_period, parse_day):
+        result = parse(text, now)
+        if result is not None:
+            return result
+    return None
@@ -0,0 +1,86 @@
+import heapq
+import math
+import re
+from operator import itemgetter
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough number of LLM tokens of `text`, about 4 characters each in English."""
+    return len(text) // 4 + 1
+
+
+class ExampleIndex:
+    """BM25 index of documents, used to select the few-shot examples similar to an input.
+
+    Scores are computed from an inverted index, so a query only visits the documents
+    sharing a term with it. Terms found in more than `max_document_frequency` of the
+    documents of a large index, like "is" or "your", barely change the ranking while
+    being the slowest to score, so they are not indexed.
+    """
+
+    def __init__(
+        self,
+        documents: Iterable[str],
+        k1: float = 1.5,
+        b: float = 0.75,
+        max_document_frequency: float = 0.2,
+    ):
+        self.k1 = k1
+        self.b = b
+        term_counts = [Counter(tokenize(document)) for document in documents]
+        self.size = len(term_counts)
+        lengths = [sum(counts.values()) for counts in term_counts]
+        average_length = sum(lengths) / self.size if self.size else 0.0
+        postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+        for i, counts in enumerate(term_counts):
+            norm = k1 * (1 - b + b * lengths[i] / average_length) if average_length else k1
+            for term, count in counts.items():
+                postings[term].append((i, count * (k1 + 1) / (count + norm)))
+        # term -> (documents, scores of the term in the documents)
+        self.postings: dict[str, tuple[list[int], list[float]]] = {}
+        for term, documents in postings.items():
+            if len(documents) > max(max_document_frequency * self.size, 50):
+                continue
+            idf = math.log(1 + (self.size - len(documents) + 0.5) / (len(documents) + 0.5))
+            self.postings[term] = (
+                [i for i, _ in documents],
+                [idf * weight for _, weight in documents],
+            )
+
+    def scores(self, query: str) -> dict[int, float]:
+        scores: dict[int, float] = {}
+        get = scores.get
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                for i, score in zip(*self.postings[term]):
+                    scores[i] = get(i, 0.0) + score
+        return scores
+
+    def top(
+        self, query: str, k: int, candidates: Optional[Iterable[int]] = None
+    ) -> list[int]:
+        """Return the `k` documents the most similar to `query`, the most similar first.
+
+        Documents sharing no term with the query come last, ordered by position.
+        """
+        scores = self.scores(query)
+        documents = range(self.size) if candidates is None else list(candidates)
+        if candidates is not None:
+            allowed = set(documents)
+            scores = {i: score for i, score in scores.items() if i in allowed}
+        best = [i for i, _ in heapq.nlargest(k, scores.items(), key=itemgetter(1))]
+        if len(best) < k:
+            for i in documents:
+                if i not in scores:
+                    best.append(i)
+                    if len(best) == k:
+                        break
+        return best
@@ -0,0 +1,98 @@
+"""Deterministic extractors resolving an entity without calling the NER LLM.
+
+An extractor only returns a value when the whole user input is the entity, e.g. "514-666-7777"
+or "yes", so that the input cannot contain other entities the LLM would have found.
+"""
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Type
+
+from .entities.basic_entities import (
+    EMAIL_PATTERN,
+    EmailEntity,
+    Entity,
+    IntEntity,
+)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split()).strip(" .!")
+
+
+def last_ai_message(history: str) -> str:
+    _, _, message = history.rpartition("AI:")
+    return message.split("\nUser:")[0].strip()
+
+
+class Extractor(ABC):
+    @abstractmethod
+    def extract(self, text: str, history: str = "") -> Optional[Any]:
+        """Return the value of the entity if `text` is only that entity, else None."""
+
+
+class RegexExtractor(Extractor):
+    def __init__(self, pattern: str, flags: int = 0):
+        self.pattern = re.compile(pattern, flags)
+
+    def extract(self, text: str, history: str = "") -> Optional[Any]:
+        text = text.strip().rstrip(".!")
+        return text if self.pattern.fullmatch(text) else None
+
+
+class PhoneNumberExtractor(RegexExtractor):
+    def __init__(self):
+        super().__init__(r"\d{3}-\d{3}-\d{4}")
+
+
+class EmailExtractor(RegexExtractor):
+    def __init__(self):
+        super().__init__(EMAIL_PATTERN.strip("^$"))
+
+
+class IntExtractor(Extractor):
+    def extract(self, text: str, history: str = "") -> Optional[int]:
+        text = normalize(text)
+        return int(text) if text.isdecimal() else None
+
+
+class YesNoExtractor(Extractor):
+    """Resolve "yes" and "no" answers, when the last AI message asked a yes/no question.
+
+    Not a default extractor: the question may be about something else than the field the
+    process is asking for, like "Would that work?", so only use it for the fields which
+    are the only yes/no question of their process.
+    """
+
+    YES = {"yes", "yep", "yeah", "yup", "sure", "correct", "that's correct", "yes please"}
+    NO = {"no", "nope", "nah", "not really", "no thanks"}
+    QUESTION_PATTERN = re.compile(
+        r"(?:^|[.!?]\s+)(?:is|are|am|do|does|did|can|could|would|will|shall|should|have|has|may)\b[^.!?]*\?$",
+        re.IGNORECASE,
+    )
+
+    def extract(self, text: str, history: str = "") -> Optional[bool]:
+        if not self.QUESTION_PATTERN.search(last_ai_message(history)):
+            return None
+        text = normalize(text).rstrip(",")
+        if text in self.YES:
+            return True
+        if text in self.NO:
+            return False
+        return None
+
+
+DEFAULT_EXTRACTORS: dict[Type[Entity], Type[Extractor]] = {
+    EmailEntity: EmailExtractor,
+    IntEntity: IntExtractor,
+}
+
+
+def default_extractors(
+    entities: dict[str, Type[Entity] | tuple[Type[Entity], Any]]
+) -> dict[str, Extractor]:
+    """Return the extractors of the entity types in `DEFAULT_EXTRACTORS`, by entity name."""
+    return {
+        name: DEFAULT_EXTRACTORS[definition]()
+        for name, definition in entities.items()
+        if not isinstance(definition, tuple) and definition in DEFAULT_EXTRACTORS
+    }
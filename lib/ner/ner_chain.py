@@ -1,14 +1,60 @@
-from typing import Optional, Type
+import asyncio
+import threading
+import time
+import weakref
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Type
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from langchain.chains.base import Chain
 from langchain.chains.sequential import SequentialChain
 from langchain.chains.transform import TransformChain
 from langchain.base_language import BaseLanguageModel
-from pydantic import BaseModel, root_validator
+from pydantic import BaseModel, Field, PrivateAttr, root_validator
 from langchain import LLMChain
 import json
 
 from .ner_prompt_template import NERPromptTemplate
 from .entities.basic_entities import EntityExample, Entity
+from .extractors import Extractor, default_extractors
+from ..cache import CacheStats, CachedLLMChain, ResponseCache
+from ..logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class AsyncTransformChain(TransformChain):
+    """`TransformChain` which can also run an async transform."""
+
+    atransform: Optional[Callable[[Dict[str, str]], Awaitable[Dict[str, Any]]]] = None
+
+    async def _acall(
+        self,
+        inputs: Dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        if self.atransform is None:
+            return self.transform(inputs)
+        return await self.atransform(inputs)
+
+
+class LoopSemaphores:
+    """One `asyncio.Semaphore` of `value` per event loop, shared by the tasks of the loop."""
+
+    def __init__(self, value: int):
+        self.value = value
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.value)
+            return semaphore
 
 
 class NERChain(SequentialChain):
@@ -18,85 +64,367 @@ class NERChain(SequentialChain):
     output_key: str = "entities"
     llm: BaseLanguageModel
     examples: Optional[list[EntityExample]] = None
+    # Few-shot examples selected by similarity with the input, see `NERPromptTemplate`
+    max_examples: Optional[int] = None
+    example_token_budget: Optional[int] = None
     entities: dict[str, Type[Entity] | tuple[Type[Entity], BaseLanguageModel]]
     chains: list[Chain] = []
+    # Entities which need an LLM to be parsed, like `DateTimeEntity`, are resolved
+    # concurrently on `executor` with at most `max_concurrency` at the same time
+    max_concurrency: int = 4
+    # Timeout in seconds to resolve one of those entities once started, the late ones
+    # are dropped
+    resolution_timeout: Optional[float] = None
+    executor: Optional[Executor] = None
+    owns_executor: bool = False
+    # Cache of the NER LLM responses, shared by the sessions since the prompt only
+    # depends on the user input and the last AI message
+    cache: Optional[ResponseCache] = None
+    # Extractors by entity name, tried before the LLM on the entity the process is
+    # asking for, passed as the optional `focus` input. The optional `relevant_entities`
+    # input restricts the entities and examples of the prompt, and the optional
+    # `offered_options` input lists in the prompt the options the User may refer to. When
+    # an extractor resolves the whole input, the LLM is not called. Defaults to
+    # `default_extractors(entities)`.
+    extractors: dict[str, Extractor] = {}
+    # `hits` are the turns resolved by the extractors, `misses` the LLM calls
+    extraction_stats: CacheStats = Field(default_factory=CacheStats)
+    _extraction_stats_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def skip_rate(self) -> float:
+        """Share of the turns for which the NER LLM call was skipped."""
+        return self.extraction_stats.hit_ratio
+
+    def extract(self, inputs: Dict[str, Any]) -> Optional[list[Entity]]:
+        """Return the entity the process is asking for if an extractor resolves the input."""
+        focus = inputs.get("focus")
+        extractor = self.extractors.get(focus) if focus else None
+        if extractor is None or focus not in self.entities:
+            return None
+        value = extractor.extract(inputs["input"], inputs.get("history", ""))
+        if value is None:
+            return None
+        entity_type, llm = self.get_entity_type(self.entities[focus], self.llm)
+        entity = self.parse_entity(entity_type, {"name": focus, "value": value}, llm)
+        return [entity] if entity is not None and entity.value is not None else None
+
+    def _extract_or_none(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        entities = self.extract(inputs)
+        # The chain and its stats are shared by the sessions
+        with self._extraction_stats_lock:
+            if entities is None:
+                self.extraction_stats.misses += 1
+                return None
+            self.extraction_stats.hits += 1
+            hit_ratio = self.extraction_stats.hit_ratio
+        logger.debug(f"Skipped the NER LLM call, {hit_ratio:.0%} of the turns so far")
+        return {self.output_key: entities}
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        outputs = self._extract_or_none(inputs)
+        if outputs is not None:
+            return outputs
+        # Optional inputs listing the entities to extract, all of them by default, and the
+        # options offered to the User
+        return super()._call(
+            {"relevant_entities": None, "offered_options": None, **inputs}, run_manager
+        )
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        outputs = self._extract_or_none(inputs)
+        if outputs is not None:
+            return outputs
+        return await super()._acall(
+            {"relevant_entities": None, "offered_options": None, **inputs}, run_manager
+        )
 
     @staticmethod
-    def parse_entities(
-        entities_definition: dict[str, Type[BaseModel]],
-        raw_entities: str,
-        llm: BaseLanguageModel,
-        verbose: bool = False,
-    ) -> str:
-        validated_entities = []
+    def load_raw_entities(raw_entities: str) -> list[dict]:
         # Dumb models might predict more that just entities and repeat examples
         # but they do generally ok at predicting a valid json object with entities.
         # So we just split by new line and take the first line.
         raw_entities = raw_entities.strip().split("\n")[0]
+        try:
+            return json.loads(raw_entities)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Could not parse entities predicted by the LLM: {raw_entities}")
+            return []
+
+    @staticmethod
+    def get_entity_type(
+        entity_definition: Type[Entity] | tuple[Type[Entity], BaseLanguageModel],
+        llm: BaseLanguageModel,
+    ) -> tuple[Type[Entity], BaseLanguageModel]:
+        """Return the entity type and the llm it should use to parse its value."""
+        if isinstance(entity_definition, tuple):
+            return entity_definition
+        return entity_definition, llm
 
+    @staticmethod
+    def parse_entity(
+        entity_type: Type[Entity], raw_entity: dict, llm: BaseLanguageModel
+    ) -> Entity | None:
         try:
-            for raw_entity in json.loads(raw_entities):
-                entity_definition = entities_definition.get(raw_entity["name"], None)
-                if entity_definition is not None:
-                    entity_type: Type[Entity]
-                    if isinstance(entity_definition, tuple):
-                        entity_type, llm = entity_definition  # type: ignore
-                        raw_entity["llm"] = llm
-                    else:
-                        entity_type = entity_definition  # type: ignore
-                        parsed_entity: dict | None = None
-                        try:
-                            # Entity can use the llm to parse the value
-                            parsed_entity = entity_type.parse_obj(
-                                {**raw_entity, "llm": llm}
-                            ).dict(include={"name", "value"})
-                        except:
-                            parsed_entity = None
-                        # An invalid entity will have a null value and we don't want to include it
-                        if parsed_entity and parsed_entity["value"] is not None:
-                            validated_entities.append(parsed_entity)
+            # Entity can use the llm to parse the value
+            return entity_type.parse_obj({**raw_entity, "llm": llm})
+        except:
+            return None
 
-        except json.JSONDecodeError as e:
-            pass
-            # raise ValueError(f"Could not parse entities: {raw_entities}")
+    @staticmethod
+    async def aparse_entity(
+        entity_type: Type[Entity], raw_entity: dict, llm: BaseLanguageModel
+    ) -> Entity | None:
+        try:
+            return await entity_type.aparse_obj({**raw_entity, "llm": llm})
+        except:
+            return None
+
+    @staticmethod
+    def validated_entities(
+        parsed_entities: list[Entity | None], verbose: bool = False
+    ) -> list[Entity]:
+        # An invalid entity will have a null value and we don't want to include it
+        validated_entities = [
+            e for e in parsed_entities if e is not None and e.value is not None
+        ]
         if verbose:
-            print(f"Validated entities: {validated_entities}")
-        return json.dumps(validated_entities)
+            print(f"Validated entities: {NERChain.dump_entities(validated_entities)}")
+        return validated_entities
+
+    @staticmethod
+    def dump_entities(entities: list[Entity]) -> str:
+        """Serialize entities to JSON, for consumers outside of the chains."""
+        return json.dumps([e.dict(include={"name", "value"}) for e in entities])
+
+    @staticmethod
+    def requires_llm(
+        entity_definition: Type[Entity] | tuple[Type[Entity], BaseLanguageModel]
+    ) -> bool:
+        return isinstance(entity_definition, tuple) or entity_definition.requires_llm
+
+    @staticmethod
+    def get_parsing_jobs(
+        entities_definition: dict[str, Type[BaseModel]],
+        raw_entities: str,
+        llm: BaseLanguageModel,
+    ) -> list[tuple[Type[Entity], dict, BaseLanguageModel, bool]]:
+        jobs = []
+        for raw_entity in NERChain.load_raw_entities(raw_entities):
+            entity_definition = entities_definition.get(raw_entity["name"], None)
+            if entity_definition is not None:
+                entity_type, entity_llm = NERChain.get_entity_type(entity_definition, llm)  # type: ignore
+                jobs.append(
+                    (
+                        entity_type,
+                        raw_entity,
+                        entity_llm,
+                        NERChain.requires_llm(entity_definition),  # type: ignore
+                    )
+                )
+        return jobs
+
+    @staticmethod
+    def parse_entities(
+        entities_definition: dict[str, Type[BaseModel]],
+        raw_entities: str,
+        llm: BaseLanguageModel,
+        verbose: bool = False,
+        executor: Optional[Executor] = None,
+        timeout: Optional[float] = None,
+    ) -> list[Entity]:
+        """Parse the raw entities predicted by the LLM.
+
+        Entities requiring an LLM to be parsed are resolved concurrently on `executor` if
+        provided. Those still running `timeout` seconds after they started are dropped,
+        the time spent waiting for a worker of `executor` does not count.
+        """
+        jobs = NERChain.get_parsing_jobs(entities_definition, raw_entities, llm)
+        started: dict[int, float] = {}
+        condition = threading.Condition()
+
+        def parse(i: int, entity_type, raw_entity, entity_llm) -> Entity | None:
+            with condition:
+                started[i] = time.monotonic()
+                condition.notify_all()
+            return NERChain.parse_entity(entity_type, raw_entity, entity_llm)
+
+        def notify(_: Future) -> None:
+            with condition:
+                condition.notify_all()
+
+        futures: dict[int, Future] = {}
+        if executor is not None:
+            futures = {
+                i: executor.submit(parse, i, entity_type, raw_entity, entity_llm)
+                for i, (entity_type, raw_entity, entity_llm, requires_llm) in enumerate(jobs)
+                if requires_llm
+            }
+            for future in futures.values():
+                future.add_done_callback(notify)
+        parsed_entities: list[Entity | None] = [
+            None
+            if i in futures
+            else NERChain.parse_entity(entity_type, raw_entity, entity_llm)
+            for i, (entity_type, raw_entity, entity_llm, _) in enumerate(jobs)
+        ]
+        timed_out: set[int] = set()
+        if futures and timeout is None:
+            wait(futures.values())
+        elif futures:
+            with condition:
+                while True:
+                    now = time.monotonic()
+                    pending = [i for i, future in futures.items() if not future.done()]
+                    deadlines = [started[i] + timeout for i in pending if i in started]
+                    timed_out = {i for i in pending if i in started and started[i] + timeout <= now}
+                    if len(timed_out) == len(pending):
+                        break
+                    # Wait for a job to start or finish, or for the next deadline
+                    remaining = [d - now for d in deadlines if d > now]
+                    condition.wait(min(remaining) if remaining else None)
+        for i, future in futures.items():
+            if i in timed_out:
+                # The job keeps its worker until the LLM answers, only its result is dropped
+                logger.warning(f"Timed out resolving entity {jobs[i][1]}")
+            else:
+                parsed_entities[i] = future.result()
+        return NERChain.validated_entities(parsed_entities, verbose)
+
+    @staticmethod
+    async def aparse_entities(
+        entities_definition: dict[str, Type[BaseModel]],
+        raw_entities: str,
+        llm: BaseLanguageModel,
+        verbose: bool = False,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+    ) -> list[Entity]:
+        """Async counterpart of `parse_entities`.
+
+        At most `max_concurrency` entities are resolved at the same time, or as many as
+        `semaphore` allows when it is shared with other calls. Those still running
+        `timeout` seconds after they acquired the semaphore are cancelled and dropped.
+        """
+        if semaphore is None and max_concurrency:
+            semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def parse(entity_type, raw_entity, entity_llm) -> Entity | None:
+            try:
+                return await asyncio.wait_for(
+                    NERChain.aparse_entity(entity_type, raw_entity, entity_llm), timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out resolving entity {raw_entity}")
+                return None
+
+        async def bounded_parse(entity_type, raw_entity, entity_llm) -> Entity | None:
+            if semaphore is None:
+                return await parse(entity_type, raw_entity, entity_llm)
+            async with semaphore:
+                return await parse(entity_type, raw_entity, entity_llm)
+
+        jobs = NERChain.get_parsing_jobs(entities_definition, raw_entities, llm)
+        parsed_entities: list[Entity | None] = list(
+            await asyncio.gather(
+                *[
+                    bounded_parse(entity_type, raw_entity, entity_llm)
+                    if requires_llm
+                    else NERChain.aparse_entity(entity_type, raw_entity, entity_llm)
+                    for entity_type, raw_entity, entity_llm, requires_llm in jobs
+                ]
+            )
+        )
+        return NERChain.validated_entities(parsed_entities, verbose)
+
+    def close(self) -> None:
+        """Shut down the executor resolving the entities, if this chain created it."""
+        if self.owns_executor and self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
 
     @root_validator(pre=True)
     def validate_chains(cls, values: dict) -> dict:
         if "chains" in values:
             raise ValueError("Cannot specify chains in NERChain")
 
-        ner_chain = LLMChain(
+        llm_chain_kwargs = dict(
             llm=values["llm"],
             verbose=values["verbose"],
             output_key="raw_entities",
             prompt=NERPromptTemplate(
-                input_variables=["input", "history"],
+                input_variables=["input", "history", "relevant_entities", "offered_options"],
                 examples=values.get("examples", None),
                 entities=values["entities"],
-                additional_instructions=values.get("additional_instructions", None)
+                additional_instructions=values.get("additional_instructions", None),
+                max_examples=values.get("max_examples"),
+                example_token_budget=values.get("example_token_budget"),
             ),
         )
+        ner_chain = (
+            CachedLLMChain(**llm_chain_kwargs, cache=values["cache"])
+            if values.get("cache") is not None
+            else LLMChain(**llm_chain_kwargs)
+        )
 
-        def transform(raw_entities: dict[str, str]) -> dict[str, str]:
+        # Shared by all the sessions using this chain, so it bounds the number of
+        # entities resolved at the same time by the process. Pass `executor` to share it
+        # between chains, else the chain creates one and `close` shuts it down.
+        max_concurrency = values.get("max_concurrency", 4)
+        if values.get("executor") is None and max_concurrency > 1:
+            values["executor"] = ThreadPoolExecutor(
+                max_workers=max_concurrency, thread_name_prefix="entity-resolution"
+            )
+            values["owns_executor"] = True
+        executor = values.get("executor")
+        # The same bound for the turns run on an event loop, with one semaphore per loop
+        semaphores = LoopSemaphores(max_concurrency)
+
+        # Entities are passed to the next chains as `Entity` objects
+        def transform(raw_entities: dict[str, str]) -> dict[str, Any]:
             return {
                 "entities": NERChain.parse_entities(
                     values["entities"],
                     raw_entities["raw_entities"],
                     values["llm"],
                     values["verbose"],
+                    executor=executor,
+                    timeout=values.get("resolution_timeout"),
+                )
+            }
+
+        async def atransform(raw_entities: dict[str, str]) -> dict[str, Any]:
+            return {
+                "entities": await NERChain.aparse_entities(
+                    values["entities"],
+                    raw_entities["raw_entities"],
+                    values["llm"],
+                    values["verbose"],
+                    timeout=values.get("resolution_timeout"),
+                    semaphore=semaphores.get(),
                 )
             }
 
-        transform_chain = TransformChain(
+        transform_chain = AsyncTransformChain(
             input_variables=["raw_entities"],
             output_variables=["entities"],
             verbose=values["verbose"],
             transform=transform,
+            atransform=atransform,
         )
 
         values["chains"] = [ner_chain, transform_chain]
+        values["extractors"] = {
+            **default_extractors(values["entities"]),
+            **(values.get("extractors") or {}),
+        }
 
         return values
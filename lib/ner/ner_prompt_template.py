@@ -1,8 +1,10 @@
 import json
-from typing import Any, Optional, Type
+from typing import Any, Iterable, Optional, Type
 from langchain.prompts.base import StringPromptTemplate
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from .entities.basic_entities import EntityExample
+from .example_index import ExampleIndex, estimate_tokens
+from ..cache import LRUCache
 
 PROMPT_FEW_SHOTS = """
 Extract entities {variable_names} from the 'text', considering the 'context' as in the following examples.
@@ -32,25 +34,144 @@ class NERPromptTemplate(StringPromptTemplate):
     template: str = None
     examples: Optional[list[EntityExample]] = None
     entities: dict[str, Type[BaseModel]]
+    # Only include the `max_examples` examples the most similar to the input and its
+    # context, within `example_token_budget` tokens. All the examples by default.
+    max_examples: Optional[int] = None
+    example_token_budget: Optional[int] = None
+    _example_blocks: list[str] = PrivateAttr(default_factory=list)
+    _example_entity_names: list[frozenset[str]] = PrivateAttr(default_factory=list)
+    _compiled_template: str = PrivateAttr(default="")
+    # Templates restricted to subsets of the entities, by subset
+    _pruned_templates: LRUCache = PrivateAttr(default_factory=lambda: LRUCache(128))
+    # Templates with selected examples, by examples and subset of the entities
+    _selected_templates: LRUCache = PrivateAttr(default_factory=lambda: LRUCache(1024))
+    _example_index: Optional[ExampleIndex] = PrivateAttr(default=None)
+    _example_tokens: list[int] = PrivateAttr(default_factory=list)
 
-    def format(self, **kwargs: Any) -> str:
-        variable_names = ", ".join(self.entities.keys())
-        examples = self.stringify_dict_for_template(
-            [
+    def __init__(self, **data: Any):
+        super().__init__(**data)
+        # Everything but the context and the input is static, so it is rendered once.
+        # Fields must not be mutated after construction.
+        self._example_blocks = [
+            self.stringify_example(
                 example.dict(exclude={"entities": {"__all__": {"description"}}})
-                for example in self.examples
-            ]
-        ) if self.examples else ""
+            )
+            for example in self.examples or []
+        ]
+        self._example_entity_names = [
+            frozenset(entity.name for entity in example.entities)
+            for example in self.examples or []
+        ]
+        self._compiled_template = self.compile_template(self._example_blocks)
+        if self.examples and (
+            self.max_examples is not None or self.example_token_budget is not None
+        ):
+            self._example_index = ExampleIndex(
+                f"{example.context or ''}\n{example.text}" for example in self.examples
+            )
+            self._example_tokens = [estimate_tokens(block) for block in self._example_blocks]
+
+    def compile_template(
+        self, example_blocks: list[str], entity_names: Optional[Iterable[str]] = None
+    ) -> str:
+        """Render the static part of the prompt, leaving `{context}` and `{input}`."""
+        variable_names = ", ".join(
+            entity_names if entity_names is not None else self.entities.keys()
+        )
         prompt_template = self.template
         if self.template is None:
             prompt_template = PROMPT_FEW_SHOTS if self.examples else PROMPT_FINE_TUNED
 
-        template = prompt_template.format(
+        return prompt_template.format(
             variable_names=variable_names,
-            examples=examples,
+            examples="\n\n\n".join(example_blocks),
             additional_instructions=self.additional_instructions,
         )
+
+    def relevant_examples(self, relevant: frozenset[str]) -> list[int]:
+        """Return the examples showing relevant entities, or no entity at all.
+
+        Examples without entities are kept, as they show when not to extract any.
+        """
+        return [
+            i
+            for i, names in enumerate(self._example_entity_names)
+            if not names or names & relevant
+        ]
+
+    def get_pruned_template(self, relevant_entities: Iterable[str]) -> str:
+        """Return the template only listing the relevant entities and their examples."""
+        relevant = frozenset(relevant_entities)
+        template = self._pruned_templates.get(relevant)
+        if template is None:
+            template = self.compile_template(
+                [self._example_blocks[i] for i in self.relevant_examples(relevant)],
+                [name for name in self.entities.keys() if name in relevant],
+            )
+            self._pruned_templates.set(relevant, template)
+        return template
+
+    def select_examples(
+        self, query: str, relevant_entities: Optional[Iterable[str]] = None
+    ) -> list[int]:
+        """Return the examples the most similar to `query` fitting in the token budget.
+
+        They are returned in their original order.
+        """
+        assert self._example_index is not None
+        candidates = (
+            self.relevant_examples(frozenset(relevant_entities))
+            if relevant_entities
+            else None
+        )
+        selected = []
+        tokens = 0
+        for i in self._example_index.top(
+            query, self.max_examples or len(self._example_blocks), candidates
+        ):
+            if (
+                self.example_token_budget is not None
+                and tokens + self._example_tokens[i] > self.example_token_budget
+            ):
+                continue
+            tokens += self._example_tokens[i]
+            selected.append(i)
+        return sorted(selected)
+
+    def get_selected_template(
+        self, examples: list[int], relevant_entities: Optional[Iterable[str]] = None
+    ) -> str:
+        """Return the template with the `examples`, only listing the relevant entities."""
+        relevant = frozenset(relevant_entities) if relevant_entities else None
+        key = (tuple(examples), relevant)
+        template = self._selected_templates.get(key)
+        if template is None:
+            template = self.compile_template(
+                [self._example_blocks[i] for i in examples],
+                [name for name in self.entities.keys() if name in relevant]
+                if relevant
+                else None,
+            )
+            self._selected_templates.set(key, template)
+        return template
+
+    def format(self, **kwargs: Any) -> str:
         context = self.get_entity_extraction_context(kwargs["history"])
+        # Only the entities still relevant to the process, if given
+        relevant_entities = kwargs.get("relevant_entities")
+        if self._example_index is not None:
+            template = self.get_selected_template(
+                self.select_examples(f"{context}\n{kwargs['input']}", relevant_entities),
+                relevant_entities,
+            )
+        elif relevant_entities:
+            template = self.get_pruned_template(relevant_entities)
+        else:
+            template = self._compiled_template
+        # The options the AI offered, so that answers like "the last one" resolve to one
+        offered_options = kwargs.get("offered_options")
+        if offered_options:
+            context = f"{context}\n{self.stringify_offered_options(offered_options)}"
         return template.format(
             **{
                 **kwargs,
@@ -58,24 +179,27 @@ class NERPromptTemplate(StringPromptTemplate):
             }
         )
 
-    def stringify_dict_for_template(self, dictionary: list[dict[str, Any]]) -> str:
+    def stringify_example(self, item: dict[str, Any]) -> str:
         result = []
-        for index, item in enumerate(dictionary):
-            if item.get("context"):
-                result.append(f"context: {item['context']}")
-            result.append(f"text: {item['text']}")
-            result.append("entities:")
-            entities_str = (
-                json.dumps(item["entities"], indent=2)
-                if self.debug
-                else json.dumps(item["entities"])
-            )
-            entities_str = entities_str.replace("{", "{{").replace("}", "}}")
-            result.append(entities_str)
-            if index < len(dictionary) - 1:
-                result.append("\n")
-        str_result = "\n".join(result)
-        return str_result
+        if item.get("context"):
+            result.append(f"context: {item['context']}")
+        result.append(f"text: {item['text']}")
+        result.append("entities:")
+        entities_str = (
+            json.dumps(item["entities"], indent=2)
+            if self.debug
+            else json.dumps(item["entities"])
+        )
+        entities_str = entities_str.replace("{", "{{").replace("}", "}}")
+        result.append(entities_str)
+        return "\n".join(result)
+
+    @staticmethod
+    def stringify_offered_options(options: list[Any]) -> str:
+        return f"offered options: {json.dumps(options, default=str)}"
+
+    def stringify_dict_for_template(self, dictionary: list[dict[str, Any]]) -> str:
+        return "\n\n\n".join(self.stringify_example(item) for item in dictionary)
 
     @staticmethod
     def get_entity_extraction_context(text: str) -> str:
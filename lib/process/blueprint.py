@@ -0,0 +1,74 @@
+from typing import Any, Optional, Type
+
+from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.base import BaseCallbackHandler
+
+from ..conversation_memory import ConversationMemory
+from ..ner.entities.basic_entities import Entity, EntityExample
+from .process_chain import ProcessChain
+from .schemas import Process
+
+
+class ProcessChainBlueprint:
+    """Immutable configuration of a `ProcessChain`, compiled once and shared by sessions.
+
+    The `ProcessChain` validators (which build the `NERChain`, the prompt templates and
+    the validation chain) run once, when the blueprint is created. `new_session` then
+    only attaches a fresh `ConversationMemory` to shallow copies of the compiled chains.
+
+    ```python
+    blueprint = ProcessChainBlueprint(
+        ner_llm=ner_llm,
+        chat_llm=chat_llm,
+        process=AppointmentBookingProcess,
+        entities={"first_name": Entity},
+        entity_examples=yaml.safe_load(open("examples.yaml")),
+    )
+    chain = blueprint.new_session()
+    ```
+    """
+
+    def __init__(
+        self,
+        ner_llm: BaseLanguageModel,
+        chat_llm: BaseLanguageModel,
+        process: Type[Process],
+        entities: dict[str, Type[Entity] | tuple[Type[Entity], BaseLanguageModel]],
+        entity_examples: list[EntityExample | dict[str, Any]],
+        additional_ner_instructions: Optional[str] = "",
+        callbacks: Optional[list[BaseCallbackHandler]] = None,
+        verbose: bool = False,
+        **kwargs: Any,
+    ):
+        self.entity_examples = [
+            e if isinstance(e, EntityExample) else EntityExample.parse_obj(e)
+            for e in entity_examples
+        ]
+        self.chain = ProcessChain(
+            ner_llm=ner_llm,
+            chat_llm=chat_llm,
+            process=process,
+            entities=entities,
+            entity_examples=self.entity_examples,
+            additional_ner_instructions=additional_ner_instructions,
+            callbacks=callbacks,
+            memory=ConversationMemory(),
+            verbose=verbose,
+            **kwargs,
+        )
+
+    @property
+    def process(self) -> Type[Process]:
+        return self.chain.process
+
+    @property
+    def entities(self) -> dict[str, Type[Entity] | tuple[Type[Entity], BaseLanguageModel]]:
+        return self.chain.entities
+
+    def new_session(self, memory: Optional[ConversationMemory] = None) -> ProcessChain:
+        """Return a `ProcessChain` bound to `memory`, or to a new empty memory."""
+        return self.chain.new_session(memory)
+
+    def close(self) -> None:
+        """Shut down the entity resolution executor of the sessions, see `ProcessChain.close`."""
+        self.chain.close()
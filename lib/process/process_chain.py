@@ -1,17 +1,35 @@
-from pydantic import root_validator
+from pydantic import BaseModel, root_validator
 from .schemas import Process
+from ..cache import ResponseCache
 from ..conversation_memory import ConversationMemory
 from ..ner.entities.basic_entities import Entity, EntityExample
 from .validation_chain import ProcessValidationChain
 from .process_prompt_template import ProcessPromptTemplate
+from ..ner.extractors import Extractor
 from ..ner.ner_chain import NERChain
 from langchain.chains.sequential import SequentialChain
+from concurrent.futures import Executor
 from typing import Any, Callable, Dict, List, Optional, Type
 from langchain import ConversationChain
 from langchain.callbacks.base import BaseCallbackHandler
 from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from langchain.chains.base import Chain
 
+def shallow_copy(model: BaseModel) -> Any:
+    """Copy a pydantic model without validating or copying its field values."""
+    copied = model.__class__.__new__(model.__class__)
+    object.__setattr__(copied, "__dict__", dict(model.__dict__))
+    object.__setattr__(copied, "__fields_set__", set(model.__fields_set__))
+    for name in model.__private_attributes__:
+        if hasattr(model, name):
+            object.__setattr__(copied, name, getattr(model, name))
+    return copied
+
+
 class ProcessConversationChain(ConversationChain):
     @property
     def input_keys(self) -> List[str]:
@@ -42,6 +60,28 @@ class ProcessChain(SequentialChain):
     entities: dict[str, Type[Entity] | tuple[Type[Entity], BaseLanguageModel]]
     entity_examples: list[EntityExample]
     additional_ner_instructions: Optional[str] = ""
+    # Number of LLM-backed entities resolved at the same time and timeout of each one.
+    # Pass `entity_resolution_executor` to share one between chains, else `close` shuts
+    # down the one of this chain.
+    entity_resolution_max_concurrency: int = 4
+    entity_resolution_timeout: Optional[float] = None
+    entity_resolution_executor: Optional[Executor] = None
+    ner_cache: Optional[ResponseCache] = None
+    # Extractors resolving the entity asked for without the NER LLM, by entity name,
+    # in addition to the defaults of the entity types. See `NERChain.extractors`.
+    entity_extractors: Optional[dict[str, Extractor]] = None
+    # Only list the entities of the fields not collected yet, or with an error, in the
+    # NER prompt, with the examples showing at least one of them. Shorter prompts. Kept
+    # examples may still show other entities, and the entities the LLM still returns for
+    # collected fields are applied, so the User is less likely, not unable, to change them.
+    prune_ner_prompt: bool = False
+    # Variables of the process holding the options last offered to the User, like the
+    # slots proposed by a booking process. Their values are listed in the NER prompt, so
+    # that answers like "the last one" resolve to one of them.
+    ner_offered_options: Optional[list[str]] = None
+    # Only include the NER examples the most similar to the input, see `NERPromptTemplate`
+    ner_max_examples: Optional[int] = None
+    ner_example_token_budget: Optional[int] = None
     process: Type[Process]
     memory: Optional[ConversationMemory]
     chains: Optional[list[Chain]] = []
@@ -63,6 +103,13 @@ class ProcessChain(SequentialChain):
                 if "additional_ner_instructions" in values
                 else None,
                 verbose=values["verbose"],
+                max_concurrency=values.get("entity_resolution_max_concurrency", 4),
+                resolution_timeout=values.get("entity_resolution_timeout"),
+                executor=values.get("entity_resolution_executor"),
+                cache=values.get("ner_cache"),
+                extractors=values.get("entity_extractors"),
+                max_examples=values.get("ner_max_examples"),
+                example_token_budget=values.get("ner_example_token_budget"),
             ),
             ProcessValidationChain(
                 input_variables=["entities"],
@@ -86,6 +133,57 @@ class ProcessChain(SequentialChain):
         ]
         return values
 
+    def relevant_entities(self, variables: Dict[str, Any]) -> Optional[list[str]]:
+        """Return the entities the User can still provide, or None for all of them."""
+        fields = self.process.spec.fields
+        errors = variables.get("errors") or {}
+        relevant = [
+            name
+            for name in self.entities
+            if name not in fields or variables.get(name) is None or name in errors
+        ]
+        return relevant or None
+
+    def offered_options(self, variables: Dict[str, Any]) -> Optional[list[Any]]:
+        """Return the options last offered to the User, or None if there are none."""
+        options: list[Any] = []
+        for name in self.ner_offered_options or []:
+            value = variables.get(name)
+            if value is not None:
+                options.extend(value if isinstance(value, list) else [value])
+        return options or None
+
+    def ner_inputs(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Add the state of the process the NER chain uses.
+
+        `focus` is the field the process is asking for, which the NER can resolve without
+        the LLM, `relevant_entities` the entities to list in the NER prompt and
+        `offered_options` the options the User may refer to.
+        """
+        variables = inputs.get("variables") or {}
+        return {
+            **inputs,
+            "focus": self.process.spec.next_question_field(variables),
+            "relevant_entities": self.relevant_entities(variables)
+            if self.prune_ner_prompt
+            else None,
+            "offered_options": self.offered_options(variables),
+        }
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        return super()._call(self.ner_inputs(inputs), run_manager)
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        return await super()._acall(self.ner_inputs(inputs), run_manager)
+
     def set_callbacks(self, callbacks: list[BaseCallbackHandler]) -> None:
         """Set callbacks for all chains."""
         self.callbacks = callbacks
@@ -93,13 +191,37 @@ class ProcessChain(SequentialChain):
             for chain in self.chains:
                 chain.callbacks = callbacks
 
+    def close(self) -> None:
+        """Release the resources of the chain, shared with the sessions created from it."""
+        if self.chains:
+            self.chains[0].close()
+
     def reset(self) -> None:
         """Set memory for all chains."""
-        self.memory = ConversationMemory()
+        self.bind_memory(ConversationMemory())
+
+    def bind_memory(self, memory: ConversationMemory) -> None:
+        """Use `memory` in this chain and in the chains using the memory."""
+        self.memory = memory
         if self.chains and len(self.chains) > 2:
             self.chains[1].memory = self.memory
             self.chains[2].memory = self.memory
 
+    def new_session(
+        self, memory: Optional[ConversationMemory] = None
+    ) -> "ProcessChain":
+        """Return a copy of this chain with its own memory, empty unless `memory` is given.
+
+        The chains are copied shallowly, so the entities, examples, prompt templates and
+        LLM clients are shared while the memory and the callbacks are set on the copies
+        only. No validator runs.
+        """
+        session = shallow_copy(self)
+        if self.chains:
+            session.chains = [shallow_copy(chain) for chain in self.chains]
+        session.bind_memory(memory if memory is not None else ConversationMemory())
+        return session
+
     def prep_outputs(
         self,
         inputs: Dict[str, str],
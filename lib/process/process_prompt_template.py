@@ -2,15 +2,16 @@ import json
 import os
 from typing import Any, Tuple, Type
 
-from jinja2 import Template
 from langchain.prompts.prompt import PromptTemplate
 from pydantic import BaseModel, root_validator
 
 from lib.logger_config import setup_logger
 
 logger = setup_logger(__name__)
+from ..templates import get_template, get_template_variables
 from ..utils import convert_list_to_string
 from .schemas import Process
+from .spec import LazyVariables
 
 
 class ProcessPromptTemplate(PromptTemplate):
@@ -28,11 +29,13 @@ class ProcessPromptTemplate(PromptTemplate):
 
     def format(self, **kwargs: Any) -> str:
         collected = self.get_collected_variables(kwargs["variables"])
+        # Derived variables are only computed if a rendered question or error uses them
+        variables = LazyVariables(self.process.spec, kwargs["variables"])
         (
             remaining_dict,
             remaining,
             remaining_as_list,
-        ) = self.get_remaining_variables_to_collect(kwargs["variables"])
+        ) = self.get_remaining_variables_to_collect(variables, with_questions=False)
 
         errors: dict | None = kwargs["variables"].get("errors")
 
@@ -40,20 +43,22 @@ class ProcessPromptTemplate(PromptTemplate):
             errors.get(list(errors.keys())[0]) if errors and len(errors) else None
         )
         if error_message is not None:
-            error_message = Template(error_message).render(**kwargs["variables"])
+            error_message = get_template(error_message).render(
+                variables.context(get_template_variables(error_message))
+            )
 
         next_variable_to_collect = (
             list(remaining_dict.keys())[0] if len(remaining_dict.keys()) > 0 else None
         )
         next_variable_question = ""
         if next_variable_to_collect is not None:
-            next_variable_question = Template(
-                self.process.schema()["properties"][next_variable_to_collect][
-                    "question"
-                ]
-            ).render(**kwargs["variables"])
+            field = self.process.spec.fields[next_variable_to_collect]
+            next_variable_question = field.question_template.render(
+                variables.context(field.question_variables)
+            )
 
-        return Template(self.template, lstrip_blocks=True, trim_blocks=True).render(
+        template = get_template(self.template, lstrip_blocks=True, trim_blocks=True)
+        return template.render(
             goal=self.process.process_description,
             is_process_starting=self.is_first_message(kwargs["history"]),
             remaining=remaining_as_list,
@@ -81,24 +86,27 @@ class ProcessPromptTemplate(PromptTemplate):
         return list(self.get_collected_variables(variables).keys())
 
     def get_remaining_variables_to_collect(
-        self, variables: dict[str, Any] = {}
+        self,
+        variables: dict[str, Any] | LazyVariables = {},
+        with_questions: bool = True,
     ) -> Tuple[dict[str, Any], str, str]:
-        model_schema = self.process.schema()
-        fields = model_schema["properties"]
-        logger.debug(f"variables: {variables}")
+        spec = self.process.spec
+        if not isinstance(variables, LazyVariables):
+            variables = LazyVariables(spec, variables)
+        logger.debug(f"variables: {variables.variables}")
+        collected = self.get_collected_variables(variables.variables)
         json_object = {}
-        for field_name, field_info in fields.items():
-            if field_name not in self.get_collected_variables(
-                variables
-            ).keys() and field_info.get("question"):
+        for field_name in spec.question_fields:
+            field = spec.fields[field_name]
+            if field_name not in collected and field.question:
                 json_object[field_name] = {
-                    "description": field_info.get("description", ""),
-                    "variable_name": field_info.get("title", ""),
+                    "description": field.description,
+                    "variable_name": field.title,
                 }
-                if field_info.get("question"):
-                    json_object[field_name]["question"] = Template(
-                        field_info["question"]
-                    ).render(variables)
+                if with_questions:
+                    json_object[field_name]["question"] = field.question_template.render(
+                        variables.context(field.question_variables)
+                    )
         return (
             json_object,
             json.dumps(json_object, indent=2),
@@ -116,12 +124,9 @@ class ProcessPromptTemplate(PromptTemplate):
     def get_updates(self, diff: list[dict], variables: dict) -> str:
         additions = []
         updates = []
-        schema = self.process.schema()
+        fields = self.process.spec.fields
         for item in diff:
-            if (
-                "question" in schema["properties"][item["name"]]
-                or "aknowledgement" in schema["properties"][item["name"]]
-            ):
+            if fields[item["name"]].is_surfaced:
                 if item["operation"] == "added":
                     additions.append(f"{item['name']}")
                 elif item["operation"] == "updated":
@@ -1,7 +1,25 @@
-from typing import ClassVar, Optional, Dict, Union, get_args, get_origin
-from pydantic import BaseModel, Field, root_validator, validator
+from typing import Any, Callable, ClassVar, Optional, Dict
+from pydantic import BaseModel, Field, ValidationError, root_validator, validator
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.utils import ROOT_KEY
 from enum import Enum
 
+from .spec import ProcessSpec
+
+
+def derived(func: Callable) -> classmethod:
+    """Declare a variable computed from the process variables, only when a question,
+    error or acknowledgement about to be rendered references it.
+
+    ```python
+    @derived
+    def full_name(cls, variables) -> str:
+        return f"{variables.get('first_name')} {variables.get('last_name')}"
+    ```
+    """
+    func.__derived__ = True  # type: ignore
+    return classmethod(func)
+
 
 class Process(BaseModel):
     process_description: ClassVar[
@@ -10,26 +28,109 @@ class Process(BaseModel):
     
     errors: Optional[Dict[str, str]] = {}
 
+    # Built when the class is defined, see `__init_subclass__`
+    spec: ClassVar[ProcessSpec]
+
+    # Only run the validators of the fields that changed during the turn, see `validate_changes`
+    incremental_validation: ClassVar[bool] = False
+    # Fields read by a field validator (keyed by field name) or a root validator
+    # (keyed by function name), e.g. `{"confirmation": ["first_name", "last_name"]}`.
+    # Root validators without an entry run on every validation.
+    dependencies: ClassVar[dict[str, list[str]]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.spec = ProcessSpec(cls)
+
     def is_completed(self) -> bool:
         return all(v is not None for v in self.dict().values())
 
     def is_failed(self) -> bool:
         return False
 
+    @classmethod
+    def validate_changes(
+        cls, previous: dict[str, Any], changes: dict[str, Any]
+    ) -> tuple["Process", set[str]]:
+        """Validate `changes` on top of the `previous` values of a validated process.
+
+        Only the changed fields, the fields depending on them and the root validators
+        reading them are validated again. Returns the process and the names of the fields
+        whose value changed. Raises a `ValidationError` like `parse_obj`.
+        """
+        spec = cls.spec
+        if spec.non_optional_fields:
+            raise ValueError(
+                f"All Process fields must be Optional, and {', '.join(sorted(spec.non_optional_fields))} were not"
+            )
+        # Fields never validated before are validated as in `parse_obj`
+        new_fields = {name for name in spec.fields if name not in previous}
+        values = {**previous, **changes, "errors": {}}
+        changed = new_fields | _changed_keys(previous, values)
+
+        for validator, inputs in spec.pre_root_validators:
+            if spec.reads(inputs, changed):
+                try:
+                    values = validator(cls, dict(values))
+                except (ValueError, TypeError, AssertionError) as e:
+                    raise ValidationError([ErrorWrapper(e, loc=ROOT_KEY)], cls)
+                changed |= _changed_keys(previous, values)
+
+        affected = spec.affected_fields(changed)
+        validated: dict[str, Any] = {}
+        errors: list[ErrorWrapper] = []
+        for name, field in cls.__fields__.items():
+            if name not in affected:
+                validated[name] = values.get(name)
+                continue
+            if name not in values and not field.validate_always:
+                validated[name] = field.get_default()
+                continue
+            value, error = field.validate(
+                values.get(name, field.get_default()), validated, loc=field.alias, cls=cls  # type: ignore
+            )
+            if isinstance(error, ErrorWrapper):
+                errors.append(error)
+            elif isinstance(error, list):
+                errors.extend(error)
+            else:
+                validated[name] = value
+        changed |= _changed_keys(previous, validated)
+
+        for skip_on_failure, validator, inputs in spec.post_root_validators:
+            if (skip_on_failure and errors) or not spec.reads(inputs, changed):
+                continue
+            try:
+                validated = validator(cls, validated)
+            except (ValueError, TypeError, AssertionError) as e:
+                errors.append(ErrorWrapper(e, loc=ROOT_KEY))
+        if errors:
+            raise ValidationError(errors, cls)
+
+        validated = {name: validated.get(name) for name in spec.fields}
+        changed = new_fields | _changed_keys(previous, validated)
+        return cls.construct(**validated), changed & spec.fields.keys()
+
     @root_validator(pre=True)
     def all_fields_optional(cls, values):
-        vals = {k: v for k, v in values.items() if k != "errors"}
-        for field_name, _ in vals.items():
-            field_type = cls.__annotations__[field_name]
-            if not get_origin(field_type) is Union or not type(None) in get_args(
-                field_type
-            ):
-                raise ValueError(
-                    f"All Process fields must be Optional, and {field_name} was not"
-                )
+        for field_name in cls.spec.non_optional_fields.intersection(values.keys()):
+            raise ValueError(
+                f"All Process fields must be Optional, and {field_name} was not"
+            )
         return values
 
 
+Process.spec = ProcessSpec(Process)
+
+
+def _changed_keys(before: dict[str, Any], after: dict[str, Any]) -> set[str]:
+    return {
+        key
+        for key in before.keys() | after.keys()
+        if before.get(key) != after.get(key)
+    }
+
+
 class Status(str, Enum):
     completed = "completed"
     failed = "failed"
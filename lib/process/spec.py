@@ -0,0 +1,146 @@
+from collections.abc import Mapping
+from typing import Any, Callable, Iterable, Iterator, Optional, Type, Union, get_args, get_origin
+
+from pydantic import BaseModel
+from jinja2 import Template
+from pydantic.fields import ModelField
+
+from ..templates import get_template, get_template_variables
+
+
+class FieldSpec:
+    """What the conversation needs to know about a `Process` field."""
+
+    def __init__(self, field: ModelField):
+        self.name = field.name
+        # Same defaults as the JSON schema of the model
+        self.title: str = field.field_info.title or field.alias.title().replace("_", " ")
+        self.description: str = field.field_info.description or ""
+        self.question: Optional[str] = field.field_info.extra.get("question")
+        self.aknowledgement: Optional[str] = field.field_info.extra.get("aknowledgement")
+        self.optional = is_optional(field.annotation)
+        # Compiled when the Process class is defined
+        self.question_template: Optional[Template] = (
+            get_template(self.question) if self.question else None
+        )
+        self.aknowledgement_template: Optional[Template] = (
+            get_template(self.aknowledgement) if self.aknowledgement else None
+        )
+        self.question_variables = get_template_variables(self.question or "")
+        self.aknowledgement_variables = get_template_variables(self.aknowledgement or "")
+
+    @property
+    def is_surfaced(self) -> bool:
+        """Whether a change of the field value is acknowledged to the User."""
+        return self.question is not None or self.aknowledgement is not None
+
+
+def is_optional(annotation: Any) -> bool:
+    return get_origin(annotation) is Union and type(None) in get_args(annotation)
+
+
+class ProcessSpec:
+    """Introspection of a `Process` class, computed once when the class is defined.
+
+    Hot paths read from the spec instead of calling `Process.schema()`.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.fields: dict[str, FieldSpec] = {
+            name: FieldSpec(field) for name, field in model.__fields__.items()
+        }
+        # Fields asked to the User, in order of definition
+        self.question_fields: list[str] = [
+            name for name, field in self.fields.items() if field.question is not None
+        ]
+        self.non_optional_fields: set[str] = {
+            name
+            for name, field in self.fields.items()
+            if not field.optional and name != "errors"
+        }
+        # Variables declared with `@derived`, computed when a template references them
+        self.derived: dict[str, Callable[[Mapping], Any]] = {
+            name: getattr(model, name)
+            for klass in reversed(model.__mro__)
+            for name, attr in vars(klass).items()
+            if isinstance(attr, classmethod) and getattr(attr.__func__, "__derived__", False)
+        }
+
+        # Inputs read by the field and root validators, see `Process.dependencies`
+        dependencies: dict[str, Iterable[str]] = getattr(model, "dependencies", {})
+        # Fields to validate again when a field changes
+        self.dependents: dict[str, set[str]] = {name: {name} for name in self.fields}
+        for name in self.fields:
+            for dependency in dependencies.get(name, ()):
+                self.dependents.setdefault(dependency, {dependency}).add(name)
+        # Root validators without declared inputs run on every validation
+        self.pre_root_validators: list[tuple[Callable, Optional[set[str]]]] = [
+            (validator, self._inputs(dependencies, validator))
+            for validator in getattr(model, "__pre_root_validators__", [])
+        ]
+        self.post_root_validators: list[tuple[bool, Callable, Optional[set[str]]]] = [
+            (skip_on_failure, validator, self._inputs(dependencies, validator))
+            for skip_on_failure, validator in getattr(model, "__post_root_validators__", [])
+        ]
+
+    @staticmethod
+    def _inputs(
+        dependencies: dict[str, Iterable[str]], validator: Callable
+    ) -> Optional[set[str]]:
+        inputs = dependencies.get(validator.__name__)
+        return set(inputs) if inputs is not None else None
+
+    def next_question_field(self, variables: Mapping[str, Any]) -> Optional[str]:
+        """Return the field the process is asking the User for, like `ProcessPromptTemplate`."""
+        for name in self.question_fields:
+            if variables.get(name) is None:
+                return name
+        return None
+
+    def affected_fields(self, changed: set[str]) -> set[str]:
+        """Return the fields to validate again when the `changed` fields changed."""
+        affected: set[str] = set()
+        pending = list(changed)
+        while pending:
+            name = pending.pop()
+            if name not in affected:
+                affected.add(name)
+                pending.extend(self.dependents.get(name, ()))
+        return affected
+
+    @staticmethod
+    def reads(inputs: Optional[set[str]], changed: set[str]) -> bool:
+        return inputs is None or not inputs.isdisjoint(changed)
+
+
+class LazyVariables(Mapping):
+    """Variables of a turn, computing the derived variables of the process on first access.
+
+    Derived values are memoized, so create one instance per turn.
+    """
+
+    def __init__(self, spec: ProcessSpec, variables: dict[str, Any]):
+        self.spec = spec
+        self.variables = variables
+        self._derived: dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self.spec.derived:
+            return self.variables[name]
+        if name not in self._derived:
+            self._derived[name] = self.spec.derived[name](self)
+        return self._derived[name]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.variables
+        yield from (name for name in self.spec.derived if name not in self.variables)
+
+    def __len__(self) -> int:
+        return len(self.variables.keys() | self.spec.derived.keys())
+
+    def context(self, names: Iterable[str]) -> dict[str, Any]:
+        """Return the variables with the derived ones among `names`, to render a template."""
+        return {
+            **self.variables,
+            **{name: self[name] for name in names if name in self.spec.derived},
+        }
@@ -1,4 +1,8 @@
-from langchain.callbacks.manager import CallbackManagerForChainRun
+import asyncio
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from langchain.chains.base import Chain
 from typing import Any, Dict, List, Optional, Type
 import json
@@ -7,6 +11,7 @@ from pydantic import BaseModel, ValidationError
 from .schemas import Result, Status, Process
 
 from ..conversation_memory import ConversationMemory
+from ..ner.entities.basic_entities import Entity
 from ..logger_config import setup_logger
 from .. import utils
 
@@ -43,6 +48,16 @@ class ProcessValidationChain(Chain):
     ) -> Dict[str, str]:
         return self.validate(inputs)
 
+    async def _acall(
+        self,
+        inputs: Dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        # Process validators run user code which may block, e.g. on an availability
+        # provider, so validate on the default executor rather than on the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.validate, inputs)
+
     def load_variables(self, variables: Dict[str, Any]) -> Dict[str, Any]:
         for field in self.process.__fields__.keys():
             if field not in variables.keys():
@@ -58,19 +73,33 @@ class ProcessValidationChain(Chain):
             else:
                 self.memory.kv_store.set(field, None)
 
+    @staticmethod
+    def load_entities(inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the values of the entities by name.
+
+        Entities are `Entity` objects when passed by the `NERChain`, a JSON string of
+        `{"name", "value"}` objects is also accepted from other callers.
+        """
+        entities = inputs["entities"]
+        if isinstance(entities, str):
+            try:
+                entities = json.loads(entities)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Could not parse entities: {entities}") from e
+        values = {}
+        for entity in entities:
+            if isinstance(entity, Entity):
+                values[entity.name] = entity.get_value()
+            else:
+                values[entity["name"]] = entity["value"]
+        return values
+
     def validate(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if self.process.incremental_validation:
+            return self.validate_incrementally(inputs)
         # Just to raise the "All fields should be optional" error if applicable
         self.process()  # type: ignore
-        try:
-            entities = json.loads(inputs["entities"])
-        except json.JSONDecodeError as e:
-            entities = []
-
-        variables_from_entities = self.load_variables(
-            {d["name"]: d["value"] for d in entities}
-        )
-        result: Result | None = None
-        diff = []
+        variables_from_entities = self.load_variables(self.load_entities(inputs))
         try:
             logger.debug(
                 f"Current variables: {variables_from_entities}",
@@ -84,38 +113,64 @@ class ProcessValidationChain(Chain):
             logger.debug(
                 f"Process model post-validation: {data.dict()}",
             )
-
-            if data.is_completed():
-                result = Result(
-                    status=Status.completed, result=data, errors=data.errors
-                )
-            if data.is_failed():
-                result = Result(status=Status.failed, result=data, errors=None)
-            self.memory.kv_store.set("errors", {})
-            variables_from_entities = self.memory.kv_store.load_memory_variables()[
-                "variables"
-            ]
-            variables_from_entities["errors"] = data.errors
+            return self.validation_output(data, diff)
         except ValidationError as e:
-            logger.debug(
-                f"Validation error: {e}",
+            return self.validation_error_output(e)
+
+    def validate_incrementally(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Only validate and store the fields changed by the entities of the turn.
+
+        See `Process.validate_changes` and `Process.dependencies`.
+        """
+        changes = self.load_entities(inputs)
+        previous = self.memory.kv_store.load_memory_variables()["variables"]
+        try:
+            logger.debug(f"Changed variables: {changes}")
+            data, changed = self.process.validate_changes(previous, changes)
+            diff = utils.dict_diff(
+                after={name: getattr(data, name) for name in changed},
+                before={name: changes.get(name, previous.get(name)) for name in changed},
             )
-            errors = self.convert_validation_error_to_dict(e, "assertion")
-            variables_from_entities = {
-                k: v
-                for k, v in self.memory.kv_store.load_memory_variables()[
-                    "variables"
-                ].items()
-                if k not in errors.keys()
-            }
-            logger.debug("Variables after validation errors:", variables_from_entities)
-            variables_from_entities["errors"] = errors
+            for name in changed:
+                self.memory.kv_store.set(name, getattr(data, name))
+            logger.debug(f"Process fields changed by validation: {changed}")
+            return self.validation_output(data, diff)
+        except ValidationError as e:
+            return self.validation_error_output(e)
+
+    def validation_output(self, data: Process, diff: list[dict]) -> Dict[str, Any]:
+        result: Result | None = None
+        if data.is_completed():
+            result = Result(status=Status.completed, result=data, errors=data.errors)
+        if data.is_failed():
+            result = Result(status=Status.failed, result=data, errors=None)
+        self.memory.kv_store.set("errors", {})
+        variables = self.memory.kv_store.load_memory_variables()["variables"]
+        variables["errors"] = data.errors
         return {
-            "variables": variables_from_entities,
+            "variables": variables,
             "diff": diff,
             "result": result.dict() if result else None,
         }
 
+    def validation_error_output(self, e: ValidationError) -> Dict[str, Any]:
+        logger.debug(
+            f"Validation error: {e}",
+        )
+        errors = self.convert_validation_error_to_dict(e, "assertion")
+        variables = {
+            k: v
+            for k, v in self.memory.kv_store.load_memory_variables()["variables"].items()
+            if k not in errors.keys()
+        }
+        logger.debug("Variables after validation errors:", variables)
+        variables["errors"] = errors
+        return {
+            "variables": variables,
+            "diff": [],
+            "result": None,
+        }
+
     def variables_diff(
         self, before: dict[str, Any], after: dict[str, Any]
     ) -> list[str]:
@@ -0,0 +1,272 @@
+"""ASGI application serving the conversations of a `ProcessChain` over HTTP and WebSocket.
+
+Routes:
+
+- `POST /sessions` creates a session, `{"session_id": ...}` is optional in the body
+- `POST /sessions/{session_id}/turns` runs a turn of `{"input": ...}` and returns
+  `{"session_id", "response", "result"}`, or a 404 if the session was not created,
+  was dropped or was evicted
+- `DELETE /sessions/{session_id}` drops a session
+- `GET /health` returns the number of sessions and of running and waiting turns
+- `WS /sessions/{session_id}/stream` runs a turn for each text message received, sending
+  `{"type": "token", "token": ...}` messages followed by `{"type": "end", "response", "result"}`.
+  The connection is closed with code 4404 if the session does not exist.
+
+The application has no dependency beyond the standard library and runs on any ASGI
+server, `serve` starts it with uvicorn:
+
+```python
+serve(ChatServer(blueprint), port=8000)
+```
+"""
+import asyncio
+import json
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+from .logger_config import setup_logger
+from .process.blueprint import ProcessChainBlueprint
+from .process.process_chain import ProcessChain
+from .session import SessionManager
+from .streaming import ResponseTokenHandler
+
+logger = setup_logger(__name__)
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ChatServer:
+    """ASGI application running the turns of the sessions of `chain`.
+
+    At most `max_concurrency` turns run at once, other turns wait for a slot and are
+    rejected with a 503 once `max_waiting` of them are waiting. Turns of the same session
+    run one after the other and wait for the previous one before taking a slot. On
+    shutdown, new turns are rejected and the pending ones get up to `shutdown_timeout`
+    seconds to complete.
+    """
+
+    def __init__(
+        self,
+        chain: ProcessChain | ProcessChainBlueprint,
+        max_concurrency: int = 64,
+        max_waiting: int = 1024,
+        max_sessions: Optional[int] = 10_000,
+        shutdown_timeout: float = 30.0,
+    ):
+        self.sessions = SessionManager(chain, max_sessions=max_sessions)
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.shutdown_timeout = shutdown_timeout
+        self.running = 0
+        self.waiting = 0
+        self.accepting = True
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            await self.handle_http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.handle_websocket(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self.handle_lifespan(receive, send)
+
+    async def run_turn(
+        self, session_id: str, user_input: str, callbacks: Optional[list] = None
+    ) -> dict[str, Any]:
+        """Run a turn of `session_id` once a concurrency slot is available."""
+        if not self.accepting:
+            raise HTTPError(503, "Server is shutting down")
+        if self.waiting >= self.max_waiting:
+            raise HTTPError(503, "Too many pending turns")
+        if session_id not in self.sessions:
+            raise HTTPError(404, f"Unknown session {session_id}")
+        session = self.sessions.get(session_id)
+        self.waiting += 1
+        self._idle.clear()
+        started = False
+        try:
+            # The previous turn of the session completes before this one takes a slot,
+            # so that the turns queued by one client hold a single slot
+            async with session.async_lock, self._slots:
+                self.waiting -= 1
+                self.running += 1
+                started = True
+                output = await session.chain.acall(user_input, callbacks=callbacks)
+        finally:
+            if started:
+                self.running -= 1
+            else:
+                self.waiting -= 1
+            if self.running == 0 and self.waiting == 0:
+                self._idle.set()
+        return {"session_id": session_id, "response": output["response"], "result": output["result"]}
+
+    async def shutdown(self) -> None:
+        """Stop accepting turns and wait for the pending ones."""
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Shutting down with {self.running + self.waiting} turns still pending"
+            )
+
+    def health(self) -> dict[str, Any]:
+        return {
+            "status": "ok" if self.accepting else "shutting_down",
+            "sessions": len(self.sessions),
+            "running": self.running,
+            "waiting": self.waiting,
+        }
+
+    async def route(self, method: str, path: str, body: dict[str, Any]) -> tuple[int, Any]:
+        parts = [part for part in path.split("/") if part]
+        if parts == ["health"] and method == "GET":
+            return 200, self.health()
+        if parts == ["sessions"] and method == "POST":
+            if not self.accepting:
+                raise HTTPError(503, "Server is shutting down")
+            session_id = str(body.get("session_id") or uuid.uuid4())
+            self.sessions.get(session_id)
+            return 201, {"session_id": session_id}
+        if len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            if parts[1] not in self.sessions:
+                raise HTTPError(404, f"Unknown session {parts[1]}")
+            self.sessions.drop(parts[1])
+            return 204, None
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "turns":
+            if method != "POST":
+                raise HTTPError(405, "Method not allowed")
+            user_input = body.get("input")
+            if not isinstance(user_input, str):
+                raise HTTPError(400, 'Expected a JSON body with an "input" string')
+            return 200, await self.run_turn(parts[1], user_input)
+        raise HTTPError(404, "Not found")
+
+    async def handle_http(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            body = await read_json_body(receive)
+            status, payload = await self.route(scope["method"], scope["path"], body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception:
+            logger.exception(f"Error handling {scope['method']} {scope['path']}")
+            status, payload = 500, {"error": "Internal server error"}
+        content = b"" if payload is None else json.dumps(payload, default=str).encode()
+        headers = [(b"content-type", b"application/json")] if content else []
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": content})
+
+    async def handle_websocket(self, scope: Scope, receive: Receive, send: Send) -> None:
+        parts = [part for part in scope["path"].split("/") if part]
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        if (
+            len(parts) != 3
+            or parts[0] != "sessions"
+            or parts[2] != "stream"
+            or parts[1] not in self.sessions
+        ):
+            await send({"type": "websocket.close", "code": 4404})
+            return
+        await send({"type": "websocket.accept"})
+        session_id = parts[1]
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            user_input = message.get("text")
+            if user_input is None:
+                user_input = (message.get("bytes") or b"").decode()
+            try:
+                await self.stream_turn(session_id, user_input, send)
+            except HTTPError as e:
+                await send_json(send, {"type": "error", "error": e.message})
+            except Exception:
+                logger.exception(f"Error streaming a turn of session {session_id}")
+                await send_json(send, {"type": "error", "error": "Internal server error"})
+
+    async def stream_turn(self, session_id: str, user_input: str, send: Send) -> None:
+        loop = asyncio.get_running_loop()
+        tokens: asyncio.Queue[str] = asyncio.Queue()
+        # Sync callback handlers run in executor threads when the chain runs async
+        handler = ResponseTokenHandler(
+            lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token)
+        )
+        turn = asyncio.ensure_future(self.run_turn(session_id, user_input, [handler]))
+        streamed = False
+        try:
+            while not turn.done():
+                next_token = asyncio.ensure_future(tokens.get())
+                await asyncio.wait({next_token, turn}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_token.done():
+                    next_token.cancel()
+                    break
+                streamed = True
+                await send_json(send, {"type": "token", "token": next_token.result()})
+        finally:
+            if not turn.done():
+                turn.cancel()
+        output = turn.result()
+        # Tokens scheduled from executor threads right before the end of the turn
+        await asyncio.sleep(0)
+        while not tokens.empty():
+            streamed = True
+            await send_json(send, {"type": "token", "token": tokens.get_nowait()})
+        if not streamed:
+            await send_json(send, {"type": "token", "token": output["response"]})
+        await send_json(send, {"type": "end", **output})
+
+    async def handle_lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def read_json_body(receive: Receive) -> dict[str, Any]:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    body = b"".join(chunks)
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPError(400, "Invalid JSON body")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Expected a JSON object")
+    return data
+
+
+async def send_json(send: Send, data: dict[str, Any]) -> None:
+    await send({"type": "websocket.send", "text": json.dumps(data, default=str)})
+
+
+def serve(app: ChatServer, host: str = "127.0.0.1", port: int = 8000, **kwargs: Any) -> None:
+    """Run `app` with uvicorn, which has to be installed separately."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError("Serving requires uvicorn, install it with `pip install uvicorn`")
+    uvicorn.run(app, host=host, port=port, lifespan="on", **kwargs)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from .conversation_memory import ConversationMemory
+from .logger_config import setup_logger
+from .process.blueprint import ProcessChainBlueprint
+from .process.process_chain import ProcessChain
+
+logger = setup_logger(__name__)
+
+
+class Session:
+    """A conversation with its own `ProcessChain` and memory.
+
+    Turns of the same session are serialized by `lock` since the memory is not thread safe,
+    or by `async_lock` for the turns run with `acall` on an event loop.
+    """
+
+    def __init__(self, session_id: str, chain: ProcessChain):
+        self.session_id = session_id
+        self.chain = chain
+        self.lock = threading.Lock()
+        self.async_lock = asyncio.Lock()
+
+    def __call__(self, user_input: str, callbacks: Optional[list] = None) -> dict[str, Any]:
+        with self.lock:
+            return self.chain(user_input, callbacks=callbacks)
+
+    async def acall(self, user_input: str, callbacks: Optional[list] = None) -> dict[str, Any]:
+        async with self.async_lock:
+            return await self.chain.acall(user_input, callbacks=callbacks)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.chain.reset()
+
+
+class SessionManager:
+    """Keep one isolated `ProcessChain` per session id.
+
+    All sessions are created from `chain`, a `ProcessChain` or a `ProcessChainBlueprint`,
+    with `new_session` so they share its configuration but not its memory. The least
+    recently used sessions are dropped once `max_sessions` is reached.
+    """
+
+    def __init__(
+        self,
+        chain: ProcessChain | ProcessChainBlueprint,
+        max_sessions: Optional[int] = 10_000,
+    ):
+        self.chain = chain
+        self.max_sessions = max_sessions
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.sessions
+
+    def create_session(
+        self, session_id: str, memory: Optional[ConversationMemory] = None
+    ) -> Session:
+        return Session(session_id, self.chain.new_session(memory))
+
+    def get(self, session_id: str) -> Session:
+        """Return the session for `session_id`, creating it if needed."""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                return session
+            return self._add(self.create_session(session_id))
+
+    def restore(self, session_id: str, memory: ConversationMemory) -> Session:
+        """Replace the session for `session_id` by one continuing from `memory`."""
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            return self._add(self.create_session(session_id, memory))
+
+    def _add(self, session: Session) -> Session:
+        self.sessions[session.session_id] = session
+        while self.max_sessions is not None and len(self.sessions) > self.max_sessions:
+            evicted_id, _ = self.sessions.popitem(last=False)
+            logger.debug(f"Evicted session {evicted_id}")
+        return session
+
+    def run(self, session_id: str, user_input: str) -> dict[str, Any]:
+        """Run one turn of the conversation `session_id`."""
+        return self.get(session_id)(user_input)
+
+    def reset(self, session_id: str) -> None:
+        self.get(session_id).reset()
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self.sessions.pop(session_id, None)
@@ -0,0 +1,106 @@
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chains.base import Chain
+
+from .process.process_chain import ProcessConversationChain
+
+
+class ResponseTokenHandler(BaseCallbackHandler):
+    """Forward the tokens of the AI response to `on_token`.
+
+    Only tokens of LLM runs started by a `ProcessConversationChain` are forwarded, so a
+    streaming NER or entity LLM does not leak its output in the response.
+    Tokens are only produced by LLMs with streaming enabled, e.g. `ChatOpenAI(streaming=True)`.
+    """
+
+    def __init__(self, on_token: Callable[[str], None]):
+        self.on_token = on_token
+        self.response_chain_runs: set[UUID] = set()
+        self.response_llm_runs: set[UUID] = set()
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if (serialized.get("id") or [None])[-1] == ProcessConversationChain.__name__:
+            self.response_chain_runs.add(run_id)
+
+    def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: List[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if parent_run_id in self.response_chain_runs:
+            self.response_llm_runs.add(run_id)
+
+    def on_llm_new_token(
+        self,
+        token: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if run_id in self.response_llm_runs:
+            self.on_token(token)
+
+
+class StreamingTurn:
+    """Run one turn of `chain`, or of a `Session`, in a thread and iterate over the response tokens.
+
+    The chain output is available as `inference` once the iteration is over. If the
+    chat LLM does not stream, the whole response is yielded as a single token.
+
+    ```python
+    turn = StreamingTurn(chain, "Hey")
+    for token in turn:
+        print(token, end="")
+    print(turn.inference["result"])
+    ```
+    """
+
+    _done = object()
+
+    def __init__(self, chain: Chain | Callable[..., Dict[str, Any]], user_input: str):
+        self.chain = chain
+        self.user_input = user_input
+        self.inference: Optional[dict[str, Any]] = None
+        self._tokens: queue.Queue = queue.Queue()
+        self._error: Optional[BaseException] = None
+
+    def _run(self) -> None:
+        try:
+            self.inference = self.chain(
+                self.user_input,
+                callbacks=[ResponseTokenHandler(self._tokens.put)],
+            )
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._tokens.put(self._done)
+
+    def __iter__(self) -> Iterator[str]:
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        streamed = False
+        while (token := self._tokens.get()) is not self._done:
+            streamed = True
+            yield token
+        thread.join()
+        if self._error is not None:
+            raise self._error
+        if not streamed and self.inference is not None:
+            yield self.inference["response"]
@@ -0,0 +1,34 @@
+"""Process-wide cache of compiled Jinja templates.
+
+`Template(source)` parses and compiles `source` on every call. `get_template` compiles
+each source once per set of environment options and returns the same `Template`
+afterwards.
+"""
+import functools
+
+from jinja2 import Environment, Template, meta
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment(options: tuple[tuple[str, object], ...] = ()) -> Environment:
+    return Environment(**dict(options))
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(source: str, options: tuple[tuple[str, object], ...]) -> Template:
+    return get_environment(options).from_string(source)
+
+
+def get_template(source: str, **options) -> Template:
+    """Return the compiled template of `source`, e.g. `get_template(s, trim_blocks=True)`."""
+    return _compile(source, tuple(sorted(options.items())))
+
+
+def render(source: str, *args, **kwargs) -> str:
+    return get_template(source).render(*args, **kwargs)
+
+
+@functools.lru_cache(maxsize=1024)
+def get_template_variables(source: str) -> frozenset[str]:
+    """Return the names of the variables referenced by `source`."""
+    return frozenset(meta.find_undeclared_variables(get_environment().parse(source)))
@@ -48,9 +48,9 @@ from pydantic.main import BaseModel
 from typing import List, Type
 
 def get_fields_with_question(pydantic_model: Type[BaseModel]) -> List[str]:
-    schema = pydantic_model.schema()
-    fields_with_title = []
-    for field_name, field_value in schema['properties'].items():
-        if 'question' in field_value:
-            fields_with_title.append(field_name)
-    return fields_with_title
\ No newline at end of file
+    # Read from the field definitions rather than building the whole JSON schema
+    return [
+        field_name
+        for field_name, field in pydantic_model.__fields__.items()
+        if "question" in field.field_info.extra
+    ]
\ No newline at end of file
@@ -0,0 +1,423 @@
+"""Run the sessions of a `ProcessChainBlueprint` across worker processes.
+
+Validation, template rendering and prompt building hold the GIL, so a single process
+is bound to one core. `WorkerPool` starts worker processes each hosting the blueprint
+and routes every session to one of them with a `HashRing`, so the memory of a
+conversation stays in the process running its turns. When workers are added or
+removed, the sessions whose owner changed are moved to their new worker.
+
+```python
+pool = WorkerPool(functools.partial(make_blueprint, ...), workers=os.cpu_count())
+output = pool.run("session-1", "Hello")
+output = await pool.arun("session-1", "I'm Nathan")
+pool.close()
+```
+"""
+import asyncio
+import bisect
+import concurrent.futures
+import hashlib
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional
+
+from .logger_config import setup_logger
+from .process.blueprint import ProcessChainBlueprint
+from .session import SessionManager
+
+logger = setup_logger(__name__)
+
+
+def stable_hash(key: str) -> int:
+    # Unlike hash(), the same across processes and runs
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys on nodes.
+
+    Each node is placed `replicas` times on the ring, so adding or removing a node only
+    moves about 1/n of the keys, evenly taken from the other nodes.
+    """
+
+    def __init__(self, nodes: Iterable[int] = (), replicas: int = 128):
+        self.replicas = replicas
+        self.hashes: list[int] = []
+        self.owners: list[int] = []
+        self.nodes: set[int] = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def add(self, node: int) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = stable_hash(f"{node}:{replica}")
+            i = bisect.bisect(self.hashes, point)
+            self.hashes.insert(i, point)
+            self.owners.insert(i, node)
+
+    def remove(self, node: int) -> None:
+        self.nodes.remove(node)
+        kept = [(h, n) for h, n in zip(self.hashes, self.owners) if n != node]
+        self.hashes = [h for h, _ in kept]
+        self.owners = [n for _, n in kept]
+
+    def node(self, key: str) -> int:
+        if not self.hashes:
+            raise LookupError("The ring has no node")
+        i = bisect.bisect(self.hashes, stable_hash(key)) % len(self.hashes)
+        return self.owners[i]
+
+
+class WorkerError(Exception):
+    """Error raised in a worker process while handling a request."""
+
+
+def _worker_main(
+    blueprint_factory: Callable[[], ProcessChainBlueprint],
+    max_sessions: Optional[int],
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.connection.Connection,
+) -> None:
+    asyncio.run(_serve_worker(blueprint_factory, max_sessions, requests, responses))
+
+
+async def _serve_worker(
+    blueprint_factory: Callable[[], ProcessChainBlueprint],
+    max_sessions: Optional[int],
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.connection.Connection,
+) -> None:
+    sessions = SessionManager(blueprint_factory(), max_sessions=max_sessions)
+    loop = asyncio.get_running_loop()
+    pending: set[asyncio.Task] = set()
+
+    async def handle(request_id: int, command: str, session_id: str, payload: Any) -> None:
+        try:
+            if command == "turn":
+                output = await sessions.get(session_id).acall(payload)
+                result = {"response": output["response"], "result": output["result"]}
+            elif command == "export":
+                if session_id not in sessions:
+                    # Evicted, or never started: nothing to hand off
+                    result = None
+                else:
+                    # Exported after the turns already queued for the session
+                    session = sessions.get(session_id)
+                    async with session.async_lock:
+                        result = session.chain.memory
+                        sessions.drop(session_id)
+            elif command == "import":
+                sessions.restore(session_id, payload)
+                result = None
+            elif command == "drop":
+                sessions.drop(session_id)
+                result = None
+            else:
+                raise ValueError(f"Unknown command {command}")
+            # Only sent from the event loop, to the pipe of this worker alone, so a worker
+            # exiting in the middle of a write cannot block the responses of the others
+            responses.send((request_id, True, result))
+        except Exception as e:
+            responses.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+    while True:
+        # Requests are read in order, so the turns of a session start in order
+        request = await loop.run_in_executor(None, requests.get)
+        if request is None:
+            break
+        task = asyncio.ensure_future(handle(*request))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+
+
+class WorkerPool:
+    """Supervisor of worker processes hosting the sessions of a blueprint.
+
+    `blueprint_factory` builds the blueprint in each worker, so it has to be picklable,
+    e.g. a module level function or a `functools.partial` of one. Turns of a session
+    always run on the worker the `HashRing` assigns to the session id. Workers which exit
+    unexpectedly are detected as soon as their response pipe closes: their pending requests
+    fail with a `WorkerError` and their sessions are lost.
+    """
+
+    def __init__(
+        self,
+        blueprint_factory: Callable[[], ProcessChainBlueprint],
+        workers: int = 1,
+        max_sessions: Optional[int] = 10_000,
+        start_method: str = "spawn",
+    ):
+        self.blueprint_factory = blueprint_factory
+        self.max_sessions = max_sessions
+        self.context = multiprocessing.get_context(start_method)
+        self.ring = HashRing()
+        self.processes: dict[int, multiprocessing.process.BaseProcess] = {}
+        self.queues: dict[int, multiprocessing.Queue] = {}
+        # Response pipe of each worker, until the worker closes it by exiting
+        self.responses: dict[int, multiprocessing.connection.Connection] = {}
+        # Worker hosting each session, to hand them off when the ring changes
+        self.locations: dict[str, int] = {}
+        # Sessions of each worker, least recently used first, evicted like the
+        # `SessionManager` of the worker evicts them
+        self.hosted: dict[int, OrderedDict[str, None]] = {}
+        # Turns of the sessions being handed off, sent once the session is imported
+        self.held: dict[str, list[tuple[concurrent.futures.Future, str]]] = {}
+        self.futures: dict[int, tuple[int, concurrent.futures.Future]] = {}
+        self._request_ids = itertools.count()
+        self._worker_ids = itertools.count()
+        self._lock = threading.RLock()
+        # Serializes the hand-offs, without holding back the turns of other sessions
+        self._rebalance_lock = threading.Lock()
+        # Wakes up the collector to watch new pipes, or to exit once all pipes are closed
+        self._wakeup, self._wakeup_sender = multiprocessing.Pipe(duplex=False)
+        self._closing = False
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        for _ in range(workers):
+            self.add_worker()
+
+    def __len__(self) -> int:
+        return len(self.processes)
+
+    def _collect(self) -> None:
+        while True:
+            with self._lock:
+                pipes = {pipe: worker_id for worker_id, pipe in self.responses.items()}
+                if self._closing and not pipes:
+                    return
+            for pipe in multiprocessing.connection.wait([self._wakeup, *pipes]):
+                if pipe is self._wakeup:
+                    self._wakeup.recv()
+                    continue
+                try:
+                    request_id, ok, result = pipe.recv()
+                except (EOFError, OSError):
+                    # The worker exited, all its responses were read
+                    self._close_pipe(pipes[pipe])
+                    continue
+                _, future = self.futures.pop(request_id, (None, None))
+                if future is None or future.done():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(WorkerError(result))
+
+    def _close_pipe(self, worker_id: int) -> None:
+        with self._lock:
+            self.responses.pop(worker_id).close()
+            process = self.processes.get(worker_id)
+            if process is None:
+                # Stopped by the pool, the requests it did not answer are failed below
+                error = WorkerError(f"Worker {worker_id} was stopped")
+            else:
+                process.join()
+                logger.error(
+                    f"Worker {worker_id} exited unexpectedly with code {process.exitcode}"
+                )
+                self._remove_dead_worker(worker_id)
+                error = WorkerError(f"Worker {worker_id} exited with code {process.exitcode}")
+            for request_id, (target, future) in list(self.futures.items()):
+                if target == worker_id:
+                    del self.futures[request_id]
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _remove_dead_worker(self, worker_id: int) -> None:
+        # Out of the ring first, so that no turn is sent to the worker while it is removed
+        if worker_id in self.ring.nodes:
+            self.ring.remove(worker_id)
+        for session_id in self.hosted.pop(worker_id, {}):
+            del self.locations[session_id]
+        del self.queues[worker_id]
+        del self.processes[worker_id]
+
+    def _send(
+        self, worker_id: int, command: str, session_id: str, payload: Any = None
+    ) -> concurrent.futures.Future:
+        request_id = next(self._request_ids)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        if worker_id not in self.queues:
+            future.set_exception(WorkerError(f"Worker {worker_id} is not running"))
+            return future
+        self.futures[request_id] = (worker_id, future)
+        self.queues[worker_id].put((request_id, command, session_id, payload))
+        return future
+
+    def _place(self, session_id: str, worker_id: int) -> None:
+        """Record that `worker_id` hosts `session_id`, and the sessions it evicts."""
+        previous = self.locations.get(session_id)
+        if previous is not None and previous != worker_id:
+            self.hosted[previous].pop(session_id, None)
+        self.locations[session_id] = worker_id
+        hosted = self.hosted[worker_id]
+        hosted[session_id] = None
+        hosted.move_to_end(session_id)
+        while self.max_sessions is not None and len(hosted) > self.max_sessions:
+            evicted_id, _ = hosted.popitem(last=False)
+            del self.locations[evicted_id]
+
+    def _forget(self, session_id: str) -> Optional[int]:
+        worker_id = self.locations.pop(session_id, None)
+        if worker_id is not None:
+            self.hosted[worker_id].pop(session_id, None)
+        return worker_id
+
+    def submit(self, session_id: str, user_input: str) -> concurrent.futures.Future:
+        """Queue a turn of `session_id` on its worker and return the future of its output."""
+        with self._lock:
+            if session_id in self.held:
+                future: concurrent.futures.Future = concurrent.futures.Future()
+                self.held[session_id].append((future, user_input))
+                return future
+            if not self.ring:
+                raise WorkerError("No worker is running")
+            worker_id = self.ring.node(session_id)
+            self._place(session_id, worker_id)
+            return self._send(worker_id, "turn", session_id, user_input)
+
+    def run(
+        self, session_id: str, user_input: str, timeout: Optional[float] = None
+    ) -> dict[str, Any]:
+        """Run a turn of `session_id`, raising a `TimeoutError` after `timeout` seconds."""
+        return self.submit(session_id, user_input).result(timeout)
+
+    async def arun(
+        self, session_id: str, user_input: str, timeout: Optional[float] = None
+    ) -> dict[str, Any]:
+        """Run a turn of `session_id`, raising a `TimeoutError` after `timeout` seconds."""
+        return await asyncio.wait_for(
+            asyncio.wrap_future(self.submit(session_id, user_input)), timeout
+        )
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            worker_id = self._forget(session_id)
+            if worker_id is not None:
+                self._send(worker_id, "drop", session_id)
+
+    def add_worker(self) -> int:
+        """Start a worker and move to it the sessions it now owns."""
+        with self._rebalance_lock:
+            with self._lock:
+                worker_id = next(self._worker_ids)
+                requests = self.context.Queue()
+                responses, sender = self.context.Pipe(duplex=False)
+                process = self.context.Process(
+                    target=_worker_main,
+                    args=(self.blueprint_factory, self.max_sessions, requests, sender),
+                    daemon=True,
+                )
+                process.start()
+                # Only the worker holds the sending end, so the pipe closes when it exits
+                sender.close()
+                self.queues[worker_id] = requests
+                self.responses[worker_id] = responses
+                self.processes[worker_id] = process
+                self.hosted[worker_id] = OrderedDict()
+                self.ring.add(worker_id)
+            self._wakeup_sender.send(worker_id)
+            self._rebalance()
+            return worker_id
+
+    def remove_worker(self, worker_id: Optional[int] = None) -> None:
+        """Move the sessions of a worker, the last one by default, and stop it."""
+        with self._rebalance_lock:
+            with self._lock:
+                if worker_id is None:
+                    worker_id = max(self.processes)
+                if len(self.ring) == 1 and self.locations:
+                    raise ValueError("Cannot remove the last worker while it hosts sessions")
+                self.ring.remove(worker_id)
+            self._rebalance()
+            with self._lock:
+                process = self._stop(worker_id) if worker_id in self.processes else None
+                self.hosted.pop(worker_id, None)
+            if process is not None:
+                process.join()
+
+    def rebalance(self) -> None:
+        """Hand off the sessions whose worker changed.
+
+        The turns of the moving sessions are held until they are imported by their new
+        worker, the turns of the other sessions are not delayed.
+        """
+        with self._rebalance_lock:
+            self._rebalance()
+
+    def _rebalance(self) -> None:
+        with self._lock:
+            moves = [
+                (session_id, worker_id, self.ring.node(session_id))
+                for session_id, worker_id in self.locations.items()
+                if worker_id != self.ring.node(session_id)
+            ]
+            exports = []
+            for session_id, source, target in moves:
+                self.held[session_id] = []
+                exports.append((session_id, target, self._send(source, "export", session_id)))
+        for session_id, target, export in exports:
+            try:
+                memory = export.result()
+            except WorkerError as e:
+                logger.warning(f"Could not hand off session {session_id}: {e}")
+                memory = None
+            with self._lock:
+                self._forget(session_id)
+                held = self.held.pop(session_id)
+                if memory is not None:
+                    self._send(target, "import", session_id, memory)
+                if (memory is not None or held) and target in self.hosted:
+                    self._place(session_id, target)
+                for future, user_input in held:
+                    chain_future(self._send(target, "turn", session_id, user_input), future)
+        if moves:
+            logger.debug(f"Handed off {len(moves)} sessions")
+
+    def _stop(self, worker_id: int) -> multiprocessing.process.BaseProcess:
+        """Ask a worker to exit once its pending requests are handled, return its process."""
+        self.queues.pop(worker_id).put(None)
+        return self.processes.pop(worker_id)
+
+    def close(self) -> None:
+        """Stop the workers once their pending requests are handled."""
+        with self._lock:
+            processes = [self._stop(worker_id) for worker_id in list(self.processes)]
+            self._closing = True
+        # Without the lock, which the collector takes to handle the last responses
+        for process in processes:
+            process.join()
+        self._wakeup_sender.send(None)
+        self._collector.join()
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def chain_future(source: concurrent.futures.Future, target: concurrent.futures.Future) -> None:
+    """Complete `target` with the outcome of `source`."""
+
+    def copy(done: concurrent.futures.Future) -> None:
+        if target.done():
+            # Cancelled by the caller
+            return
+        if done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+
+    source.add_done_callback(copy)
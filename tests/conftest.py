@@ -0,0 +1,140 @@
+import json
+import re
+from typing import Any, Callable, List, Optional
+
+import pytest
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.llms.base import LLM
+from pydantic import Field
+
+from lib.conversation_memory import ConversationMemory
+from lib.ner.entities.basic_entities import Entity, EntityExample, IntEntity
+from lib.ner.entities.datetime_entity import DateTimeEntity, DateTimeResolutionCache
+from lib.process.blueprint import ProcessChainBlueprint
+from lib.process.process_chain import ProcessChain
+from lib.process.schemas import Process
+
+
+class FakeNERLLM(LLM):
+    """Answer NER prompts with the entities registered for the user text."""
+
+    entities: dict[str, list[dict[str, Any]]] = {}
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ner"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self.calls += 1
+        match = re.search(r"text: (.*)\n(entities:)?$", prompt)
+        text = match.group(1) if match else ""
+        return json.dumps(self.entities.get(text, []))
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        return self._call(prompt, stop)
+
+
+class FakeChatLLM(LLM):
+    """Answer with the last line of the user input found in the prompt."""
+
+    calls: int = 0
+    streaming: bool = False
+    on_token: Optional[Callable[[str], None]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        self.calls += 1
+        user_lines = re.findall(r"^User: (.*)$", prompt, re.MULTILINE)
+        response = f"You said {user_lines[-1] if user_lines else ''}"
+        if self.streaming and run_manager:
+            for token in re.findall(r"\S+\s*", response):
+                if self.on_token:
+                    self.on_token(token)
+                run_manager.on_llm_new_token(token)
+        return response
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        response = self._call(prompt, stop)
+        if self.streaming and run_manager:
+            for token in re.findall(r"\S+\s*", response):
+                await run_manager.on_llm_new_token(token)
+        return response
+
+
+class FormProcess(Process):
+    first_name: Optional[str] = Field(
+        title="First name",
+        description="First name of the user",
+        question="What is your first name?",
+    )
+    age: Optional[int] = Field(
+        title="Age",
+        description="Age of the user",
+        question="What is your age?",
+    )
+
+
+FORM_ENTITIES = {
+    "I'm nathan": [{"name": "first_name", "value": "Nathan"}],
+    "I'm jenny": [{"name": "first_name", "value": "Jenny"}],
+    "42": [{"name": "age", "value": "42"}],
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_datetime_resolution_cache():
+    DateTimeEntity.resolution_cache = DateTimeResolutionCache()
+
+
+def chain_config(**kwargs: Any) -> dict[str, Any]:
+    return {
+        "ner_llm": FakeNERLLM(entities=FORM_ENTITIES),
+        "chat_llm": FakeChatLLM(),
+        "entities": {"first_name": Entity, "age": IntEntity},
+        "entity_examples": [
+            EntityExample.parse_obj(
+                {
+                    "text": "I'm Bob",
+                    "entities": [{"name": "first_name", "value": "Bob"}],
+                }
+            )
+        ],
+        "process": FormProcess,
+        "verbose": False,
+        **kwargs,
+    }
+
+
+@pytest.fixture
+def make_process_chain() -> Callable[..., ProcessChain]:
+    def make(**kwargs: Any) -> ProcessChain:
+        return ProcessChain(**chain_config(memory=ConversationMemory(), **kwargs))
+
+    return make
+
+
+@pytest.fixture
+def make_blueprint() -> Callable[..., ProcessChainBlueprint]:
+    def make(**kwargs: Any) -> ProcessChainBlueprint:
+        return ProcessChainBlueprint(**chain_config(**kwargs))
+
+    return make
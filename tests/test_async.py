@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+from langchain.llms.fake import FakeListLLM
+
+from lib.ner.entities.basic_entities import Entity, IntEntity
+from lib.ner.entities.datetime_entity import DateTimeEntity
+from lib.ner.ner_chain import NERChain
+
+DATETIME = {"start": "2023-06-26T00:00:00", "end": "2023-07-02T23:59:59", "grain": 604800}
+
+
+def test_process_chain_async_matches_sync(make_process_chain):
+    turns = ["hey", "I'm nathan", "42"]
+    sync_chain, async_chain = make_process_chain(), make_process_chain()
+
+    sync_outputs = [sync_chain(turn) for turn in turns]
+
+    async def run():
+        return [await async_chain.acall(turn) for turn in turns]
+
+    async_outputs = asyncio.run(run())
+    assert async_outputs == sync_outputs
+    assert async_outputs[-1]["result"]["status"] == "completed"
+    assert async_chain.memory.history.buffer == sync_chain.memory.history.buffer
+
+
+def test_datetime_entity_async_matches_sync():
+    sync_entity = DateTimeEntity.parse_obj(
+        {"value": "first week of july", "llm": FakeListLLM(responses=[json.dumps(DATETIME)])}
+    )
+    async_entity = asyncio.run(
+        DateTimeEntity.aparse_obj(
+            {"value": "first week of july", "llm": FakeListLLM(responses=[json.dumps(DATETIME)])}
+        )
+    )
+    assert async_entity == sync_entity
+    assert async_entity.dict()["value"] == DATETIME
+
+
+def test_aparse_entities_matches_parse_entities():
+    raw_entities = json.dumps(
+        [
+            {"name": "availability", "value": "first week of july"},
+            {"name": "age", "value": "42"},
+            {"name": "unknown", "value": "x"},
+        ]
+    )
+    llm = FakeListLLM(responses=[json.dumps(DATETIME)] * 2)
+    definition = {"availability": DateTimeEntity, "age": IntEntity}
+    sync_entities = NERChain.parse_entities(definition, raw_entities, llm)
+    async_entities = asyncio.run(NERChain.aparse_entities(definition, raw_entities, llm))
+    assert sync_entities == async_entities
+    assert json.loads(NERChain.dump_entities(async_entities)) == [
+        {"name": "availability", "value": DATETIME},
+        {"name": "age", "value": 42},
+    ]
+
+
+def test_tuple_entity_uses_its_own_llm():
+    raw_entities = json.dumps([{"name": "availability", "value": "first week of july"}])
+    definition = {
+        "availability": (DateTimeEntity, FakeListLLM(responses=[json.dumps(DATETIME)])),
+        "name": Entity,
+    }
+    entities = NERChain.parse_entities(definition, raw_entities, FakeListLLM(responses=[]))
+    assert json.loads(NERChain.dump_entities(entities)) == [{"name": "availability", "value": DATETIME}]
@@ -0,0 +1,94 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+from lib.availability.providers import (
+    CachedAvailabilityProvider,
+    InMemoryAvailabilityProvider,
+    SQLiteAvailabilityProvider,
+)
+from lib.availability.slot_index import Slot
+
+MONDAY = datetime.datetime(2023, 6, 19)
+SLOTS = [
+    MONDAY + datetime.timedelta(hours=9),
+    MONDAY + datetime.timedelta(hours=14),
+    Slot(MONDAY + datetime.timedelta(hours=14), "bob"),
+    MONDAY + datetime.timedelta(days=1, hours=10),
+    MONDAY + datetime.timedelta(days=3, hours=16),
+]
+
+
+@pytest.fixture(params=["memory", "sqlite", "cached"])
+def provider(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryAvailabilityProvider(SLOTS)
+    if request.param == "sqlite":
+        return SQLiteAvailabilityProvider(str(tmp_path / "slots.db"), SLOTS)
+    return CachedAvailabilityProvider(InMemoryAvailabilityProvider(SLOTS))
+
+
+def test_provider(provider):
+    tuesday = MONDAY + datetime.timedelta(days=1)
+    assert provider.between(MONDAY, tuesday) == [
+        Slot(SLOTS[0]),
+        Slot(SLOTS[1]),
+        SLOTS[2],
+    ]
+    assert provider.between(MONDAY, tuesday, resource="bob") == [SLOTS[2]]
+    assert provider.nearest(MONDAY + datetime.timedelta(days=2, hours=12), count=2) == [
+        Slot(SLOTS[3]),
+        Slot(SLOTS[4]),
+    ]
+
+    provider.book(SLOTS[0])
+    with pytest.raises(KeyError):
+        provider.book(SLOTS[0])
+    assert provider.between(MONDAY, tuesday) == [Slot(SLOTS[1]), SLOTS[2]]
+    provider.add(SLOTS[0])
+    assert len(provider.between(MONDAY, tuesday)) == 3
+
+
+class CountingProvider(InMemoryAvailabilityProvider):
+    def __init__(self, slots):
+        super().__init__(slots)
+        self.lookups = 0
+
+    def between(self, start, end, resource=None):
+        self.lookups += 1
+        time.sleep(0.05)
+        return super().between(start, end, resource)
+
+
+def test_cached_provider_batches_lookups_of_the_same_day():
+    backend = CountingProvider(SLOTS)
+    provider = CachedAvailabilityProvider(backend)
+    morning = (MONDAY, MONDAY + datetime.timedelta(hours=12))
+    afternoon = (MONDAY + datetime.timedelta(hours=12), MONDAY + datetime.timedelta(days=1))
+    results = []
+    threads = [
+        threading.Thread(target=lambda r=r: results.append(provider.between(*r)))
+        for r in [morning, afternoon] * 4
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.lookups == 1
+    assert sorted(len(r) for r in results) == [1] * 4 + [2] * 4
+
+    provider.book(SLOTS[0])
+    assert provider.between(*morning) == []
+    assert backend.lookups == 2
+
+
+def test_cached_provider_sees_writes_of_other_workers(tmp_path):
+    path = str(tmp_path / "slots.db")
+    provider = CachedAvailabilityProvider(SQLiteAvailabilityProvider(path, SLOTS))
+    other_worker = SQLiteAvailabilityProvider(path)
+    tuesday = MONDAY + datetime.timedelta(days=1)
+    assert len(provider.between(MONDAY, tuesday)) == 3
+    other_worker.book(SLOTS[1])
+    assert provider.between(MONDAY, tuesday) == [Slot(SLOTS[0]), SLOTS[2]]
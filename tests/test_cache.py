@@ -0,0 +1,77 @@
+from langchain.llms.fake import FakeListLLM
+
+from lib.cache import LRUCache, ResponseCache, SQLiteCache
+from lib.conversation_memory import ConversationMemory
+from conftest import FakeNERLLM, FORM_ENTITIES
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert (cache.stats.hits, cache.stats.misses) == (3, 1)
+
+
+def test_sqlite_cache_persists_and_evicts(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteCache(path, max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.set("c", "3")
+    assert len(cache) == 2
+    assert SQLiteCache(path).get("c") == "3"
+    assert SQLiteCache(path).get("a") is None
+
+
+def test_sqlite_cache_only_updates_stale_access_times(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteCache(path, touch_interval=60)
+    cache.set("a", "1")
+
+    def accessed_at() -> float:
+        return cache._connection.execute(
+            "SELECT accessed_at FROM cache WHERE key = 'a'"
+        ).fetchone()[0]
+
+    written = accessed_at()
+    assert cache.get("a") == "1"
+    assert accessed_at() == written
+
+    cache.touch_interval = 0
+    assert cache.get("a") == "1"
+    assert accessed_at() > written
+    assert cache._connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_response_cache_promotes_disk_hits(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResponseCache(path=path).set("key", "[]")
+    cache = ResponseCache(path=path)
+    assert cache.get("key") == "[]"
+    assert cache.memory.get("key") == "[]"
+    assert cache.stats.hits == 1
+
+
+def test_response_cache_key_depends_on_llm_parameters():
+    llm = FakeListLLM(responses=["[]"])
+    key = ResponseCache.make_key("prompt", llm)
+    assert key == ResponseCache.make_key("prompt", FakeListLLM(responses=["[]"]))
+    assert key != ResponseCache.make_key("other prompt", llm)
+    assert key != ResponseCache.make_key("prompt", FakeListLLM(responses=["{}"]))
+    assert key != ResponseCache.make_key("prompt", FakeNERLLM())
+    assert key != ResponseCache.make_key("prompt", llm, stop=["\n"])
+
+
+def test_ner_cache_is_shared_by_sessions(make_blueprint):
+    cache = ResponseCache()
+    ner_llm = FakeNERLLM(entities=FORM_ENTITIES)
+    blueprint = make_blueprint(ner_llm=ner_llm, ner_cache=cache)
+    for _ in range(3):
+        output = blueprint.new_session()("I'm nathan")
+        assert output["variables"]["first_name"] == "Nathan"
+    assert ner_llm.calls == 1
+    assert (cache.stats.hits, cache.stats.misses) == (2, 1)
@@ -0,0 +1,146 @@
+import datetime
+import json
+
+import pytest
+
+from langchain.llms.fake import FakeListLLM
+
+from lib.cache import LRUCache
+from lib.ner.entities.datetime_entity import DateTimeEntity, DateTimeResolutionCache
+from lib.ner.entities.datetime_rules import parse_datetime
+
+DATETIME = {"start": "2023-06-26T00:00:00", "end": "2023-07-02T23:59:59", "grain": 604800}
+
+
+def test_resolutions_are_memoized():
+    llm = FakeListLLM(responses=[json.dumps(DATETIME)])
+    assert DateTimeEntity.resolve("First week of July", llm).dict() == DATETIME
+    assert DateTimeEntity.resolve("first  week of july!", llm).dict() == DATETIME
+    assert llm.i == 1
+    assert DateTimeEntity.resolution_cache.stats.hit_ratio == 0.5
+
+
+def test_failed_resolutions_are_not_memoized():
+    llm = FakeListLLM(responses=["not a date", json.dumps(DATETIME)])
+    assert DateTimeEntity.resolve("first week of july", llm) is None
+    assert DateTimeEntity.resolve("first week of july", llm).dict() == DATETIME
+
+
+def test_resolution_cache_expires_when_the_date_changes():
+    cache = DateTimeResolutionCache()
+    monday = datetime.datetime(2023, 6, 19, 10)
+    key = cache.key("tomorrow", monday)
+    cache.set(key, DATETIME)
+    assert cache.get(cache.key("Tomorrow", monday.replace(hour=18))) == DATETIME
+    assert cache.get(cache.key("tomorrow", monday + datetime.timedelta(days=1))) is None
+    assert len(cache.entries) == 0
+
+
+def test_time_relative_expressions_are_anchored_on_the_minute():
+    cache = DateTimeResolutionCache()
+    now = datetime.datetime(2023, 6, 19, 10, 5, 10)
+    assert cache.key("in 90 minutes", now) == cache.key("in 90 minutes", now.replace(second=50))
+    assert cache.key("in 90 minutes", now) != cache.key("in 90 minutes", now.replace(minute=6))
+    assert cache.key("in a bit", now) != cache.key("in a bit", now.replace(minute=6))
+    assert cache.key("tomorrow", now) == cache.key("tomorrow", now.replace(hour=11))
+
+
+def test_resolutions_are_memoized_per_llm():
+    cache = DateTimeResolutionCache()
+    now = datetime.datetime(2023, 6, 19, 10, 5)
+    key = cache.key("tomorrow", now, FakeListLLM(responses=["[]"]))
+    assert key == cache.key("tomorrow", now, FakeListLLM(responses=["[]"]))
+    assert key != cache.key("tomorrow", now, FakeListLLM(responses=["{}"]))
+
+
+def test_common_expressions_are_resolved_without_llm():
+    llm = FakeListLLM(responses=[])
+    entity = DateTimeEntity.parse_obj({"value": "Tomorrow", "llm": llm})
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    assert entity.value.start == f"{tomorrow.isoformat()}T00:00:00"
+    assert entity.value.grain == 24 * 3600
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        (
+            "in a couple of hours",
+            {"start": "2023-06-21T12:30:15", "end": "2023-06-21T13:30:14", "grain": 3600},
+        ),
+        (
+            "in 1 hour",
+            {"start": "2023-06-21T11:30:15", "end": "2023-06-21T12:30:14", "grain": 3600},
+        ),
+        (
+            "Tomorrow",
+            {"start": "2023-06-22T00:00:00", "end": "2023-06-22T23:59:59", "grain": 86400},
+        ),
+        (
+            "tomorrow at 9:30am",
+            {"start": "2023-06-22T09:30:00", "end": "2023-06-22T10:29:59", "grain": 3600},
+        ),
+        (
+            "Thursday 2pm",
+            {"start": "2023-06-22T14:00:00", "end": "2023-06-22T14:59:59", "grain": 3600},
+        ),
+        (
+            "wednesday at 14:00",
+            {"start": "2023-06-21T14:00:00", "end": "2023-06-21T14:59:59", "grain": 3600},
+        ),
+        (
+            "next Wednesday",
+            {"start": "2023-06-28T00:00:00", "end": "2023-06-28T23:59:59", "grain": 86400},
+        ),
+        (
+            "Next Tuesday 4pm",
+            {"start": "2023-06-27T16:00:00", "end": "2023-06-27T16:59:59", "grain": 3600},
+        ),
+        (
+            "next week",
+            {"start": "2023-06-26T00:00:00", "end": "2023-07-02T23:59:59", "grain": 604800},
+        ),
+        (
+            "Next month.",
+            {"start": "2023-07-01T00:00:00", "end": "2023-07-31T23:59:59", "grain": 2678400},
+        ),
+        ("thursday at 4", None),
+        ("the first week of july", None),
+        ("thursday 25pm", None),
+    ],
+)
+def test_parse_datetime(text, expected):
+    # A Wednesday
+    now = datetime.datetime(2023, 6, 21, 10, 30, 15, 123)
+    assert parse_datetime(text, now) == expected
+
+
+def test_chain_is_built_once_per_day_and_llm():
+    llm = FakeListLLM(responses=[])
+    chain = DateTimeEntity.get_chain(llm)
+    assert DateTimeEntity.get_chain(llm) is chain
+    assert DateTimeEntity.get_chain(FakeListLLM(responses=[])) is not chain
+
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    DateTimeEntity._chains.set(id(llm), (yesterday, llm, chain))
+    assert DateTimeEntity.get_chain(llm) is not chain
+
+
+def test_chains_are_bounded(monkeypatch):
+    monkeypatch.setattr(DateTimeEntity, "_chains", LRUCache(max_entries=2))
+    llms = [FakeListLLM(responses=[]) for _ in range(3)]
+    for llm in llms:
+        DateTimeEntity.get_chain(llm)
+    assert len(DateTimeEntity._chains) == 2
+
+
+def test_time_relative_examples_are_rendered_per_call():
+    prompt = DateTimeEntity.get_chain(FakeListLLM(responses=[])).prompt
+    now = datetime.datetime(2023, 6, 21, 10, 30, 15)
+    later = now + datetime.timedelta(hours=3)
+    text = prompt.format(**DateTimeEntity.prompt_inputs("in a bit", now))
+    later_text = prompt.format(**DateTimeEntity.prompt_inputs("in a bit", later))
+    assert "date time is Wednesday, June 21, 2023 10:30" in text
+    assert '"start": "2023-06-21T12:30:15"' in text
+    assert '"start": "2023-06-21T15:30:15"' in later_text
+    assert "Next Tuesday 4pm" in text and text.endswith("in a bit\nISO:")
@@ -0,0 +1,48 @@
+import pytest
+
+from lib.ner.entities.basic_entities import BooleanEntity, IntEntity
+from lib.ner.extractors import (
+    EmailExtractor,
+    IntExtractor,
+    PhoneNumberExtractor,
+    YesNoExtractor,
+    default_extractors,
+)
+
+HISTORY = "User: Hi\nAI: You are Bob and your phone number is 514-666-7777. Is everything correct?"
+
+
+@pytest.mark.parametrize(
+    "extractor, text, history, expected",
+    [
+        (PhoneNumberExtractor(), "514-666-7777", "", "514-666-7777"),
+        (PhoneNumberExtractor(), "it's 514-666-7777", "", None),
+        (EmailExtractor(), " bob@example.com.", "", "bob@example.com"),
+        (EmailExtractor(), "bob at example.com", "", None),
+        (IntExtractor(), "42", "", 42),
+        (IntExtractor(), "42 or 43", "", None),
+        (YesNoExtractor(), "Yes!", HISTORY, True),
+        (YesNoExtractor(), "nope", HISTORY, False),
+        (YesNoExtractor(), "yes but my name is Jim", HISTORY, None),
+        (YesNoExtractor(), "yes", "User: Hi\nAI: What is your name?", None),
+    ],
+)
+def test_extractors(extractor, text, history, expected):
+    assert extractor.extract(text, history) == expected
+
+
+def test_process_chain_skips_ner_llm_for_extracted_entities(make_process_chain):
+    chain = make_process_chain()
+    ner_chain = chain.chains[0]
+    chain("I'm nathan")
+    assert chain.ner_llm.calls == 1
+    # The process now asks for the age, resolved by the `IntEntity` extractor
+    chain("42")
+    assert chain.ner_llm.calls == 1
+    assert chain.memory.kv_store.get("age") == 42
+    assert ner_chain.skip_rate == 0.5
+
+
+def test_boolean_entities_have_no_default_extractor():
+    extractors = default_extractors({"confirmed": BooleanEntity, "age": IntEntity})
+    assert list(extractors) == ["age"]
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain.llms.base import LLM
+
+from conftest import FakeChatLLM, FakeNERLLM, FORM_ENTITIES
+from lib.llm_scheduler import LLMScheduler, Priority, ScheduledLLM, TokenBucket
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Rate limit reached")
+        self.headers = {"retry-after": str(retry_after)}
+
+
+class RateLimitedStubLLM(LLM):
+    """Reject the requests exceeding `requests` per `period` seconds, like a provider."""
+
+    requests: int
+    period: float
+    fail_first: int = 0
+    calls: int = 0
+    rejected: int = 0
+    bucket: Any = None
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.bucket = TokenBucket(self.requests, self.period)
+
+    @property
+    def _llm_type(self) -> str:
+        return "rate-limited-stub"
+
+    def _check(self) -> None:
+        self.calls += 1
+        if self.calls <= self.fail_first or self.bucket.wait_time(1, time.monotonic()) > 0:
+            self.rejected += 1
+            raise RateLimitError(retry_after=0.01)
+        self.bucket.take(1)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self._check()
+        return "ok"
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self._check()
+        await asyncio.sleep(0)
+        return "ok"
+
+
+def test_calls_stay_within_the_provider_limits():
+    stub = RateLimitedStubLLM(requests=10, period=0.2)
+    scheduler = LLMScheduler(requests_per_minute=10, period=0.2)
+    llm = ScheduledLLM(llm=stub, scheduler=scheduler, max_retries=0)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(llm.predict("hey"))) for _ in range(25)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["ok"] * 25
+    assert stub.rejected == 0
+    # 9 calls at once, then one every 22ms
+    assert time.monotonic() - start >= 0.3
+    assert scheduler.metrics.granted == 25
+    assert scheduler.metrics.delayed >= 15
+
+
+def test_async_calls_stay_within_the_provider_limits():
+    stub = RateLimitedStubLLM(requests=5, period=0.1)
+    llm = ScheduledLLM(
+        llm=stub, scheduler=LLMScheduler(requests_per_minute=5, period=0.1), max_retries=0
+    )
+
+    async def run():
+        return await asyncio.gather(*[llm.apredict("hey") for _ in range(15)])
+
+    assert asyncio.run(run()) == ["ok"] * 15
+    assert stub.rejected == 0
+
+
+def test_interactive_calls_go_first():
+    scheduler = LLMScheduler(max_concurrency=1)
+    scheduler.acquire(10)
+    background = scheduler.submit(10, Priority.BACKGROUND)
+    interactive = scheduler.submit(10, Priority.INTERACTIVE)
+    assert scheduler.metrics.snapshot()["queue_depth"] == {"interactive": 1, "background": 1}
+
+    scheduler.release(10)
+    assert interactive.done() and not background.done()
+    scheduler.release(10)
+    assert background.done()
+    assert scheduler.metrics.max_queue_depth == 2
+
+
+def test_token_budget_is_corrected_with_the_usage():
+    scheduler = LLMScheduler(tokens_per_minute=1000, headroom=1)
+    scheduler.acquire(800)
+    assert not scheduler.submit(800).done()
+    scheduler.release(800, used_tokens=100)
+    assert scheduler.metrics.granted == 2
+
+
+def test_rate_limited_calls_back_off_and_retry():
+    stub = RateLimitedStubLLM(requests=100, period=1, fail_first=2)
+    scheduler = LLMScheduler(requests_per_minute=100, period=1)
+    llm = ScheduledLLM(llm=stub, scheduler=scheduler, max_retries=2)
+    assert llm.predict("hey") == "ok"
+    assert stub.calls == 3
+    assert scheduler.metrics.rate_limit_errors == 2
+    assert scheduler.metrics.running == 0
+
+
+def test_backoff_holds_calls_without_rate_budgets():
+    scheduler = LLMScheduler(max_concurrency=4)
+    scheduler.backoff(0.1)
+    held = scheduler.submit(10)
+    assert not held.done()
+    held.result(timeout=1)
+    assert scheduler.metrics.delayed == 1
+
+
+def test_backoff_holds_calls_when_the_budgets_allow_them():
+    scheduler = LLMScheduler(requests_per_minute=100, period=1)
+    scheduler.backoff(0.1)
+    # The budget is refilled, only the pause holds the call
+    scheduler.request_bucket.level = scheduler.request_bucket.capacity
+    held = scheduler.submit(10)
+    assert not held.done()
+    held.result(timeout=1)
+
+
+def test_process_chain_with_scheduled_llms(make_process_chain):
+    scheduler = LLMScheduler(requests_per_minute=100, tokens_per_minute=100_000)
+    chain = make_process_chain(
+        ner_llm=ScheduledLLM(llm=FakeNERLLM(entities=FORM_ENTITIES), scheduler=scheduler),
+        chat_llm=ScheduledLLM(llm=FakeChatLLM(), scheduler=scheduler),
+    )
+    assert chain("I'm nathan")["response"] == "You said I'm nathan"
+    assert asyncio.run(chain.acall("42"))["result"]["status"] == "completed"
+    assert scheduler.metrics.granted >= 2
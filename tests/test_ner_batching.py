@@ -0,0 +1,210 @@
+import asyncio
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain.chat_models.base import SimpleChatModel
+from langchain.prompts import PromptTemplate
+from langchain.schema import BaseMessage, LLMResult
+
+from conftest import FakeNERLLM, FORM_ENTITIES
+from lib.llm_scheduler import used_tokens
+from lib.ner.batching import BatchingLLM
+from lib.session import SessionManager
+
+
+class InvalidRequestError(Exception):
+    """Named like the error of the OpenAI client for the requests it rejects."""
+
+
+class BatchRecordingLLM(FakeNERLLM):
+    """Record the size of the batches and count one token per character of the prompts."""
+
+    batch_sizes: list[int] = []
+    fail: bool = False
+    # Reject the batches containing a prompt with this text
+    poison: Optional[str] = None
+
+    def _check(self, prompts: List[str]) -> None:
+        self.batch_sizes.append(len(prompts))
+        if self.fail:
+            raise ValueError("Model unavailable")
+        if self.poison and any(self.poison in p for p in prompts):
+            raise InvalidRequestError("Prompt too long")
+
+    @staticmethod
+    def _with_usage(result: LLMResult, prompts: List[str]) -> LLMResult:
+        tokens = sum(len(p) for p in prompts)
+        result.llm_output = {"token_usage": {"total_tokens": tokens}, "model_name": "fake"}
+        return result
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, **kwargs: Any):
+        self._check(prompts)
+        return self._with_usage(super()._generate(prompts, stop, **kwargs), prompts)
+
+    async def _agenerate(
+        self, prompts: List[str], stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> LLMResult:
+        self._check(prompts)
+        return self._with_usage(await super()._agenerate(prompts, stop, **kwargs), prompts)
+
+
+class SlowChatModel(SimpleChatModel):
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-chat"
+
+    def _call(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> str:
+        self.calls += 1
+        time.sleep(0.1)
+        return "[]"
+
+
+def prompt(text: str):
+    return PromptTemplate.from_template("text: {text}\nentities:").format_prompt(text=text)
+
+
+def test_concurrent_sessions_share_a_batch(make_blueprint):
+    recorder = BatchRecordingLLM(entities=FORM_ENTITIES, batch_sizes=[])
+    sessions = SessionManager(
+        make_blueprint(ner_llm=BatchingLLM(llm=recorder, max_wait=0.05))
+    )
+    inputs = ["I'm nathan", "I'm jenny", "42", "hey"]
+
+    async def run():
+        return await asyncio.gather(
+            *[sessions.get(str(i)).acall(text) for i, text in enumerate(inputs)]
+        )
+
+    asyncio.run(run())
+    assert recorder.batch_sizes == [4]
+    assert sessions.get("0").chain.memory.kv_store.get("first_name") == "Nathan"
+    assert sessions.get("1").chain.memory.kv_store.get("first_name") == "Jenny"
+    assert sessions.get("2").chain.memory.kv_store.get("age") == 42
+
+
+def test_batches_are_limited_in_size():
+    recorder = BatchRecordingLLM(entities=FORM_ENTITIES, batch_sizes=[])
+    llm = BatchingLLM(llm=recorder, max_wait=0.05, max_batch_size=2)
+    texts = ["I'm nathan", "I'm jenny", "42", "hey", "I'm nathan"]
+
+    async def run():
+        return await asyncio.gather(*[llm.agenerate_prompt([prompt(text)]) for text in texts])
+
+    results = asyncio.run(run())
+    assert sorted(recorder.batch_sizes) == [1, 2, 2]
+    assert [r.generations[0][0].text for r in results] == [
+        '[{"name": "first_name", "value": "Nathan"}]',
+        '[{"name": "first_name", "value": "Jenny"}]',
+        '[{"name": "age", "value": "42"}]',
+        "[]",
+        '[{"name": "first_name", "value": "Nathan"}]',
+    ]
+    assert llm.stats.average_batch_size == 5 / 3
+
+
+def test_threads_share_a_batch_and_its_errors():
+    recorder = BatchRecordingLLM(entities=FORM_ENTITIES, batch_sizes=[], fail=True)
+    llm = BatchingLLM(llm=recorder, max_wait=0.05)
+    errors = []
+
+    def call(text: str):
+        try:
+            llm.generate_prompt([prompt(text)])
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(text,)) for text in ["42", "hey", "yo"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The error of the batch is not caused by a prompt, so no call runs again
+    assert recorder.batch_sizes == [3]
+    assert len(errors) == 3
+    assert errors[0] is errors[1] is errors[2]
+
+
+def test_errors_of_a_batch_fail_all_its_async_calls():
+    recorder = BatchRecordingLLM(entities=FORM_ENTITIES, batch_sizes=[], fail=True)
+    llm = BatchingLLM(llm=recorder, max_wait=0.05)
+
+    async def run():
+        return await asyncio.gather(
+            *[llm.agenerate_prompt([prompt(text)]) for text in ["42", "hey", "yo"]],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert recorder.batch_sizes == [3]
+
+
+def test_a_failing_prompt_only_fails_its_own_call():
+    recorder = BatchRecordingLLM(entities=FORM_ENTITIES, batch_sizes=[], poison="boom")
+    llm = BatchingLLM(llm=recorder, max_wait=0.05)
+    texts = ["I'm nathan", "boom", "42"]
+
+    async def run():
+        return await asyncio.gather(
+            *[llm.agenerate_prompt([prompt(text)]) for text in texts], return_exceptions=True
+        )
+
+    nathan, boom, age = asyncio.run(run())
+    assert isinstance(boom, InvalidRequestError)
+    assert nathan.generations[0][0].text == '[{"name": "first_name", "value": "Nathan"}]'
+    assert age.generations[0][0].text == '[{"name": "age", "value": "42"}]'
+    assert sorted(recorder.batch_sizes) == [1, 1, 1, 3]
+    assert used_tokens(age) == len(prompt("42").to_string())
+
+
+def test_calls_get_their_share_of_the_token_usage():
+    recorder = BatchRecordingLLM(entities=FORM_ENTITIES, batch_sizes=[])
+    llm = BatchingLLM(llm=recorder, max_wait=0.05)
+    texts = ["I'm nathan", "42"]
+
+    async def run():
+        return await asyncio.gather(*[llm.agenerate_prompt([prompt(text)]) for text in texts])
+
+    results = asyncio.run(run())
+    assert recorder.batch_sizes == [2]
+    assert [used_tokens(result) for result in results] == [
+        len(prompt(text).to_string()) for text in texts
+    ]
+    assert results[0].llm_output["model_name"] == "fake"
+
+
+def test_chat_model_calls_are_not_batched():
+    chat = SlowChatModel()
+    llm = BatchingLLM(llm=chat, max_wait=0.05)
+    threads = [
+        threading.Thread(target=llm.generate_prompt, args=([prompt(text)],))
+        for text in ["42", "hey", "yo", "hi"]
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The requests ran at the same time rather than one after the other in a batch
+    assert time.perf_counter() - start < 0.3
+    assert chat.calls == 4
+    assert llm.stats.batches == 0
+
+
+def test_calls_with_different_stop_words_are_not_batched():
+    recorder = BatchRecordingLLM(entities=FORM_ENTITIES, batch_sizes=[])
+    llm = BatchingLLM(llm=recorder, max_wait=0.02)
+
+    async def run():
+        await asyncio.gather(
+            llm.agenerate_prompt([prompt("42")]),
+            llm.agenerate_prompt([prompt("hey")], stop=["\n"]),
+        )
+
+    asyncio.run(run())
+    assert recorder.batch_sizes == [1, 1]
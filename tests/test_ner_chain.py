@@ -0,0 +1,146 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, ClassVar, List, Optional
+
+import pytest
+from langchain.llms.base import LLM
+
+from lib.ner.entities.basic_entities import Entity
+from lib.ner.entities.datetime_entity import DateTimeEntity
+from lib.ner.ner_chain import NERChain
+
+DATETIME = {"start": "2023-06-26T00:00:00", "end": "2023-07-02T23:59:59", "grain": 604800}
+
+RAW_ENTITIES = json.dumps(
+    [
+        {"name": "availability", "value": "first week of july"},
+        {"name": "confirmation_date", "value": "end of the month"},
+        {"name": "first_name", "value": "Nathan"},
+    ]
+)
+
+
+class SlowDateTimeLLM(LLM):
+    delays: dict[str, float] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-datetime"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        time.sleep(self.delays.get(prompt.strip().split("\n")[-2], 0.2))
+        return json.dumps(DATETIME)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        await asyncio.sleep(self.delays.get(prompt.strip().split("\n")[-2], 0.2))
+        return json.dumps(DATETIME)
+
+
+ENTITIES = {
+    "availability": DateTimeEntity,
+    "confirmation_date": (DateTimeEntity, SlowDateTimeLLM()),
+    "first_name": Entity,
+}
+
+EXPECTED = [
+    {"name": "availability", "value": DATETIME},
+    {"name": "confirmation_date", "value": DATETIME},
+    {"name": "first_name", "value": "Nathan"},
+]
+
+
+def test_parse_entities_resolves_llm_entities_concurrently():
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        entities = NERChain.parse_entities(
+            ENTITIES, RAW_ENTITIES, SlowDateTimeLLM(), executor=executor
+        )
+    assert time.perf_counter() - start < 0.35
+    assert json.loads(NERChain.dump_entities(entities)) == EXPECTED
+
+
+def test_parse_entities_drops_entities_resolved_after_timeout():
+    llm = SlowDateTimeLLM(delays={"first week of july": 1})
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        entities = NERChain.parse_entities(
+            ENTITIES, RAW_ENTITIES, llm, executor=executor, timeout=0.4
+        )
+    assert json.loads(NERChain.dump_entities(entities)) == EXPECTED[1:]
+
+
+def test_parse_entities_timeout_excludes_the_wait_for_a_worker():
+    llm = SlowDateTimeLLM(delays={"first week of july": 0.3, "end of the month": 0.3})
+    entities = {"availability": DateTimeEntity, "confirmation_date": DateTimeEntity}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        parsed = NERChain.parse_entities(entities, RAW_ENTITIES, llm, executor=executor, timeout=0.5)
+    assert json.loads(NERChain.dump_entities(parsed)) == EXPECTED[:2]
+
+
+CHAIN_ENTITIES = {
+    "availability": DateTimeEntity,
+    "confirmation_date": DateTimeEntity,
+    "first_name": Entity,
+}
+
+
+def test_ner_chain_closes_only_the_executor_it_created():
+    chain = NERChain(llm=SlowDateTimeLLM(), entities=CHAIN_ENTITIES, verbose=False)
+    chain.close()
+    with pytest.raises(RuntimeError):
+        chain.executor.submit(time.sleep, 0)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        chain = NERChain(
+            llm=SlowDateTimeLLM(), entities=CHAIN_ENTITIES, executor=executor, verbose=False
+        )
+        chain.close()
+        assert executor.submit(lambda: 1).result() == 1
+
+
+class CountingEntity(Entity):
+    requires_llm: ClassVar[bool] = True
+    running: ClassVar[int] = 0
+    max_running: ClassVar[int] = 0
+
+    @classmethod
+    async def aparse_obj(cls, obj: dict[str, Any]) -> Entity:
+        CountingEntity.running += 1
+        CountingEntity.max_running = max(CountingEntity.max_running, CountingEntity.running)
+        await asyncio.sleep(0.05)
+        CountingEntity.running -= 1
+        return cls.parse_obj(obj)
+
+
+def test_ner_chain_bounds_async_resolution_across_turns():
+    entities = {"availability": CountingEntity, "confirmation_date": CountingEntity}
+    chain = NERChain(llm=SlowDateTimeLLM(), entities=entities, max_concurrency=2, verbose=False)
+    transform = chain.chains[1]
+
+    async def run():
+        return await asyncio.gather(
+            *[transform.acall({"raw_entities": RAW_ENTITIES}) for _ in range(3)]
+        )
+
+    outputs = asyncio.run(run())
+    assert CountingEntity.max_running == 2
+    assert all(len(output["entities"]) == 2 for output in outputs)
+    chain.close()
+
+
+def test_aparse_entities_resolves_llm_entities_concurrently():
+    start = time.perf_counter()
+    entities = asyncio.run(
+        NERChain.aparse_entities(ENTITIES, RAW_ENTITIES, SlowDateTimeLLM(), max_concurrency=2)
+    )
+    assert time.perf_counter() - start < 0.35
+    assert json.loads(NERChain.dump_entities(entities)) == EXPECTED
+
+
+def test_aparse_entities_drops_entities_resolved_after_timeout():
+    llm = SlowDateTimeLLM(delays={"first week of july": 1})
+    entities = asyncio.run(
+        NERChain.aparse_entities(ENTITIES, RAW_ENTITIES, llm, timeout=0.4)
+    )
+    assert json.loads(NERChain.dump_entities(entities)) == EXPECTED[1:]
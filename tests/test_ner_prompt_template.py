@@ -17,4 +17,140 @@ from lib.ner.ner_prompt_template import NERPromptTemplate  # replace with the ac
     ],
 )
 def test_get_entity_extraction_context(text: str, expected: str):
-    assert NERPromptTemplate.get_entity_extraction_context(text) == expected
\ No newline at end of file
+    assert NERPromptTemplate.get_entity_extraction_context(text) == expected
+
+def test_format_only_substitutes_context_and_input(monkeypatch):
+    from lib.ner.entities.basic_entities import Entity, EntityExample
+
+    template = NERPromptTemplate(
+        input_variables=["input", "history"],
+        entities={"first_name": Entity, "age": Entity},
+        examples=[
+            EntityExample.parse_obj(
+                {
+                    "context": "What is your name?",
+                    "text": "I'm Bob",
+                    "entities": [{"name": "first_name", "value": "Bob"}],
+                }
+            ),
+            EntityExample.parse_obj({"text": "Yes", "entities": []}),
+        ],
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Examples should be serialized once")
+
+    monkeypatch.setattr(EntityExample, "dict", fail)
+    output = template.format(input="I'm {Jo}", history="User: Hi\nAI: Your name?")
+    assert "Extract entities first_name, age from the 'text'" in output
+    assert (
+        'context: What is your name?\ntext: I\'m Bob\nentities:\n[{"name": "first_name", "value": "Bob"}]'
+        "\n\n\ntext: Yes\nentities:\n[]"
+    ) in output
+    assert output.endswith("context: Your name?\ntext: I'm {Jo}\nentities:")
+
+
+def test_format_prunes_irrelevant_entities_and_examples():
+    from lib.ner.entities.basic_entities import Entity, EntityExample
+
+    template = NERPromptTemplate(
+        input_variables=["input", "history", "relevant_entities"],
+        entities={"first_name": Entity, "age": Entity},
+        examples=[
+            EntityExample.parse_obj(
+                {"text": "I'm Bob", "entities": [{"name": "first_name", "value": "Bob"}]}
+            ),
+            EntityExample.parse_obj(
+                {"text": "I'm 42", "entities": [{"name": "age", "value": "42"}]}
+            ),
+            EntityExample.parse_obj({"text": "Yes", "entities": []}),
+        ],
+    )
+    kwargs = {"input": "Hi", "history": "AI: Age?"}
+    output = template.format(relevant_entities=["age"], **kwargs)
+    assert "Extract entities age from the 'text'" in output
+    assert "I'm 42" in output and "text: Yes" in output
+    assert "I'm Bob" not in output
+    assert template.format(relevant_entities=None, **kwargs) == template.format(**kwargs)
+    assert "I'm Bob" in template.format(**kwargs)
+
+
+def test_process_chain_relevant_entities(make_process_chain):
+    chain = make_process_chain(prune_ner_prompt=True)
+    assert chain.relevant_entities({}) == ["first_name", "age"]
+    assert chain.relevant_entities({"first_name": "Bob", "errors": {}}) == ["age"]
+    assert chain.relevant_entities({"first_name": "Bob", "errors": {"age": "Too old"}, "age": 1}) == ["age"]
+    # All collected, the User can change any of them
+    assert chain.relevant_entities({"first_name": "Bob", "age": 1}) is None
+    chain("I'm nathan")
+    assert chain.memory.kv_store.get("first_name") == "Nathan"
+
+
+def test_format_lists_the_offered_options():
+    from lib.ner.entities.basic_entities import Entity
+
+    template = NERPromptTemplate(
+        input_variables=["input", "history", "offered_options"],
+        entities={"availability": Entity},
+    )
+    kwargs = {"input": "The last one", "history": "AI: Tuesday or Friday?"}
+    output = template.format(
+        offered_options=["2023-07-04T09:00:00", "2023-07-07T14:00:00"], **kwargs
+    )
+    assert output.startswith(
+        "context: Tuesday or Friday?\n"
+        'offered options: ["2023-07-04T09:00:00", "2023-07-07T14:00:00"]\n'
+        "text: The last one"
+    )
+    assert template.format(offered_options=None, **kwargs) == template.format(**kwargs)
+
+
+def test_process_chain_passes_the_offered_options_to_the_ner(make_process_chain):
+    chain = make_process_chain(ner_offered_options=["first_name", "age"])
+    assert chain.offered_options({}) is None
+    assert chain.offered_options({"first_name": ["Bob", "Jim"], "age": 42}) == ["Bob", "Jim", 42]
+    inputs = chain.ner_inputs({"input": "Jim", "variables": {"first_name": ["Bob", "Jim"]}})
+    assert inputs["offered_options"] == ["Bob", "Jim"]
+    assert make_process_chain().ner_inputs({"input": "Jim"})["offered_options"] is None
+    chain("I'm nathan")
+    assert chain.memory.kv_store.get("first_name") == "Nathan"
+
+
+def test_format_selects_similar_examples_within_budget():
+    from lib.ner.entities.basic_entities import Entity, EntityExample
+
+    def example(text, name=None):
+        entities = [{"name": name, "value": text}] if name else []
+        return EntityExample.parse_obj({"text": text, "entities": entities})
+
+    examples = [
+        example("My name is Bob", "first_name"),
+        example("I am 42 years old", "age"),
+        example("Call me Jim", "first_name"),
+        example("I am turning 30 next week, so 29 years old for now", "age"),
+    ]
+    template = NERPromptTemplate(
+        input_variables=["input", "history"],
+        entities={"first_name": Entity, "age": Entity},
+        examples=examples,
+        max_examples=2,
+    )
+    output = template.format(input="I'm 25 years old", history="AI: How old are you?")
+    assert "I am 42 years old" in output and "29 years old" in output
+    assert "Bob" not in output and "Jim" not in output
+
+    template = NERPromptTemplate(
+        input_variables=["input", "history"],
+        entities={"first_name": Entity, "age": Entity},
+        examples=examples,
+        example_token_budget=30,
+    )
+    output = template.format(input="I'm 25 years old", history="AI: How old are you?")
+    # The long example does not fit once the most similar one is included
+    assert "I am 42 years old" in output and "29 years old" not in output
+    assert template.select_examples("Call me Bob", ["first_name"]) == [2]
+
+    template.format(input="I'm 31 years old", history="AI: How old are you?")
+    # Same examples as the first input, so the same compiled template
+    assert len(template._selected_templates) == 1
+    assert template._selected_templates.stats.hits == 1
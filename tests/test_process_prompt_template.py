@@ -4,7 +4,7 @@ import pytest
 from pydantic import Field
 
 from lib.process.process_prompt_template import ProcessPromptTemplate
-from lib.process.schemas import Process
+from lib.process.schemas import Process, derived
 
 
 def test_process_prompt_template_format_with_errors():
@@ -75,3 +75,33 @@ def test_create_output(data, expected):
     template = ProcessPromptTemplate(process=MyProcess, validate_template=False)
     result = template.get_updates(data, {"a": 10, "b": 20, "c": 30})
     assert result == expected
+
+
+def test_process_prompt_derived_variables_are_lazy():
+    calls = []
+
+    class MyProcess(Process):
+        a: Optional[str] = Field(question="Is {{ full_name }} right?")
+        b: Optional[str] = Field(question="b")
+
+        @derived
+        def full_name(cls, variables) -> str:
+            calls.append(variables.get("first"))
+            return f"{variables.get('first')} Doe"
+
+    template = ProcessPromptTemplate(process=MyProcess, validate_template=False)
+    kwargs = {"history": "User: Hi\nAI: Hi", "diff": [], "input": "Yo"}
+
+    output = template.format(variables={"first": "John", "errors": {}}, **kwargs)
+    assert 'collect the User\'s`a`: "Is John Doe right?"' in output
+    assert calls == ["John"]
+
+    # Not computed when no rendered question references it
+    template.format(variables={"first": "John", "a": "yes", "errors": {}}, **kwargs)
+    assert calls == ["John"]
+
+    # Computed once when referenced by both the error and the question
+    template.format(
+        variables={"first": "Bob", "errors": {"a": "Not {{ full_name }}"}}, **kwargs
+    )
+    assert calls == ["John", "Bob"]
@@ -0,0 +1,32 @@
+from typing import Optional
+
+import pytest
+from pydantic import Field
+
+from lib.process.schemas import Process
+
+
+def test_process_spec_matches_schema():
+    class MyProcess(Process):
+        first_name: Optional[str] = Field(description="First name", question="Name?")
+        age: Optional[int] = Field(aknowledgement="Got it")
+        notes: Optional[str] = None
+
+    spec = MyProcess.spec
+    properties = MyProcess.schema()["properties"]
+    for name, field in spec.fields.items():
+        assert field.title == properties[name]["title"]
+    assert spec.fields["first_name"].description == "First name"
+    assert spec.question_fields == ["first_name"]
+    assert spec.fields["age"].is_surfaced
+    assert not spec.fields["notes"].is_surfaced
+    assert spec.non_optional_fields == set()
+
+
+def test_process_spec_rejects_non_optional_fields():
+    with pytest.raises(ValueError):
+
+        class MyProcess(Process):
+            name: str
+
+        MyProcess(name="Bob")
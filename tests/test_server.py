@@ -0,0 +1,172 @@
+import asyncio
+import json
+from typing import Any, Optional
+
+from lib.process.process_chain import ProcessChain
+from lib.server import ChatServer
+from conftest import FakeChatLLM
+
+
+async def request(
+    app: ChatServer, method: str, path: str, body: Optional[dict] = None
+) -> tuple[int, Any]:
+    messages = [{"type": "http.request", "body": json.dumps(body).encode() if body else b""}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": method, "path": path}, receive, send)
+    content = sent[1]["body"]
+    return sent[0]["status"], json.loads(content) if content else None
+
+
+async def websocket(app: ChatServer, path: str, texts: list[str]) -> list[dict]:
+    messages = [{"type": "websocket.connect"}]
+    messages += [{"type": "websocket.receive", "text": text} for text in texts]
+    messages.append({"type": "websocket.disconnect"})
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "websocket", "path": path}, receive, send)
+    assert sent[0]["type"] == "websocket.accept"
+    return [json.loads(message["text"]) for message in sent[1:]]
+
+
+def test_turns_over_http(make_blueprint):
+    app = ChatServer(make_blueprint())
+
+    async def run():
+        status, created = await request(app, "POST", "/sessions")
+        assert status == 201
+        session_id = created["session_id"]
+        await request(app, "POST", f"/sessions/{session_id}/turns", {"input": "I'm nathan"})
+        return await request(app, "POST", f"/sessions/{session_id}/turns", {"input": "42"})
+
+    status, turn = asyncio.run(run())
+    assert status == 200
+    assert turn["response"] == "You said 42"
+    assert turn["result"]["status"] == "completed"
+
+
+def test_sessions_are_isolated_and_dropped(make_blueprint):
+    app = ChatServer(make_blueprint())
+
+    async def run():
+        for session_id in ["a", "b"]:
+            await request(app, "POST", "/sessions", {"session_id": session_id})
+        await request(app, "POST", "/sessions/a/turns", {"input": "I'm nathan"})
+        await request(app, "POST", "/sessions/b/turns", {"input": "I'm jenny"})
+        assert (await request(app, "DELETE", "/sessions/b"))[0] == 204
+        assert (await request(app, "DELETE", "/sessions/b"))[0] == 404
+        # A dropped session is not created again by a turn
+        assert (await request(app, "POST", "/sessions/b/turns", {"input": "hey"}))[0] == 404
+
+    asyncio.run(run())
+    assert app.sessions.get("a").chain.memory.kv_store.get("first_name") == "Nathan"
+    assert "b" not in app.sessions
+
+
+def test_invalid_requests(make_blueprint):
+    app = ChatServer(make_blueprint())
+
+    async def run():
+        await request(app, "POST", "/sessions", {"session_id": "a"})
+        return [
+            await request(app, "POST", "/sessions/a/turns", {"text": "hey"}),
+            await request(app, "GET", "/sessions/a/turns"),
+            await request(app, "GET", "/unknown"),
+        ]
+
+    statuses = [status for status, _ in asyncio.run(run())]
+    assert statuses == [400, 405, 404]
+
+
+def test_websocket_streams_the_response(make_blueprint):
+    app = ChatServer(make_blueprint(chat_llm=FakeChatLLM(streaming=True)))
+    app.sessions.get("a")
+    messages = asyncio.run(websocket(app, "/sessions/a/stream", ["I'm nathan"]))
+
+    tokens = [m["token"] for m in messages if m["type"] == "token"]
+    assert tokens == ["You ", "said ", "I'm ", "nathan"]
+    assert messages[-1]["type"] == "end"
+    assert messages[-1]["response"] == "You said I'm nathan"
+
+
+def slow_turns(app: ChatServer, monkeypatch) -> list[int]:
+    """Make the turns slower and return the chain and number of running turns of each."""
+    running = []
+    acall = ProcessChain.acall
+
+    async def slow_acall(chain, *args, **kwargs):
+        running.append((chain, app.running))
+        await asyncio.sleep(0.01)
+        return await acall(chain, *args, **kwargs)
+
+    monkeypatch.setattr(ProcessChain, "acall", slow_acall)
+    return running
+
+
+def test_concurrency_is_bounded(make_blueprint, monkeypatch):
+    app = ChatServer(make_blueprint(), max_concurrency=2, max_waiting=3)
+    running = slow_turns(app, monkeypatch)
+
+    async def run():
+        for i in range(6):
+            app.sessions.get(str(i))
+        turns = [
+            request(app, "POST", f"/sessions/{i}/turns", {"input": "hey"}) for i in range(6)
+        ]
+        return await asyncio.gather(*turns)
+
+    statuses = [status for status, _ in asyncio.run(run())]
+    assert max(count for _, count in running) == 2
+    assert statuses.count(200) == 5
+    assert statuses.count(503) == 1
+
+
+def test_turns_of_one_session_hold_one_slot(make_blueprint, monkeypatch):
+    app = ChatServer(make_blueprint(), max_concurrency=2)
+    running = slow_turns(app, monkeypatch)
+
+    async def run():
+        app.sessions.get("chatty")
+        app.sessions.get("other")
+        turns = [
+            request(app, "POST", "/sessions/chatty/turns", {"input": "hey"}) for _ in range(4)
+        ]
+        turns.append(request(app, "POST", "/sessions/other/turns", {"input": "hey"}))
+        return await asyncio.gather(*turns)
+
+    statuses = [status for status, _ in asyncio.run(run())]
+    assert statuses == [200] * 5
+    # The turn of the other session did not wait for the queued turns of the chatty one
+    chain, count = running[1]
+    assert chain is app.sessions.get("other").chain and count == 2
+
+
+def test_shutdown_drains_pending_turns(make_blueprint):
+    app = ChatServer(make_blueprint())
+    app.sessions.get("a")
+
+    async def run():
+        turn = asyncio.ensure_future(
+            request(app, "POST", "/sessions/a/turns", {"input": "I'm nathan"})
+        )
+        await asyncio.sleep(0)
+        await app.shutdown()
+        rejected = await request(app, "POST", "/sessions/a/turns", {"input": "42"})
+        return await turn, rejected
+
+    (status, _), (rejected_status, rejected) = asyncio.run(run())
+    assert status == 200
+    assert rejected_status == 503
+    assert app.running == app.waiting == 0
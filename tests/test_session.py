@@ -0,0 +1,74 @@
+from langchain.callbacks.base import BaseCallbackHandler
+
+from lib.conversation_memory import ConversationMemory
+from lib.session import SessionManager
+
+
+def test_conversation_memories_are_not_shared():
+    a, b = ConversationMemory(), ConversationMemory()
+    a.kv_store.set("first_name", "Nathan")
+    a.history.save_context({"input": "Hi"}, {"response": "Hello"})
+    assert b.kv_store.get("first_name") is None
+    assert b.history.buffer == []
+
+
+def test_conversation_memory_clear_clears_history():
+    memory = ConversationMemory()
+    memory.history.save_context({"input": "Hi"}, {"response": "Hello"})
+    memory.clear()
+    assert memory.history.buffer == []
+
+
+def test_new_session_shares_configuration_but_not_memory(make_process_chain):
+    chain = make_process_chain()
+    session = chain.new_session()
+    assert session.memory is not chain.memory
+    assert session.chains[0].chains is chain.chains[0].chains
+    assert session.chains[2].prompt is chain.chains[2].prompt
+    assert session.chains[1].memory is session.memory
+    assert session.chains[2].memory is session.memory
+
+
+def test_session_callbacks_are_not_shared(make_process_chain):
+    chain = make_process_chain()
+    a, b = chain.new_session(), chain.new_session()
+    handler = BaseCallbackHandler()
+    a.set_callbacks([handler])
+    assert all(c.callbacks == [handler] for c in a.chains)
+    assert all(c.callbacks != [handler] for c in b.chains)
+    assert all(c.callbacks != [handler] for c in chain.chains)
+
+
+def test_sessions_are_isolated(make_process_chain):
+    manager = SessionManager(make_process_chain())
+    manager.run("a", "I'm nathan")
+    manager.run("b", "I'm jenny")
+    assert manager.get("a").chain.memory.kv_store.get("first_name") == "Nathan"
+    assert manager.get("b").chain.memory.kv_store.get("first_name") == "Jenny"
+    assert manager.chain.memory.kv_store.get("first_name") is None
+
+    manager.reset("a")
+    assert manager.get("a").chain.memory.kv_store.get("first_name") is None
+    assert manager.get("b").chain.memory.kv_store.get("first_name") == "Jenny"
+
+
+def test_least_recently_used_session_is_evicted(make_process_chain):
+    manager = SessionManager(make_process_chain(), max_sessions=2)
+    manager.get("a")
+    manager.get("b")
+    manager.get("a")
+    manager.get("c")
+    assert "a" in manager and "c" in manager
+    assert "b" not in manager
+    assert len(manager) == 2
+
+
+def test_blueprint_sessions_share_compiled_chains(make_blueprint):
+    blueprint = make_blueprint()
+    a, b = blueprint.new_session(), blueprint.new_session()
+    assert a.chains[0].chains is b.chains[0].chains
+    assert a.memory is not b.memory
+
+    manager = SessionManager(blueprint)
+    assert manager.run("a", "I'm nathan")["variables"]["first_name"] == "Nathan"
+    assert blueprint.chain.memory.kv_store.get("first_name") is None
@@ -0,0 +1,54 @@
+import datetime
+
+import pytest
+
+from lib.availability.slot_index import Slot, SlotIndex
+
+MONDAY = datetime.datetime(2023, 6, 19)
+
+
+def at(day: int, hour: int) -> datetime.datetime:
+    return MONDAY + datetime.timedelta(days=day, hours=hour)
+
+
+@pytest.fixture
+def index() -> SlotIndex:
+    return SlotIndex(
+        [at(0, 9), at(0, 14), Slot(at(0, 14), "bob"), at(1, 10), at(3, 16), at(0, 9)]
+    )
+
+
+def test_between(index):
+    assert len(index) == 5
+    assert index.between(at(0, 0), at(1, 0)) == [
+        Slot(at(0, 9)),
+        Slot(at(0, 14)),
+        Slot(at(0, 14), "bob"),
+    ]
+    # The end is excluded
+    assert index.between(at(0, 9), at(0, 14)) == [Slot(at(0, 9))]
+    assert index.between(at(0, 0), at(1, 0), resource="bob") == [Slot(at(0, 14), "bob")]
+    assert index.between(at(2, 0), at(3, 0)) == []
+
+
+def test_nearest(index):
+    assert index.nearest(at(2, 12), count=2) == [Slot(at(1, 10)), Slot(at(3, 16))]
+    assert index.nearest(at(0, 13), count=3) == [
+        Slot(at(0, 9)),
+        Slot(at(0, 14)),
+        Slot(at(0, 14), "bob"),
+    ]
+    assert index.nearest(at(5, 0), count=1, resource="bob") == [Slot(at(0, 14), "bob")]
+    assert SlotIndex().nearest(at(0, 0)) == []
+
+
+def test_add_and_remove(index):
+    index.add(at(2, 8))
+    index.add(at(2, 8))
+    assert at(2, 8) in index
+    assert index.between(at(2, 0), at(3, 0)) == [Slot(at(2, 8))]
+    index.remove(at(2, 8))
+    assert at(2, 8) not in index
+    with pytest.raises(KeyError):
+        index.remove(at(2, 8))
+    assert len(index) == 5
@@ -0,0 +1,38 @@
+from lib.streaming import StreamingTurn
+from lib.session import SessionManager
+from conftest import FakeChatLLM
+
+
+def test_streaming_turn_yields_response_tokens(make_process_chain):
+    chain = make_process_chain(chat_llm=FakeChatLLM(streaming=True))
+    turn = StreamingTurn(chain, "I'm nathan")
+    tokens = list(turn)
+    assert tokens == ["You ", "said ", "I'm ", "nathan"]
+    assert "".join(tokens) == turn.inference["response"]
+    assert turn.inference["variables"]["first_name"] == "Nathan"
+
+
+def test_history_is_saved_once_the_stream_is_over(make_process_chain):
+    history_sizes = []
+    chain = make_process_chain()
+    chain.chains[2].llm = FakeChatLLM(
+        streaming=True,
+        on_token=lambda _: history_sizes.append(len(chain.memory.history.buffer)),
+    )
+    list(StreamingTurn(chain, "hey"))
+    assert history_sizes == [0, 0, 0]
+    assert len(chain.memory.history.buffer) == 2
+
+
+def test_non_streaming_llm_yields_whole_response(make_process_chain):
+    turn = StreamingTurn(make_process_chain(), "hey")
+    assert list(turn) == ["You said hey"]
+
+
+def test_streaming_turns_of_sessions_are_isolated(make_blueprint):
+    manager = SessionManager(make_blueprint(chat_llm=FakeChatLLM(streaming=True)))
+    tokens = list(StreamingTurn(manager.get("a"), "I'm nathan"))
+    assert tokens == ["You ", "said ", "I'm ", "nathan"]
+    list(StreamingTurn(manager.get("b"), "I'm jenny"))
+    assert manager.get("a").chain.memory.kv_store.get("first_name") == "Nathan"
+    assert manager.get("b").chain.memory.kv_store.get("first_name") == "Jenny"
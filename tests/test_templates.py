@@ -0,0 +1,13 @@
+from lib.templates import get_template, render
+
+
+def test_get_template_compiles_once_per_source_and_options():
+    source = "{% if a %}\n  {{ a }}\n{% endif %}"
+    assert get_template(source) is get_template(source)
+    assert get_template(source, trim_blocks=True) is get_template(source, trim_blocks=True)
+    assert get_template(source) is not get_template(source, trim_blocks=True)
+    assert get_template(source, trim_blocks=True, lstrip_blocks=True).render(a=1) == "  1\n"
+
+
+def test_render():
+    assert render("Hello {{ name }}", name="Bob") == "Hello Bob"
@@ -1,4 +1,6 @@
+import asyncio
 import json
+import threading
 from typing import List, Optional
 
 import pytest
@@ -6,6 +8,7 @@ from lib.conversation_memory import ConversationMemory
 from lib.process.validation_chain import ProcessValidationChain
 from pydantic import BaseModel, root_validator, validator
 from lib.process.schemas import Process
+from lib.ner.entities.basic_entities import Entity, IntEntity
 import sys
 
 
@@ -37,6 +40,35 @@ def test_validation_chain_validate_output():
     output = chain.validate(inputs={"entities": entities})
     assert output["variables"]["errors"] == {"first_name": "Some error"}
 
+validation_threads = []
+
+
+class BlockingProcess(Process):
+    first_name: Optional[str] = None
+
+    @root_validator()
+    def record_thread(cls, values: dict) -> dict:
+        validation_threads.append(threading.current_thread().name)
+        return values
+
+
+def test_async_validation_runs_off_the_event_loop():
+    chain = ProcessValidationChain(
+        input_variables=["entities"],
+        output_variables=["variables", "result"],
+        process=BlockingProcess,
+        memory=ConversationMemory(),
+    )
+    entities = json.dumps([{"name": "first_name", "value": "Nathan"}])
+
+    async def run():
+        return await chain.acall({"entities": entities}), threading.current_thread().name
+
+    output, loop_thread = asyncio.run(run())
+    assert output["variables"]["first_name"] == "Nathan"
+    assert validation_threads and loop_thread not in validation_threads
+
+
 @pytest.mark.parametrize(
     "after, before, expected",
     [
@@ -79,4 +111,81 @@ def test_dict_diff(after, before, expected):
         process=MyProcess,
         memory=ConversationMemory(),
     )
-    assert set(chain.variables_diff(before, after)) == set(expected)
\ No newline at end of file
+    assert set(chain.variables_diff(before, after)) == set(expected)
+
+GREETING_CALLS = []
+
+
+class FormProcess(Process):
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    greeting: Optional[str] = None
+    age: Optional[int] = None
+
+    @validator("first_name", "last_name")
+    def capitalize(cls, v):
+        assert v[0].isalpha(), "Names must start with a letter."
+        return v.capitalize()
+
+    @root_validator()
+    def set_greeting(cls, values: dict) -> dict:
+        GREETING_CALLS.append(values)
+        if values.get("first_name") and values.get("last_name"):
+            values["greeting"] = f"Hello {values['first_name']} {values['last_name']}"
+        return values
+
+
+class IncrementalFormProcess(FormProcess):
+    incremental_validation = True
+    dependencies = {"set_greeting": ["first_name", "last_name"]}
+
+
+def run_turns(process, turns):
+    chain = ProcessValidationChain(
+        input_variables=["entities"],
+        output_variables=["variables", "result"],
+        process=process,
+        memory=ConversationMemory(),
+    )
+    outputs = []
+    for entities in turns:
+        output = chain.validate(inputs={"entities": json.dumps(entities)})
+        diff = sorted(output["diff"], key=lambda d: d["name"])
+        outputs.append((dict(output["variables"]), diff, output["result"]))
+    return outputs
+
+
+TURNS = [
+    [{"name": "first_name", "value": "john"}],
+    [{"name": "age", "value": "42"}],
+    [{"name": "last_name", "value": "1doe"}],
+    [{"name": "last_name", "value": "doe"}, {"name": "age", "value": 43}],
+    [{"name": "first_name", "value": "John"}],
+]
+
+
+def test_incremental_validation_matches_full_validation():
+    assert run_turns(IncrementalFormProcess, TURNS) == run_turns(FormProcess, TURNS)
+
+
+def test_incremental_validation_skips_root_validators_of_unchanged_inputs():
+    GREETING_CALLS.clear()
+    run_turns(IncrementalFormProcess, TURNS)
+    # Not run when only the age changed, nor when the first name is given again
+    assert len(GREETING_CALLS) == 3
+
+
+def test_validation_chain_takes_entity_objects():
+    chain = ProcessValidationChain(
+        input_variables=["entities"],
+        output_variables=["variables", "result"],
+        process=FormProcess,
+        memory=ConversationMemory(),
+    )
+    entities = [Entity(name="first_name", value="john"), IntEntity(name="age", value="42")]
+    output = chain.validate(inputs={"entities": entities})
+    assert output["variables"]["first_name"] == "John"
+    assert output["variables"]["age"] == 42
+
+    with pytest.raises(ValueError):
+        chain.validate(inputs={"entities": "not json"})
@@ -0,0 +1,107 @@
+import asyncio
+import concurrent.futures
+import time
+from collections import Counter
+
+import pytest
+
+from conftest import chain_config
+from lib.process.blueprint import ProcessChainBlueprint
+from lib.workers import HashRing, WorkerError, WorkerPool
+
+
+def make_form_blueprint() -> ProcessChainBlueprint:
+    return ProcessChainBlueprint(**chain_config())
+
+
+def test_hash_ring_spreads_keys():
+    ring = HashRing(range(4))
+    counts = Counter(ring.node(f"session-{i}") for i in range(4000))
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 600
+
+
+def test_hash_ring_only_moves_keys_to_or_from_the_changed_node():
+    ring = HashRing(range(3))
+    keys = [f"session-{i}" for i in range(1000)]
+    before = {key: ring.node(key) for key in keys}
+
+    ring.add(3)
+    after = {key: ring.node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == 3 for key in moved)
+    assert 150 < len(moved) < 350
+
+    ring.remove(3)
+    assert {key: ring.node(key) for key in keys} == before
+
+
+def test_sessions_are_handed_off_when_workers_change():
+    with WorkerPool(make_form_blueprint, workers=1) as pool:
+        sessions = [f"session-{i}" for i in range(8)]
+        for session_id in sessions:
+            pool.run(session_id, "I'm nathan")
+
+        pool.add_worker()
+        assert set(pool.locations.values()) == {0, 1}
+        outputs = [pool.run(session_id, "42") for session_id in sessions]
+        assert all(output["result"]["status"] == "completed" for output in outputs)
+
+        pool.remove_worker(0)
+        assert set(pool.locations.values()) == {1}
+        output = pool.run(sessions[0], "I'm jenny")
+        assert output["response"] == "You said I'm jenny"
+
+
+def failing_blueprint() -> ProcessChainBlueprint:
+    raise RuntimeError("Cannot build the blueprint")
+
+
+def test_turns_fail_when_workers_die():
+    with WorkerPool(failing_blueprint, workers=1) as pool:
+        with pytest.raises(WorkerError):
+            pool.run("session-0", "I'm nathan")
+        assert len(pool) == 0 and len(pool.ring) == 0
+
+
+def test_dead_workers_leave_the_ring():
+    with WorkerPool(make_form_blueprint, workers=2) as pool:
+        sessions = [f"session-{i}" for i in range(8)]
+        for session_id in sessions:
+            pool.run(session_id, "I'm nathan")
+        pool.processes[0].kill()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with pool._lock:
+                if pool.ring.nodes == {1}:
+                    break
+            time.sleep(0.05)
+
+        with pool._lock:
+            assert pool.ring.nodes == {1}
+            assert set(pool.locations.values()) == {1}
+        outputs = [pool.run(session_id, "42") for session_id in sessions]
+        assert all(output["response"] == "You said 42" for output in outputs)
+
+
+def test_turns_time_out():
+    with WorkerPool(make_form_blueprint, workers=1) as pool:
+        with pytest.raises(concurrent.futures.TimeoutError):
+            pool.run("session-0", "I'm nathan", timeout=0)
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(pool.arun("session-1", "I'm nathan", timeout=0))
+        # The late responses of the turns do not break the later turns
+        output = pool.run("session-1", "42", timeout=10)
+        assert output["response"] == "You said 42"
+
+
+def test_locations_follow_the_evictions_of_the_workers():
+    with WorkerPool(make_form_blueprint, workers=1, max_sessions=2) as pool:
+        for i in range(4):
+            pool.run(f"session-{i}", "I'm nathan")
+        assert set(pool.locations) == {"session-2", "session-3"}
+
+        pool.add_worker()
+        assert len(pool.locations) <= 2
+        output = pool.run("session-3", "42")
+        assert output["result"]["status"] == "completed"